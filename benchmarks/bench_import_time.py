@@ -0,0 +1,90 @@
+"""
+Startup benchmark based on "python -X importtime".
+
+Imports each target in a fresh interpreter, reports the cumulative import time of the target module
+and the slowest modules it pulled in, and optionally fails when "import karen" exceeds a time budget or
+a target loads one of the OPTIONAL modules so it can be used as a check in a build pipeline (build.sh).
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs N] [--top N] [--budget MS]
+"""
+
+import os, sys, subprocess, argparse
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+TARGETS = [
+    ("karen", "import karen"),                                     # CLI path (karen.run --version)
+    ("karen.shared", "import karen.shared"),
+    ("karen.templates", "import karen.templates")
+]
+
+OPTIONAL = ["asyncio", "orjson", "ujson"] # Only needed by server_mode="asyncio" or loaded by the JSON codec on first use
+
+def importTimes(statement):
+    """
+    Runs a statement in a new interpreter with -X importtime.
+
+    Returns:
+        (list):  (module, self microseconds, cumulative microseconds, nesting level) for each import in the order reported.
+    """
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC + (os.pathsep + env["PYTHONPATH"] if "PYTHONPATH" in env else "")
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+
+    ret = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        selfTime, cumulative, module = line[len("import time:"):].split("|")
+        ret.append((module.strip(), int(selfTime), int(cumulative), (len(module) - len(module.lstrip()) - 1) // 2))
+
+    return ret
+
+def subtree(times, name):
+    """
+    Returns the target module and the imports it triggered (reported just before it with a deeper nesting level).
+    """
+
+    idx = [i for i, x in enumerate(times) if x[0] == name and x[3] == 0][0]
+    start = idx
+    while start > 0 and times[start-1][3] > 0:
+        start -= 1
+
+    return times[start:idx+1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure karen import time with -X importtime")
+    parser.add_argument("--runs", type=int, default=5, help="Interpreter runs per target (the fastest is reported)")
+    parser.add_argument("--top", type=int, default=8, help="Number of slowest imports to list per target")
+    parser.add_argument("--budget", type=float, default=None, help="Exit with an error if \"import karen\" takes longer than this many milliseconds or an optional module is loaded")
+    ARGS = parser.parse_args()
+
+    failed = False
+    for name, statement in TARGETS:
+        best = None
+        for i in range(ARGS.runs):
+            times = subtree(importTimes(statement), name)
+            total = times[-1][2]
+            if best is None or total < best[0]:
+                best = (total, times)
+
+        print("%-16s %8.1f ms" % (name, best[0] / 1000.0))
+        for module, selfTime, cumulative, level in sorted(best[1], key=lambda x: x[2], reverse=True)[1:ARGS.top+1]:
+            print("    %-40s %8.1f ms" % (module, cumulative / 1000.0))
+
+        loaded = [x for x in OPTIONAL if x in [y[0] for y in best[1]]]
+        if ARGS.budget is not None and len(loaded) > 0:
+            print("FAILED: import %s loaded %s" % (name, ", ".join(loaded)))
+            failed = True
+
+        if name == "karen" and ARGS.budget is not None and best[0] / 1000.0 > ARGS.budget:
+            print("FAILED: import karen took %.1f ms (budget %.1f ms)" % (best[0] / 1000.0, ARGS.budget))
+            failed = True
+
+    sys.exit(1 if failed else 0)
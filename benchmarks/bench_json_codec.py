@@ -0,0 +1,68 @@
+"""
+Microbenchmark for the JSON codecs used by the HTTP stack.
+
+Compares the previous path (json.dumps(...).encode() on send, res.json() called twice on receive)
+against karen.shared.jsonDumps/jsonLoads for each installed codec (orjson, ujson, json) on a
+typical /brain/collect payload and a container status payload.
+
+Usage:
+    python benchmarks/bench_json_codec.py [iterations]
+"""
+
+import os, sys, json, timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from karen import shared
+
+COLLECT = {
+    "type": "BATCH",
+    "data": [
+        { "type": "AUDIO_INPUT", "data": "what is the weather like in the living room today" },
+        { "type": "STATUS", "data": { "listener": "ready", "speaker": "idle", "volume": 0.85 } },
+        { "type": "IMAGE_INPUT", "data": { "faces": [ { "name": "unknown", "box": [12, 48, 96, 150], "confidence": 0.9123 } ] * 4 } }
+    ]
+}
+
+STATUS = {
+    "http://192.168.0.%d:8080" % i: {
+        "device-%02d-%d" % (i, j): {
+            "id": "device-%02d-%d" % (i, j),
+            "type": "karen_listener.Listener",
+            "accepts": ["start","stop","upgrade","audioOutStart","audioOutEnd"],
+            "active": True,
+            "version": "0.7.1",
+            "groupName": "living room"
+        } for j in range(4)
+    } for i in range(10, 30)
+}
+
+def legacyRoundTrip(payload):
+    body = json.dumps(payload).encode()
+    obj = json.loads(body)
+    if "error" in obj:
+        pass
+    return json.loads(body) # res.json() was called a second time for the return value
+
+def codecRoundTrip(payload):
+    return shared.jsonLoads(shared.jsonDumps(payload))
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    codecs = [x for x in ["orjson", "ujson", "json"] if shared.isJSONCodecAvailable(x)]
+
+    for name, payload in [("collect", COLLECT), ("status", STATUS)]:
+        print("%s payload (%d bytes)" % (name, len(shared.jsonDumps(payload))))
+
+        legacy = min(timeit.repeat(lambda: legacyRoundTrip(payload), number=iterations, repeat=5))
+        print("  %-8s %8.2f us/round trip" % ("legacy", legacy / iterations * 1e6))
+
+        for codec in codecs:
+            shared.setJSONCodec(codec)
+            assert codecRoundTrip(payload) == payload
+
+            t = min(timeit.repeat(lambda: codecRoundTrip(payload), number=iterations, repeat=5))
+            print("  %-8s %8.2f us/round trip (%.2fx)" % (codec, t / iterations * 1e6, legacy / t))
+
+    shared.setJSONCodec()
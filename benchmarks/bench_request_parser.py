@@ -0,0 +1,85 @@
+"""
+Microbenchmark for inbound HTTP request parsing.
+
+Compares the previous KHTTPHandler approach (BaseHTTPRequestHandler.parse_request over a buffered
+file, urlparse twice, cgi.parse_header on several headers and a split("=") cookie loop) against
+karen.shared.parseHTTPRequestHead.
+
+Usage:
+    python benchmarks/bench_request_parser.py [iterations]
+"""
+
+import os, sys, io, timeit
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from karen.shared import parseHTTPRequestHead
+
+REQUEST = (
+    b"POST /brain/collect?source=listener&seq=42 HTTP/1.1\r\n"
+    b"Host: 192.168.0.10:8080\r\n"
+    b"User-Agent: python-requests/2.26.0\r\n"
+    b"Accept-Encoding: gzip, deflate\r\n"
+    b"Accept: */*\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Cookie: token=ac2f81b0-6eaf-4726-8ede-e45bbc85ecb2\r\n"
+    b"Content-Type: application/json\r\n"
+    b"X-ORIGIN: http://192.168.0.11:8081\r\n"
+    b"X-GROUP: living room\r\n"
+    b"Content-Length: 44\r\n"
+    b"\r\n"
+)
+
+class LegacyParser(BaseHTTPRequestHandler):
+    def __init__(self, data):
+        self.rfile = io.BytesIO(data)
+        self.raw_requestline = self.rfile.readline()
+        self.parse_request()
+
+        self.getVars = parse_qs(urlparse(self.path).query)
+        self.path = urlparse(self.path).path
+
+        self.isJSON = parse_header(self.headers.get("content-type"))[0] == "application/json"
+        self.origin = parse_header(self.headers.get("x-origin"))[0]
+        self.groupName = parse_header(self.headers.get("x-group"))[0]
+
+        self.authenticated = False
+        for item in self.headers.get("cookie").split(";"):
+            (key, keyVal) = item.split("=")
+            if key == "token" and keyVal == "ac2f81b0-6eaf-4726-8ede-e45bbc85ecb2":
+                self.authenticated = True
+
+try:
+    from cgi import parse_header
+except ImportError:
+    from email.message import Message
+
+    def parse_header(line):
+        # cgi is removed in Python 3.13; this is the replacement suggested by PEP 594
+        msg = Message()
+        msg["content-type"] = line
+        return msg.get_content_type(), msg.get_params()[1:]
+
+def parseNew():
+    req = parseHTTPRequestHead(REQUEST)
+    req["headers"].get("content-type").split(";",1)[0].strip().lower() == "application/json"
+    req["headers"].get("x-origin").split(";",1)[0].strip()
+    req["headers"].get("x-group").split(";",1)[0].strip()
+    return req["cookies"].get("token") == "ac2f81b0-6eaf-4726-8ede-e45bbc85ecb2"
+
+def parseLegacy():
+    return LegacyParser(REQUEST).authenticated
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    assert parseNew() and parseLegacy()
+
+    legacy = min(timeit.repeat(parseLegacy, number=iterations, repeat=5))
+    new = min(timeit.repeat(parseNew, number=iterations, repeat=5))
+
+    print("legacy parse_request: %8.2f us/request" % (legacy / iterations * 1e6))
+    print("parseHTTPRequestHead: %8.2f us/request" % (new / iterations * 1e6))
+    print("speedup:              %8.2fx" % (legacy / new))
@@ -0,0 +1,99 @@
+"""
+TLS handshake benchmark for the container's HTTPS listener.
+
+Starts a Container with a temporary self-signed certificate (created with the openssl command) and
+measures handshakes per second for:
+
+  - a new client SSLContext per connection (what urllib3 did for sendHTTPRequest, always a full handshake)
+  - karen.shared.getTLSClientContext() (shared context offering the previous TLS session for resumption)
+
+Both are repeated while a number of clients hold connections open without sending a ClientHello, which
+previously blocked the accept thread (ssl.wrap_socket on the listener) and now only occupies workers.
+
+Usage:
+    python benchmarks/bench_tls_handshake.py [connections] [stalled clients]
+"""
+
+import os, sys, ssl, socket, time, shutil, tempfile, subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from karen import shared
+from karen.templates import Container
+
+def createCertificate(folder):
+    certFile = os.path.join(folder, "cert.pem")
+    keyFile = os.path.join(folder, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-keyout", keyFile, "-out", certFile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return certFile, keyFile
+
+def newContext():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+def handshakes(address, count, getContext):
+    """
+    Connects, completes the handshake and closes the connection count times.
+
+    Returns:
+        (tuple):  (handshakes per second, connections that resumed a session)
+    """
+
+    resumed = 0
+    start = time.perf_counter()
+    for i in range(count):
+        conn = getContext().wrap_socket(socket.create_connection(address), server_hostname="localhost")
+        if conn.session_reused:
+            resumed += 1
+
+        conn.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        while conn.recv(65536):
+            pass # Reading the response also receives the TLS 1.3 session ticket
+
+        conn.close()
+
+    return count / (time.perf_counter() - start), resumed
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stalledCount = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    if shutil.which("openssl") is None:
+        print("The openssl command is required to create a test certificate.")
+        sys.exit(1)
+
+    folder = tempfile.mkdtemp()
+    try:
+        certFile, keyFile = createCertificate(folder)
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        container = Container(tcp_port=port, hostname="127.0.0.1", ssl_cert_file=certFile, ssl_key_file=keyFile, authentication={}, pool_size=stalledCount + 4,
+                              brain_cache_file=None) # Leaves ~/.karen untouched
+        container.isBrain = True # Only serves requests; no registration thread
+        container.start()
+        time.sleep(0.5)
+
+        address = ("127.0.0.1", port)
+        for stalled in [0, stalledCount]:
+            clients = [socket.create_connection(address) for i in range(stalled)] # Connected but never start the handshake
+
+            rate, resumed = handshakes(address, count, newContext)
+            print("%d stalled client(s)  new context:    %8.1f handshakes/s (%d resumed)" % (stalled, rate, resumed))
+
+            rate, resumed = handshakes(address, count, shared.getTLSClientContext)
+            print("%d stalled client(s)  shared context: %8.1f handshakes/s (%d resumed)" % (stalled, rate, resumed))
+
+            for client in clients:
+                client.close()
+
+        container.stop()
+        container.wait()
+    finally:
+        shutil.rmtree(folder)
@@ -1,5 +1,6 @@
 #!/bin/sh
 
+python3 benchmarks/bench_import_time.py --top 0 --budget 50 || exit 1
 pandoc --from=markdown --to=rst --output=README.rst README.md
 rm dist/*.*
 python3 setup.py sdist bdist_wheel
\ No newline at end of file
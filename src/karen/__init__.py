@@ -8,8 +8,6 @@ Created on July 12, 2020
 
 import os, sys
 import logging 
-import json 
-import uuid
 import shutil 
 
 # version as tuple for simple comparisons 
@@ -21,16 +19,40 @@ __app_name__ = "Project Karen"
 # Imports for built-in features
 #from .listener import Listener
 #from .speaker import Speaker
-try:
-    from karen_device import DeviceContainer
-except:
-    pass 
 
-try:
-    from karen_brain import Brain
-    from karen_brain.skillmanager import Skill, SkillManager
-except:
-    pass
+# Plugin classes are imported on first access so "import karen" (and the CLI) doesn't load them
+_lazyImports = {
+        "DeviceContainer": "karen_device",
+        "Brain": "karen_brain",
+        "Skill": "karen_brain.skillmanager",
+        "SkillManager": "karen_brain.skillmanager"
+    }
+
+def __getattr__(name):
+    """
+    Imports the plugin classes (DeviceContainer, Brain, Skill, SkillManager) when they are first used.
+    
+    Args:
+        name (str):  The attribute requested from the karen module.
+        
+    Returns:
+        (object):  The imported class.
+    """
+    
+    if name in _lazyImports:
+        import importlib
+        try:
+            value = getattr(importlib.import_module(_lazyImports[name]), name)
+        except Exception:
+            raise AttributeError("module 'karen' has no attribute '" + name + "' (" + _lazyImports[name] + " is not available)")
+        
+        globals()[name] = value # Cache so later lookups don't come back here
+        return value
+    
+    raise AttributeError("module 'karen' has no attribute '" + name + "'")
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazyImports.keys()))
 
 def _getImport(libs, val):
     """
@@ -59,7 +81,8 @@ def _getImport(libs, val):
 
 def start(configFile=None, log_level="info", log_file=None, overwriteConfig=True):
     """
-    Static method to start a new instance of karen based on a provided configuration file.
+    Static method to start a new instance of karen based on a provided configuration file.  A "restart" request rebuilds the brain and container in the
+    same process; the interpreter is only replaced after a package upgrade or when a Qt panel is in use.
     
     Args:
         configFile (str):  Path and Name of the JSON configuration file.
@@ -89,64 +112,76 @@ def start(configFile=None, log_level="info", log_file=None, overwriteConfig=True
         os.makedirs(os.path.dirname(localConfig), exist_ok=True)
         shutil.copyfile(configFile, localConfig) # Save for restart
     
-    brain = None
-    container = None 
-        
-    try:
-        from karen_brain import start as kbrain_start
-        brain = kbrain_start(configFile, log_level, log_file, x_wait=False)
-    except ModuleNotFoundError:
-        pass
-    
-    try:
-        from karen_device import start as kdevice_start
-        container = kdevice_start(configFile, log_level, log_file, x_wait=False)
-    except ModuleNotFoundError:
-        pass
-    
+    logger = logging.getLogger("RESTART")
     
-    if container is not None:
-        container.wait()
-        
-    if brain is not None:
-        brain.wait()
-        
-    if brain._doRestart or container._doRestart:
-        cmd = sys.executable + " " + " ".join(sys.argv)
-        
-        logger = logging.getLogger("RESTART")
+    while True:
+        brain = None
+        container = None 
+            
+        try:
+            from karen_brain import start as kbrain_start
+            brain = kbrain_start(configFile, log_level, log_file, x_wait=False)
+        except ModuleNotFoundError:
+            pass
         
-        import time
-        logger.info("Waiting for processes to close")
-        time.sleep(5)
-        logger.info("Restarting")
+        try:
+            from karen_device import start as kdevice_start
+            container = kdevice_start(configFile, log_level, log_file, x_wait=False)
+        except ModuleNotFoundError:
+            pass
         
-        myEnv = dict(os.environ)
-        #myEnv["GREPDB"] = cmd
-        #print(myEnv)
+        services = [x for x in [container, brain] if x is not None]
+        _waitForServices(services)
         
-        #del myEnv["GIO_LAUNCHED_DESKTOP_FILE_PID"]
-        #del myEnv["XDG_RUNTIME_DIR"]
-        #del myEnv["GPG_AGENT_INFO"]
+        if not any(x._doRestart for x in services):
+            break
         
-        #del myEnv["GDK_CORE_DEVICE_EVENTS"]
-        #del myEnv["GIO_LAUNCHED_DESKTOP_FILE_PID"]
-        #del myEnv["GIO_LAUNCHED_DESKTOP_FILE"]
-        #del myEnv["IDE_PROJECT_ROOTS"]
-        #del myEnv["LIBOVERLAY_SCROLLBAR"]
-        #del myEnv["OXYGEN_DISABLE_INNER_SHADOWS_HACK"]
-        #del myEnv["PYDEV_COMPLETER_PYTHONPATH"]
-        #del myEnv["PYDEVD_SHOW_COMPILE_CYTHON_COMMAND_LINE"]
-        #del myEnv["PYTHONIOENCODING"]
-        #del myEnv["PYTHONPATH"]
-        #del myEnv["PYTHONUNBUFFERED"]
-        #del myEnv["QT_QPA_FONTDIR"]
+        from .shared import upgradedPackages
+        if len(upgradedPackages) > 0 or any(getattr(x, "app", None) is not None for x in services):
+            # Upgraded code and Qt applications can only be reloaded by a new interpreter
+            logger.info("Restarting")
+            _restartProcess()
         
-        if "QT_QPA_PLATFORM_PLUGIN_PATH" in myEnv:
-            del myEnv["QT_QPA_PLATFORM_PLUGIN_PATH"]    
+        logger.info("Restarting (in-process)")
+        if overwriteConfig and os.path.isfile(localConfig):
+            configFile = localConfig # Pick up any configuration saved while running
+
+def _waitForServices(services):
+    """
+    Waits for the brain and/or container to stop.  When one of them stops for a restart the others are stopped as well.
+    
+    Args:
+        services (list):  The running brain and container objects.
+    """
+    
+    if any(getattr(x, "app", None) is not None for x in services):
+        for item in services:
+            item.wait() # Qt event loop has to run on this thread
         
-        #myEnv = {"QT_DEBUG_PLUGINS": "offscreen", "DISPLAY": str(os.environ["DISPLAY"]), 'GREPDB': cmd }
+        return
+    
+    while len(services) > 0 and all(x._thread is not None and x._thread.is_alive() for x in services):
+        for item in services:
+            item._thread.join(0.5 / len(services))
+    
+    for item in services:
+        if item.isRunning():
+            if any(x._doRestart for x in services):
+                item._doRestart = True
+                item.stop()
         
-        import subprocess
-        subprocess.Popen(cmd, shell=True, stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin,
-            env=myEnv)
+        item.wait() # Returns once the server thread has exited (and the port is released)
+
+def _restartProcess():
+    """
+    Replaces the current process with a new interpreter using the original command line.
+    """
+    
+    myEnv = dict(os.environ)
+    
+    if "QT_QPA_PLATFORM_PLUGIN_PATH" in myEnv:
+        del myEnv["QT_QPA_PLATFORM_PLUGIN_PATH"]    
+    
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execve(sys.executable, [sys.executable] + sys.argv, myEnv)
@@ -5,21 +5,24 @@ Shared library of functions used throughout Karen's various modules
 import time 
 import json
 import threading 
-from http.server import BaseHTTPRequestHandler 
-from urllib.parse import parse_qs, urlparse, urlencode
-from cgi import parse_header, parse_multipart
+from urllib.parse import parse_qs, urlparse, urlencode, unquote
 import socket
 import logging 
-import urllib3 
-import requests 
 import sys
 import traceback 
 import os
-import subprocess
 import queue
+import collections
+import zlib
+import heapq
+import random
+import re
 from errno import ENOPROTOOPT
 from email.utils import formatdate
 
+orjson = None # Optional JSON libraries, imported by setJSONCodec() when first selected
+ujson = None
+
 def dayPart():
     """
     Returns the part of the day based on the system time based on generally acceptable breakpoints.
@@ -47,17 +50,32 @@ def dayPart():
         # Night fills in everything else (9pm to 4am)
         return "night"
 
-def getIPAddress(iface=None):
+def threaded(fn):
     """
-    Get IP address from specified interface.
+    Thread wrapper shortcut using @threaded prefix
     
     Args:
-        iface (str): Interface name like 'eth0'.
+        fn (function):  The function to executed on a new thread.
         
     Returns:
-        (str): IP address of interface.
+        (thread):  New thread for executing function.
     """
-    
+
+    def wrapper(*args, **kwargs):
+        thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    return wrapper
+
+_ipAddresses = {}                   # interface name (None for the first non-loopback interface) => cached IPv4 address
+_ipAddressLock = threading.Lock()
+_ipAddressWatchers = []             # (callback, interface name) notified when a cached address changes
+_ipAddressMonitor = None            # Event that stops the thread polling for address changes
+_ipAddressPollInterval = 30
+
+def _readIPAddress(iface=None):
     import netifaces
     if iface is None:
         
@@ -80,24 +98,440 @@ def getIPAddress(iface=None):
                 
                 return str(addr["addr"])
 
-def threaded(fn):
+def _interfaceSignature():
     """
-    Thread wrapper shortcut using @threaded prefix
+    Returns a cheap fingerprint of the host's addresses (a checksum of /proc/net/fib_trie on Linux).
+    
+    Returns:
+        (int):  The checksum or None if the platform does not provide one.
+    """
+    
+    try:
+        with open("/proc/net/fib_trie", "rb") as f:
+            return zlib.crc32(f.read())
+    except OSError:
+        return None
+
+def getIPAddress(iface=None, refresh=False):
+    """
+    Get IP address from specified interface.  The address is cached; watchIPAddress() keeps the cache current.
     
     Args:
-        fn (function):  The function to executed on a new thread.
+        iface (str): Interface name like 'eth0'.
+        refresh (bool): Read the address from the interface instead of the cache.
         
     Returns:
-        (thread):  New thread for executing function.
+        (str): IP address of interface.
     """
+    
+    with _ipAddressLock:
+        if not refresh and iface in _ipAddresses:
+            return _ipAddresses[iface]
+    
+    address = _readIPAddress(iface)
+    with _ipAddressLock:
+        _ipAddresses[iface] = address
+    
+    return address
 
-    def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
-        thread.daemon = True
-        thread.start()
-        return thread
+def refreshIPAddresses():
+    """
+    Reads the cached interface addresses again and notifies the watchers of any that changed.
+    
+    Returns:
+        (dict):  Interface name => (old address, new address) for each changed address.
+    """
+    
+    with _ipAddressLock:
+        cached = dict(_ipAddresses)
+    
+    changed = {}
+    for iface in cached:
+        address = _readIPAddress(iface)
+        if address != cached[iface]:
+            changed[iface] = (cached[iface], address)
+    
+    with _ipAddressLock:
+        for iface in changed:
+            _ipAddresses[iface] = changed[iface][1]
+        
+        watchers = list(_ipAddressWatchers)
+    
+    logger = logging.getLogger("NETWORK")
+    for iface in changed:
+        logger.info("Address of " + str(iface if iface is not None else "default interface") + " changed from " + str(changed[iface][0]) + " to " + str(changed[iface][1]))
+        for callback, watched in watchers:
+            if watched == iface:
+                try:
+                    callback(changed[iface][1], changed[iface][0])
+                except Exception:
+                    logger.error(str(traceback.format_exc()))
+    
+    return changed
+
+@threaded
+def _monitorIPAddresses(stopEvent):
+    signature = _interfaceSignature()
+    while not stopEvent.wait(_ipAddressPollInterval):
+        current = _interfaceSignature()
+        if current is None or current != signature: # Without a fingerprint the interfaces are read on every poll
+            signature = current
+            refreshIPAddresses()
+
+def watchIPAddress(callback, iface=None, interval=None):
+    """
+    Calls a function whenever the address of an interface changes (e.g. a new DHCP lease).  A background thread checks for changes while watchers exist.
+    
+    Args:
+        callback (function):  Called with the new and the old address.
+        iface (str):  Interface name like 'eth0' (None for the address returned by getIPAddress()).
+        interval (float):  Seconds between checks (applies to all watchers).
+        
+    Returns:
+        (str):  The current address of the interface.
+    """
+    
+    global _ipAddressMonitor, _ipAddressPollInterval
+    
+    address = getIPAddress(iface)
+    with _ipAddressLock:
+        if interval is not None:
+            _ipAddressPollInterval = interval
+        
+        _ipAddressWatchers.append((callback, iface))
+        if _ipAddressMonitor is None:
+            _ipAddressMonitor = threading.Event()
+            _monitorIPAddresses(_ipAddressMonitor)
+    
+    return address
 
-    return wrapper
+def unwatchIPAddress(callback):
+    """
+    Stops calling a function registered with watchIPAddress().  The background thread exits when no watchers remain.
+    
+    Args:
+        callback (function):  The function passed to watchIPAddress().
+    """
+    
+    global _ipAddressMonitor
+    
+    with _ipAddressLock:
+        _ipAddressWatchers[:] = [x for x in _ipAddressWatchers if x[0] != callback]
+        if len(_ipAddressWatchers) == 0 and _ipAddressMonitor is not None:
+            _ipAddressMonitor.set()
+            _ipAddressMonitor = None
+
+class WorkerPool(object):
+    """
+    Bounded pool of reusable worker threads fed from a fixed-size queue.
+    """
+
+    def __init__(self, size=10, queueSize=50, overflow="reject", name="WORKER"):
+        """
+        Worker Pool Initialization
+
+        Args:
+            size (int):  Maximum number of worker threads.  Threads are created on demand up to this limit and then reused.
+            queueSize (int):  Maximum number of tasks waiting for a free worker.
+            overflow (str):  Behavior when the queue is full.  "reject" drops the task; "block" waits for space.
+            name (str):  Prefix for worker thread names.
+        """
+
+        self.size = int(size) if size is not None and int(size) > 0 else 1
+        self.queueSize = int(queueSize) if queueSize is not None and int(queueSize) > 0 else 1
+        self.overflow = str(overflow).lower() if overflow is not None else "reject"
+        if self.overflow not in ["reject","block"]:
+            raise ValueError("Invalid overflow option: " + str(overflow))
+
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+        self._queue = queue.Queue(maxsize=self.queueSize)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._isRunning = True
+
+        self.active = 0         # Number of workers currently executing a task
+        self.submitted = 0      # Total tasks accepted into the queue
+        self.completed = 0      # Total tasks finished (successfully or not)
+        self.rejected = 0       # Total tasks refused because the queue was full
+        self.failed = 0         # Total tasks that raised an exception
+        self.peakQueueDepth = 0
+
+    def _worker(self):
+        """
+        Thread runtime for pulling tasks off the queue and executing them.
+        """
+
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+
+            fn, args, kwargs = task
+
+            with self._lock:
+                self.active += 1
+
+            try:
+                fn(*args, **kwargs)
+            except:
+                with self._lock:
+                    self.failed += 1
+                self.logger.error(str(sys.exc_info()[0]))
+                self.logger.debug(str(traceback.format_exc()))
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                self._queue.task_done()
+
+    def _spawnWorker(self):
+        """
+        Starts a new worker thread if all current workers are busy and the pool is not yet full.
+        """
+
+        with self._lock:
+            idle = len(self._workers) - self.active - self._queue.qsize()
+            if idle > 0 or len(self._workers) >= self.size:
+                return False
+
+            t = threading.Thread(target=self._worker, name=self.name + "-" + str(len(self._workers)))
+            t.daemon = True
+            self._workers.append(t)
+
+        t.start()
+        return True
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues a function for execution on a pooled worker thread.
+
+        Args:
+            fn (function):  The function to execute.
+
+        Returns:
+            (bool):  True if the task was queued; False if the pool is stopped or the queue is full in "reject" mode.
+        """
+
+        if not self._isRunning:
+            return False
+
+        try:
+            self._queue.put((fn, args, kwargs), block=(self.overflow == "block"))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        with self._lock:
+            self.submitted += 1
+            depth = self._queue.qsize()
+            if depth > self.peakQueueDepth:
+                self.peakQueueDepth = depth
+
+        self._spawnWorker()
+        return True
+
+    def stats(self):
+        """
+        Returns the current counters for the pool.
+
+        Returns:
+            (dict):  Pool size, worker counts, queue depth and task counters.
+        """
+
+        with self._lock:
+            return {
+                "size": self.size,
+                "workers": len(self._workers),
+                "active": self.active,
+                "queueSize": self.queueSize,
+                "queueDepth": self._queue.qsize(),
+                "peakQueueDepth": self.peakQueueDepth,
+                "overflow": self.overflow,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "failed": self.failed
+            }
+
+    def stop(self, wait=False):
+        """
+        Stops accepting new tasks and signals the workers to exit once the queue is drained.
+
+        Args:
+            wait (bool):  Indicates if the calling thread should wait for the workers to finish.
+        """
+
+        if not self._isRunning:
+            return True
+
+        self._isRunning = False
+
+        with self._lock:
+            workers = list(self._workers)
+
+        for t in workers:
+            self._queue.put(None)
+
+        if wait:
+            for t in workers:
+                if t is not threading.current_thread(): # stop() may be requested from one of our own workers
+                    t.join()
+
+        return True
+
+class IdleConnections(object):
+    """
+    Holds idle keep-alive connections without tying up a thread for each one.  A single thread waits for any of them to receive data and passes
+    it back to a callback (e.g. to queue it on a WorkerPool); connections that stay idle longer than the timeout are closed.
+    """
+
+    def __init__(self, callback, timeout=5, name="IDLE"):
+        """
+        Idle Connections Initialization
+
+        Args:
+            callback (function):  Called with the socket and the data given to add() when the socket becomes readable.
+            timeout (float):  Seconds a connection may stay idle before it is closed.
+            name (str):  Name for the watcher thread and logger.
+        """
+
+        import selectors
+
+        self.callback = callback
+        self.timeout = timeout
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+        self._selector = selectors.DefaultSelector()
+        self._readEvent = selectors.EVENT_READ
+        self._lock = threading.Lock()
+        self._expires = {}          # socket => time the idle connection is closed
+        self._isRunning = False
+        self._thread = None
+
+        # Written to by add() so the watcher includes new sockets right away (and select() always has something to wait on)
+        self._wakeRead, self._wakeWrite = socket.socketpair()
+        self._wakeRead.setblocking(False)
+        self._wakeWrite.setblocking(False)
+        self._selector.register(self._wakeRead, self._readEvent, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expires)
+
+    def add(self, sock, data=None):
+        """
+        Starts watching an idle connection.
+
+        Args:
+            sock (socket):  The connection.
+            data (object):  Passed to the callback with the socket.
+
+        Returns:
+            (bool):  True if the connection is being watched; False if the watcher is stopped.
+        """
+
+        with self._lock:
+            if not self._isRunning:
+                return False
+
+            self._selector.register(sock, self._readEvent, data)
+            self._expires[sock] = time.time() + self.timeout
+
+        try:
+            self._wakeWrite.send(b"\0")
+        except OSError:
+            pass # Buffer is full so the watcher is already awake
+
+        return True
+
+    def _closeSocket(self, sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    @threaded
+    def _watch(self):
+        while self._isRunning:
+            events = self._selector.select(timeout=min(0.5, self.timeout))
+
+            ready = []
+            expired = []
+            with self._lock:
+                for key, mask in events:
+                    if key.fileobj is self._wakeRead:
+                        try:
+                            while self._wakeRead.recv(4096):
+                                pass
+                        except OSError:
+                            pass
+                    elif key.fileobj in self._expires:
+                        self._selector.unregister(key.fileobj)
+                        del self._expires[key.fileobj]
+                        ready.append((key.fileobj, key.data))
+
+                now = time.time()
+                for sock in [x for x in self._expires if self._expires[x] <= now]:
+                    self._selector.unregister(sock)
+                    del self._expires[sock]
+                    expired.append(sock)
+
+            for sock in expired:
+                self._closeSocket(sock)
+
+            for sock, data in ready:
+                try:
+                    self.callback(sock, data)
+                except Exception:
+                    self.logger.error(str(traceback.format_exc()))
+                    self._closeSocket(sock)
+
+    def start(self):
+        """
+        Starts the watcher thread.
+        """
+
+        if self._isRunning:
+            return True
+
+        self._isRunning = True
+        self._thread = self._watch()
+        self._thread.name = self.name
+        return True
+
+    def stop(self):
+        """
+        Stops the watcher thread and closes all idle connections.
+        """
+
+        if not self._isRunning:
+            return True
+
+        with self._lock:
+            self._isRunning = False
+            socks = list(self._expires)
+            self._expires = {}
+
+        try:
+            self._wakeWrite.send(b"\0")
+        except OSError:
+            pass
+        
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        for sock in socks:
+            self._closeSocket(sock)
+
+        self._selector.close()
+        self._wakeRead.close()
+        self._wakeWrite.close()
+        return True
 
 def getFileContents(fileName, mode="r"):
     """
@@ -125,6 +559,8 @@ def getFileContents(fileName, mode="r"):
     return content
 
 def upgradePackage(packageName):
+    import subprocess
+    
     logger = logging.getLogger(packageName)
     
     cmd = sys.executable + " -m pip install --upgrade --no-input " + packageName
@@ -174,98 +610,413 @@ def upgradePackage(packageName):
                 logger.error(str(errData))
     
     if p.returncode is not None and str(p.returncode) == "0":
+        upgradedPackages.append(packageName) # New code is only loaded by a fresh interpreter
         return True
     else:
         return False
 
-class StreamingClient(object):
+upgradedPackages = []               # Packages upgraded by upgradePackage() since the interpreter started
+
+class BatchQueue(object):
     """
-    Streaming Media Client Class
+    Collects typed events and hands them off in batches on a background thread.
     """
     
-    def __init__(self):
-        """
-        Streaming Client Initialization.
-        """
-        self.streamBuffer = ""
-        self.streamQueue = queue.Queue()
-        self.streamThread = threading.Thread(target = self.stream)
-        self.streamThread.daemon = True
-        self.connected = True
-        self.kill = False
-
-        super(StreamingClient, self).__init__()
-    
-    def start(self):
+    def __init__(self, sendFunction, batchSize=20, batchWindow=0.5, maxSize=1000, coalesce=None, name="BATCH"):
         """
-        Starts an independent thread for the streaming client to hand off data from the buffer to avoid blocking calls on new images.
+        Batch Queue Initialization
+        
+        Args:
+            sendFunction (function):  Called with a list of { "type": ..., "data": ... } items; should return True on success.
+            batchSize (int):  Maximum number of items per batch.  A batch is sent as soon as this many items are waiting.
+            batchWindow (float):  Maximum seconds the oldest item waits before a partial batch is sent.
+            maxSize (int):  Maximum number of waiting items.  The oldest item is dropped when the queue is full.
+            coalesce (list):  Types for which only the latest waiting item is kept (e.g. status updates).
+            name (str):  Name for the logger and sender thread.
         """
-        self.streamThread.start()
-
-    def transmit(self, data):
+        
+        self.sendFunction = sendFunction
+        self.batchSize = int(batchSize) if batchSize is not None and int(batchSize) > 0 else 1
+        self.batchWindow = float(batchWindow) if batchWindow is not None else 0.5
+        self.maxSize = int(maxSize) if maxSize is not None and int(maxSize) > 0 else 1000
+        self.coalesce = [str(x) for x in coalesce] if coalesce is not None else []
+        self.name = name
+        self.logger = logging.getLogger(name)
+        
+        self._pending = collections.deque()     # Items as [type, data] in arrival order
+        self._latest = {}                       # Waiting item per coalesced type
+        self._firstQueued = None                # Time the oldest waiting item was added
+        self._condition = threading.Condition()
+        self._thread = None
+        self._isRunning = False
+        
+        self.queued = 0         # Total items accepted
+        self.coalesced = 0      # Items merged into an already waiting item of the same type
+        self.dropped = 0        # Items discarded because the queue was full
+        self.flushes = 0        # Batches sent successfully
+        self.failed = 0         # Batches that could not be sent
+        self.sent = 0           # Items delivered in successful batches
+        
+    def put(self, inType, data):
         """
-        Overridden in inherited class, but would be used to transmit data to requestor.
+        Adds an item to the queue.
         
         Args:
-            data (byte):  Byte array to transmit
+            inType (str):  The type of data collected (e.g. "AUDIO_INPUT").
+            data (object):  The data for the item.
             
         Returns:
-            (bool): True on success or False on failure
-            
+            (bool):  True if queued; False if the queue is not running.
         """
         
+        if not self._isRunning:
+            return False
+        
+        inType = str(inType)
+        
+        with self._condition:
+            self.queued += 1
+            
+            if inType in self._latest:
+                self._latest[inType][1] = data # Keeps its place in line so per-type ordering holds
+                self.coalesced += 1
+                return True
+            
+            if len(self._pending) >= self.maxSize:
+                old = self._pending.popleft()
+                if self._latest.get(old[0]) is old:
+                    del self._latest[old[0]]
+                self.dropped += 1
+            
+            item = [inType, data]
+            self._pending.append(item)
+            if inType in self.coalesce:
+                self._latest[inType] = item
+            
+            if self._firstQueued is None:
+                self._firstQueued = time.time()
+            
+            self._condition.notify()
+            
         return True
-
-    def stop(self):
-        """
-        Stops the streaming connection thread
+    
+    def _nextBatch(self):
+        batch = []
+        with self._condition:
+            while len(self._pending) > 0 and len(batch) < self.batchSize:
+                item = self._pending.popleft()
+                if self._latest.get(item[0]) is item:
+                    del self._latest[item[0]]
+                batch.append({ "type": item[0], "data": item[1] })
+            
+            self._firstQueued = time.time() if len(self._pending) > 0 else None
+            
+        return batch
+    
+    def _send(self, batch):
+        if len(batch) == 0:
+            return True
+        
+        try:
+            ret = self.sendFunction(batch)
+        except:
+            self.logger.error(str(sys.exc_info()[0]))
+            ret = False
+            
+        with self._condition:
+            if ret:
+                self.flushes += 1
+                self.sent += len(batch)
+            else:
+                self.failed += 1
+                
+        return ret
+    
+    def _run(self):
         """
-        self.kill = True
-        self.connected = False
-
-    def bufferStreamData(self, data):
+        Thread runtime that waits for a full batch or the end of the batch window.
         """
-        Adds new data to the buffer for transmission to the requestor.
         
-        Args:
-            data (byte): Data to be saved to buffer
-        """
-        #use a thread-safe queue to ensure stream buffer is not modified while we're sending it
-        self.streamQueue.put(data)
-
+        while True:
+            with self._condition:
+                while self._isRunning:
+                    if len(self._pending) >= self.batchSize:
+                        break
+                    
+                    if self._firstQueued is not None:
+                        remaining = self._firstQueued + self.batchWindow - time.time()
+                        if remaining <= 0:
+                            break
+                        
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                
+                if not self._isRunning:
+                    break
+                
+            self._send(self._nextBatch())
+        
+        self.flush()
+    
+    def flush(self):
+        """
+        Sends all waiting items immediately on the calling thread.
+        """
+        
+        while len(self._pending) > 0:
+            if not self._send(self._nextBatch()):
+                return False
+            
+        return True
+    
+    def stats(self):
+        """
+        Returns the current counters for the queue.
+        
+        Returns:
+            (dict):  Queue depth and item/batch counters.
+        """
+        
+        with self._condition:
+            return {
+                "depth": len(self._pending),
+                "maxSize": self.maxSize,
+                "batchSize": self.batchSize,
+                "batchWindow": self.batchWindow,
+                "queued": self.queued,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "failed": self.failed,
+                "sent": self.sent
+            }
+    
+    def start(self):
+        """
+        Starts the sender thread.
+        """
+        
+        if self._isRunning:
+            return True
+        
+        self._isRunning = True
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+    
+    def stop(self, wait=True):
+        """
+        Stops the sender thread after sending any waiting items.
+        
+        Args:
+            wait (bool):  Indicates if the calling thread should wait for the final flush.
+        """
+        
+        with self._condition:
+            self._isRunning = False
+            self._condition.notify_all()
+        
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            
+        return True
+
+class StreamingClient(object):
+    """
+    Streaming Media Client Class
+    """
+    
+    def __init__(self, maxFrames=30, maxBytes=None, bufferPolicy="drop-oldest"):
+        """
+        Streaming Client Initialization.
+        
+        Args:
+            maxFrames (int):  Maximum number of frames waiting to be transmitted (None for no frame limit).
+            maxBytes (int):  Maximum number of bytes waiting to be transmitted (None for no byte limit).
+            bufferPolicy (str):  What to do when the buffer is full; "drop-oldest", "drop-newest" or "latest-only" (keeps just the newest frame).
+        """
+        
+        if bufferPolicy not in ["drop-oldest","drop-newest","latest-only"]:
+            raise ValueError("Invalid buffer policy: " + str(bufferPolicy))
+        
+        self.streamBuffer = ""
+        self.maxFrames = int(maxFrames) if maxFrames is not None and int(maxFrames) > 0 else None
+        self.maxBytes = int(maxBytes) if maxBytes is not None and int(maxBytes) > 0 else None
+        self.bufferPolicy = bufferPolicy
+        
+        if self.bufferPolicy == "latest-only":
+            self.maxFrames = 1
+        
+        self._buffer = collections.deque()  # Frames as (data, size, time added)
+        self._bufferBytes = 0
+        self._condition = threading.Condition()
+        
+        self.dropped = 0        # Frames discarded by the buffer policy
+        self.framesSent = 0     # Frames handed to transmit()
+        self.bytesSent = 0      # Bytes handed to transmit()
+        
+        self.streamThread = threading.Thread(target = self.stream)
+        self.streamThread.daemon = True
+        self.connected = True
+        self.kill = False
+
+        super(StreamingClient, self).__init__()
+    
+    def start(self):
+        """
+        Starts an independent thread for the streaming client to hand off data from the buffer to avoid blocking calls on new images.
+        """
+        self.streamThread.start()
+
+    def transmit(self, data):
+        """
+        Overridden in inherited class, but would be used to transmit data to requestor.
+        
+        Args:
+            data (byte):  Byte array to transmit
+            
+        Returns:
+            (bool): True on success or False on failure
+            
+        """
+        
+        return True
+
+    def stop(self):
+        """
+        Stops the streaming connection thread
+        """
+        self.kill = True
+        self.connected = False
+        
+        with self._condition:
+            self._buffer.clear()
+            self._bufferBytes = 0
+            self._condition.notify_all()
+
+    def _dataSize(self, data):
+        try:
+            return memoryview(data).nbytes
+        except TypeError:
+            return len(data)
+
+    def _isFull(self, extraBytes=0):
+        if self.maxFrames is not None and len(self._buffer) >= self.maxFrames:
+            return True
+        
+        if self.maxBytes is not None and len(self._buffer) > 0 and self._bufferBytes + extraBytes > self.maxBytes:
+            return True
+        
+        return False
+
+    def bufferStreamData(self, data):
+        """
+        Adds new data to the buffer for transmission to the requestor.  When the buffer is full the buffer policy decides which frame is dropped.
+        
+        Args:
+            data (byte): Data to be saved to buffer
+            
+        Returns:
+            (bool): True if the data was buffered; False if it was dropped
+        """
+        
+        size = self._dataSize(data)
+        
+        with self._condition:
+            if self._isFull(size):
+                if self.bufferPolicy == "drop-newest":
+                    self.dropped += 1
+                    return False
+                
+                while len(self._buffer) > 0 and self._isFull(size):
+                    old = self._buffer.popleft()
+                    self._bufferBytes -= old[1]
+                    self.dropped += 1
+            
+            self._buffer.append((data, size, time.time()))
+            self._bufferBytes += size
+            self._condition.notify()
+            
+        return True
+
+    def stats(self):
+        """
+        Returns buffer and transmission counters for the client.
+        
+        Returns:
+            (dict):  Buffer depth, lag and sent/dropped counters.
+        """
+        
+        with self._condition:
+            lag = time.time() - self._buffer[0][2] if len(self._buffer) > 0 else 0
+            return {
+                "bufferPolicy": self.bufferPolicy,
+                "maxFrames": self.maxFrames,
+                "maxBytes": self.maxBytes,
+                "queuedFrames": len(self._buffer),
+                "queuedBytes": self._bufferBytes,
+                "lag": lag,
+                "dropped": self.dropped,
+                "framesSent": self.framesSent,
+                "bytesSent": self.bytesSent
+            }
+
     def stream(self):
         """
         Thread runtime for reading data from the buffer and transmitting it to the client
         """
         
         while self.connected:
-            #this call blocks if there's no data in the queue, avoiding the need for busy-waiting
-            self.streamBuffer = self.streamQueue.get()
-            
-            #check if kill or connected state has changed after being blocked
-            if (self.kill or not self.connected):
-                self.stop()
-                return
-
+            with self._condition:
+                #wait for data, avoiding the need for busy-waiting
+                while len(self._buffer) == 0 and self.connected and not self.kill:
+                    self._condition.wait()
+                
+                #check if kill or connected state has changed after being blocked
+                if (self.kill or not self.connected):
+                    break
+                
+                data, size, added = self._buffer.popleft()
+                self._bufferBytes -= size
+                
+            self.streamBuffer = data
             self.transmit(self.streamBuffer)
-                    
+            
+            if self.connected:
+                self.framesSent += 1
+                self.bytesSent += size
+            
+        self.streamBuffer = ""
 
 class TCPStreamingClient(StreamingClient):
     """
     TCP Streaming Media Client Class
     """
     
-    def __init__(self, sock, includeHeader=True, includeBoundary=True):
+    def __init__(self, sock, includeHeader=True, includeBoundary=True, broadcaster=None, maxFrames=30, maxBytes=None, bufferPolicy="drop-oldest"):
         """
         TCP Streaming Client Initialization
+        
+        Args:
+            sock (socket):  The client connection.
+            includeHeader (bool):  Send the HTTP response headers and a header block with each frame.
+            includeBoundary (bool):  Send the multipart boundary after each frame.
+            broadcaster (FrameBroadcaster):  Shared frame source.  When set, the client always sends the latest published frame instead of queueing its own copies. (optional)
+            maxFrames (int):  Maximum number of frames waiting to be transmitted.
+            maxBytes (int):  Maximum number of bytes waiting to be transmitted.
+            bufferPolicy (str):  "drop-oldest", "drop-newest" or "latest-only" when the buffer is full.
         """
-        super(TCPStreamingClient, self).__init__()
+        super(TCPStreamingClient, self).__init__(maxFrames=maxFrames, maxBytes=maxBytes, bufferPolicy=bufferPolicy)
         self.logger = logging.getLogger("TCP_STREAM")
         self.sock = sock
         self.sock.settimeout(5)
         self.boundary = '--boundarydonotcross'
+        self._boundaryBytes = self.boundary.encode()
         self.includeHeader = includeHeader
         self.includeBoundary = includeBoundary
+        self.broadcaster = broadcaster
         
         self.logger.debug("Streaming client connected.")
         
@@ -315,112 +1066,817 @@ class TCPStreamingClient(StreamingClient):
         
         self.sock.close()
         super().stop()
+        
+        if self.broadcaster is not None:
+            self.broadcaster.removeClient(self)
 
-    def transmit(self, data):
+    def transmitFrame(self, header, data):
         """
-        Sends data to client via TCP (HTTP) response.
+        Sends a frame with a prebuilt header block to the client.
         
         Args:
-            data (byte): Data to be transmitted
-        
+            header (bytes):  The encoded frame headers (see FrameBroadcaster.publish).
+            data (memoryview):  The frame image data.
+            
         Returns:
             (bool): True on success
         """
         try:
-            if self.includeHeader:
-                self.sock.send(self.image_headers(data).encode())
-
-            self.sock.send(data)
-                
-            if self.includeBoundary:
-                self.sock.send(self.boundary.encode())
-
+            sendBuffers(self.sock, [header if self.includeHeader else None, data, self._boundaryBytes if self.includeBoundary else None])
             return True
         except:
             self.connected = False
             self.sock.close()
             
         return True
+
+    def transmit(self, data):
+        """
+        Sends data to client via TCP (HTTP) response.
+        
+        Args:
+            data (byte): Data to be transmitted
+        
+        Returns:
+            (bool): True on success
+        """
+        
+        return self.transmitFrame(self.image_headers(data).encode() if self.includeHeader else None, data)
     
-def sendSDCPRequest():
+    def stream(self):
+        """
+        Thread runtime for transmitting data to the client from the buffer or the shared broadcaster
+        """
+        
+        if self.broadcaster is None:
+            return super().stream()
+        
+        lastSeq = 0
+        while self.connected and not self.kill:
+            frame = self.broadcaster.waitForFrame(lastSeq, timeout=1)
+            if frame is None:
+                continue
+            
+            # Frames published while we were sending are skipped; only the latest one is sent
+            if lastSeq > 0 and frame[0] > lastSeq + 1:
+                self.dropped += frame[0] - lastSeq - 1
+                
+            lastSeq, header, data = frame
+            self.transmitFrame(header, data)
+            
+            if self.connected:
+                self.framesSent += 1
+                self.bytesSent += data.nbytes
+        
+        if self.broadcaster is not None:
+            self.broadcaster.removeClient(self)
+            
+class FrameBroadcaster(object):
     """
-    Sends a SDCO/UPNP Request to the network.
-    
-    Returns:
-        (list): list of all devices and their relative headers found on the network.
+    Shares the latest frame of an MJPEG stream with any number of TCP streaming clients.
     """
     
-    logger = logging.getLogger("UPNP-CLIENT")
-    logger.info("Broadcasting UPNP search for active devices")
-    
-    msg = \
-        'M-SEARCH * HTTP/1.1\r\n' \
-        'HOST:239.255.255.250:1900\r\n' \
-        'ST:upnp:rootdevice\r\n' \
-        'MX:2\r\n' \
-        'MAN:"ssdp:discover"\r\n' \
-        '\r\n'
+    def __init__(self, contentType="image/jpeg"):
+        """
+        Frame Broadcaster Initialization
+        
+        Args:
+            contentType (str):  The content type of each frame.
+        """
+        
+        self.logger = logging.getLogger("TCP_STREAM")
+        self.contentType = contentType
+        self.clients = []
+        self.published = 0
+        
+        self._frame = None          # Tuple of (sequence, header bytes, memoryview of data)
+        self._condition = threading.Condition()
+        
+    def publish(self, data):
+        """
+        Makes a new frame available to all clients.  The data is not copied so it must not be modified after publishing.
+        
+        Args:
+            data (bytes):  Encoded image data (any object supporting the buffer protocol).
+        """
+        
+        view = memoryview(data).cast("B")
+        header = ("X-Timestamp: " + str(time.time()) + "\n" + 
+                  "Content-Length: " + str(view.nbytes) + "\n" + 
+                  "Content-Type: " + self.contentType + "\n\n").encode()
+        
+        with self._condition:
+            self.published += 1
+            self._frame = (self.published, header, view)
+            self._condition.notify_all()
+            
+    def waitForFrame(self, lastSeq, timeout=None):
+        """
+        Waits for a frame newer than the one last sent by a client.
+        
+        Args:
+            lastSeq (int):  Sequence number of the frame the client sent last.
+            timeout (float):  Maximum seconds to wait.
+            
+        Returns:
+            (tuple):  (sequence, header, data) of the latest frame or None on timeout.
+        """
+        
+        with self._condition:
+            if self._frame is None or self._frame[0] <= lastSeq:
+                self._condition.wait(timeout)
+            
+            if self._frame is None or self._frame[0] <= lastSeq:
+                return None
+            
+            return self._frame
     
-    # Set up UDP socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    s.settimeout(2)
-    s.sendto(msg.encode(), ('239.255.255.250', 1900) )
+    def addClient(self, sock, includeHeader=True, includeBoundary=True):
+        """
+        Creates and starts a streaming client fed from this broadcaster.
+        
+        Args:
+            sock (socket):  The client connection.
+            includeHeader (bool):  Send HTTP response headers and per-frame headers.
+            includeBoundary (bool):  Send the multipart boundary after each frame.
+            
+        Returns:
+            (TCPStreamingClient):  The new client.
+        """
+        
+        client = TCPStreamingClient(sock, includeHeader=includeHeader, includeBoundary=includeBoundary, broadcaster=self)
+        with self._condition:
+            self.clients.append(client)
+            
+        client.start()
+        return client
     
-    devices = []
+    def removeClient(self, client):
+        """
+        Removes a client from the broadcaster.
+        
+        Args:
+            client (TCPStreamingClient):  The client to remove.
+        """
+        
+        with self._condition:
+            if client in self.clients:
+                self.clients.remove(client)
     
-    logger.info("Listening for responses")
-    try:
-        while True:
-            data, addr = s.recvfrom(65507)
-            
-            d = { 
-                "hostname": addr[0],
-                "port": addr[1],
-                "data": data.decode(),
-                "headers": {}
-            }
+    def stop(self):
+        """
+        Stops all clients and releases the last frame.
+        """
+        
+        with self._condition:
+            clients = list(self.clients)
             
-            for line in d["data"].split("\n"):
-                if ":" in line:
-                    h = line.split(":",1)
-                    if len(h) > 1:
-                        d["headers"][h[0].strip().upper()] = h[1].strip()
+        for client in clients:
+            client.stop()
             
-            logger.debug(str(d))
-            devices.append(d)
-
-    except socket.timeout:
-        pass
-
-    return devices
+        with self._condition:
+            self._frame = None
+            self._condition.notify_all()
+    
+_discoveryCache = {}                # USN => device found by discoverDevices() or SSDPListener (see _parseSSDP)
+_discoveryLock = threading.Lock()
 
-def sendHTTPRequest(url, type="POST", params=None, jsonData=None, origin=None, groupName=None, isStream=True, headers=None):
+def _parseSSDP(data, addr):
     """
-    Sends a HTTP request to a remote host.
+    Parses a SSDP response or NOTIFY message.
     
     Args:
-        url (str):  The address to submit the request.
-        type (str):  The HTTP method of the request (default to POST).
-        params (str): query string-like values of name/value pairs.
-        jsonData (dict): Dictionary object to be converted to JSON string
-        origin (str): The origination of the request (for context)
-        groupName (str): The name of the group originating the request (for context)
-        isStream (bool): indicates if the request is expected to return a stream object or a static response.
-        headers (dict): Name/Value pairs for headers
+        data (bytes):  The UDP payload.
+        addr (tuple):  The (host, port) it was received from.
         
     Returns:
-        (bool, contentType, contentObject): Status of request (True for success; HTTP content type of response; Object value or stream pointer of response.
+        (dict):  Device with "hostname", "port", "data", "headers", "usn" and "expires" (time the entry goes stale).
     """
     
-    #FIXME: Add context to request!
+    d = { 
+        "hostname": addr[0],
+        "port": addr[1],
+        "data": data.decode(errors="replace"),
+        "headers": {}
+    }
+    
+    for line in d["data"].split("\n"):
+        if ":" in line:
+            h = line.split(":",1)
+            if len(h) > 1:
+                d["headers"][h[0].strip().upper()] = h[1].strip()
     
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    match = re.search(r"max-age\s*=\s*(\d+)", d["headers"].get("CACHE-CONTROL", ""))
+    d["expires"] = time.time() + (int(match.group(1)) if match else 1800)
+    d["usn"] = d["headers"].get("USN") or (str(addr[0]) + " " + str(d["headers"].get("LOCATION")))
+    
+    return d
 
-    #url = 'https://localhost:8031/requests'
-    #mydata = {'somekey': 'somevalue'}
-    logger = logging.getLogger("HTTP")
+def _cacheDevice(device):
+    """
+    Stores a discovered device.  Headers of an unexpired entry for the same USN are kept unless the new message sends them again, so a
+    NOTIFY that omits headers from the search response does not change how the device is matched.
+    
+    Returns:
+        (bool):  True if the device was not already known.
+    """
+    
+    with _discoveryLock:
+        known = _discoveryCache.get(device["usn"])
+        isNew = known is None or known["expires"] < time.time()
+        if not isNew:
+            headers = dict(known["headers"])
+            headers.update(device["headers"])
+            device = dict(device, headers=headers)
+        
+        _discoveryCache[device["usn"]] = device
+    
+    return isNew
 
-    request_body = None
+def _matches(device, match):
+    if match is None:
+        return True
+    
+    if callable(match):
+        return match(device)
+    
+    return all(str(device["headers"].get(str(k).upper(), "")).lower() == str(match[k]).lower() for k in match)
+
+def discoveredDevices(match=None):
+    """
+    Returns the devices in the discovery cache that have not expired.
+    
+    Args:
+        match (dict or function):  Header values (e.g. { "X-KAREN-TYPE": "BRAIN" }) or a function taking the device that returns True to include it.
+        
+    Returns:
+        (list):  The matching devices.
+    """
+    
+    now = time.time()
+    with _discoveryLock:
+        for usn in [x for x in _discoveryCache if _discoveryCache[x]["expires"] < now]:
+            del _discoveryCache[usn]
+        
+        devices = list(_discoveryCache.values())
+    
+    return [x for x in devices if _matches(x, match)]
+
+def clearDiscoveryCache():
+    """
+    Removes all devices from the discovery cache.
+    """
+    
+    with _discoveryLock:
+        _discoveryCache.clear()
+
+def discoverDevices(timeout=2, match=None, stopOnMatch=True, useCache=True, st="upnp:rootdevice", mx=2):
+    """
+    Searches the network with SSDP/UPNP and yields each device as its response arrives.  Devices are reported once per USN.
+    
+    Args:
+        timeout (float):  Maximum seconds to wait for responses.
+        match (dict or function):  Only yield devices with these header values (e.g. { "X-KAREN-TYPE": "BRAIN" }) or for which the function returns True.
+        stopOnMatch (bool):  Stop after the first device that matches instead of waiting for the timeout (only used with match).
+        useCache (bool):  Yield unexpired devices from the discovery cache first (with stopOnMatch and match no search is sent if one matches).
+        st (str):  The search target.
+        mx (int):  Maximum seconds devices may wait before responding (lower values answer sooner).
+        
+    Returns:
+        (generator):  Devices as returned by sendSDCPRequest().
+    """
+    
+    logger = logging.getLogger("UPNP-CLIENT")
+    seen = set()
+    
+    if useCache:
+        for device in discoveredDevices(match):
+            seen.add(device["usn"])
+            yield device
+            
+            if stopOnMatch and match is not None:
+                return
+    
+    logger.info("Broadcasting UPNP search for active devices")
+    
+    msg = \
+        'M-SEARCH * HTTP/1.1\r\n' \
+        'HOST:239.255.255.250:1900\r\n' \
+        'ST:' + str(st) + '\r\n' \
+        'MX:' + str(mx) + '\r\n' \
+        'MAN:"ssdp:discover"\r\n' \
+        '\r\n'
+    
+    # Set up UDP socket
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        s.sendto(msg.encode(), ('239.255.255.250', 1900) )
+        
+        logger.info("Listening for responses")
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            
+            s.settimeout(remaining)
+            try:
+                data, addr = s.recvfrom(65507)
+            except socket.timeout:
+                break
+            
+            d = _parseSSDP(data, addr)
+            _cacheDevice(d)
+            
+            if d["usn"] in seen or not _matches(d, match):
+                continue
+            
+            seen.add(d["usn"])
+            logger.debug(str(d))
+            yield d
+            
+            if stopOnMatch and match is not None:
+                break
+    finally:
+        s.close()
+
+def sendSDCPRequest(timeout=2, match=None, stopOnMatch=False, useCache=False):
+    """
+    Sends a SDCO/UPNP Request to the network.
+    
+    Args:
+        timeout (float):  Maximum seconds to wait for responses.
+        match (dict or function):  Only return devices with these header values (e.g. { "X-KAREN-TYPE": "BRAIN" }) or for which the function returns True.
+        stopOnMatch (bool):  Return as soon as a matching device responds.
+        useCache (bool):  Use unexpired devices from earlier searches and NOTIFY messages.
+    
+    Returns:
+        (list): list of all devices and their relative headers found on the network.
+    """
+    
+    return list(discoverDevices(timeout=timeout, match=match, stopOnMatch=stopOnMatch, useCache=useCache))
+
+class SSDPListener(object):
+    """
+    Listens for SSDP NOTIFY messages (ssdp:alive and ssdp:byebye) and keeps the discovery cache current without sending searches.
+    """
+    
+    def __init__(self, hostname="239.255.255.250", port=1900):
+        """
+        SSDP Listener Initialization
+        
+        Args:
+            hostname (str):  The multicast group to join.
+            port (int):  The UDP port to listen on.
+        """
+        
+        self.hostname = hostname
+        self.port = port
+        self.logger = logging.getLogger("UPNP-LISTENER")
+        self._isRunning = False
+        self._thread = None
+        self._socket = None
+    
+    @threaded
+    def _listen(self):
+        while self._isRunning:
+            try:
+                data, addr = self._socket.recvfrom(65507)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            
+            if not data.startswith(b"NOTIFY"):
+                continue
+            
+            d = _parseSSDP(data, addr)
+            nts = d["headers"].get("NTS", "").lower()
+            if nts == "ssdp:byebye":
+                with _discoveryLock:
+                    _discoveryCache.pop(d["usn"], None)
+            elif nts == "ssdp:alive":
+                if _cacheDevice(d):
+                    self.logger.debug("Discovered " + str(d["usn"]) + " (" + str(d["headers"].get("LOCATION")) + ")")
+        
+        self._socket.close()
+    
+    def start(self):
+        """
+        Joins the multicast group and starts listening on a new thread.
+        
+        Returns:
+            (bool):  True on success.
+        """
+        
+        if self._isRunning:
+            return True
+        
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            try:
+                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except socket.error as le:
+                if le.errno != ENOPROTOOPT:
+                    raise
+        
+        try:
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(self.hostname) + socket.inet_aton('0.0.0.0'))
+            self._socket.bind(('0.0.0.0', self.port))
+        except OSError:
+            self._socket.close()
+            raise
+        
+        self._socket.settimeout(1)
+        
+        self._isRunning = True
+        self._thread = self._listen()
+        return True
+    
+    def isRunning(self):
+        return self._isRunning
+    
+    def stop(self):
+        """
+        Stops listening and waits for the thread to exit.
+        
+        Returns:
+            (bool):  True on success.
+        """
+        
+        self._isRunning = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        
+        return True
+
+def _orjsonDumps(obj):
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError: # e.g. integers larger than 64 bits
+        return _stdJSONDumps(obj)
+
+def _ujsonDumps(obj):
+    try:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+    except (TypeError, OverflowError):
+        return _stdJSONDumps(obj)
+
+def _stdJSONDumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",",":")).encode("utf-8")
+
+def _importJSONCodec(name):
+    """
+    Imports an optional JSON library on first use.
+    
+    Args:
+        name (str):  "orjson" or "ujson".
+        
+    Returns:
+        (tuple):  (dumps, loads) or None if the library is not installed.
+    """
+    
+    global orjson, ujson
+    
+    try:
+        if name == "orjson":
+            import orjson
+            return (_orjsonDumps, orjson.loads)
+        
+        import ujson
+        return (_ujsonDumps, ujson.loads)
+    except ImportError:
+        return None
+
+def _autoJSONDumps(obj):
+    setJSONCodec()
+    return _jsonCodec[1](obj)
+
+def _autoJSONLoads(data):
+    setJSONCodec()
+    return _jsonCodec[2](data)
+
+_jsonCodecs = { "orjson": _importJSONCodec, "ujson": _importJSONCodec, "json": (_stdJSONDumps, json.loads) } # Importers are replaced by (dumps, loads) or None once tried
+_jsonCodec = [None, _autoJSONDumps, _autoJSONLoads] # Active codec as [name, dumps, loads]; the fastest installed one is selected on first use
+
+def isJSONCodecAvailable(name):
+    """
+    Checks if a JSON library can be used, importing it if it hasn't been tried yet.
+    
+    Args:
+        name (str):  "orjson", "ujson" or "json".
+        
+    Returns:
+        (bool):  True if the codec is installed.
+    """
+    
+    if name not in _jsonCodecs:
+        raise ValueError("Unknown JSON codec: " + str(name))
+    
+    if callable(_jsonCodecs[name]):
+        _jsonCodecs[name] = _jsonCodecs[name](name)
+    
+    return _jsonCodecs[name] is not None
+
+def setJSONCodec(name=None):
+    """
+    Selects the JSON library used by jsonDumps() and jsonLoads().
+    
+    Args:
+        name (str):  "orjson", "ujson" or "json".  None picks the fastest one installed.
+        
+    Returns:
+        (str):  The name of the active codec.
+    """
+    
+    if name is None:
+        name = [x for x in ["orjson", "ujson", "json"] if isJSONCodecAvailable(x)][0]
+    
+    if not isJSONCodecAvailable(name):
+        raise ImportError("JSON codec " + str(name) + " is not installed.")
+    
+    _jsonCodec[0] = name
+    _jsonCodec[1], _jsonCodec[2] = _jsonCodecs[name]
+    return name
+
+def getJSONCodec():
+    """
+    Returns the name of the JSON library in use.
+    
+    Returns:
+        (str):  "orjson", "ujson" or "json".
+    """
+    
+    if _jsonCodec[0] is None:
+        setJSONCodec()
+    
+    return _jsonCodec[0]
+
+def jsonDumps(obj):
+    """
+    Serializes an object to compact UTF-8 encoded JSON with the active codec.
+    
+    Args:
+        obj (object):  The value to serialize.
+        
+    Returns:
+        (bytes):  The JSON document.
+    """
+    
+    return _jsonCodec[1](obj)
+
+def jsonLoads(data):
+    """
+    Parses a JSON document with the active codec.
+    
+    Args:
+        data (bytes or str):  The JSON document.
+        
+    Returns:
+        (object):  The parsed value.
+    """
+    
+    return _jsonCodec[2](data)
+
+_httpSessions = {}                  # Persistent sessions keyed by target scheme://host:port
+_httpSessionLock = threading.Lock()
+_httpSessionConfig = {
+        "poolSize": 10,             # Connections kept open per target host
+        "keepAlive": True,          # Reuse connections between requests
+        "retries": 2,               # Retries for failed connections (and 502/503/504 on idempotent requests)
+        "backoff": 0.2,             # Backoff factor between retries in seconds
+        "connectTimeout": 3.05,     # Seconds to wait for the connection to be established
+        "readTimeout": 30,          # Seconds to wait between bytes of the response
+        "compressMinSize": 1024     # Smallest request body compressed when sendHTTPRequest is called with compress=True
+    }
+_tlsClientContext = None            # SSLContext shared by all HTTPS sessions (see getTLSClientContext)
+
+def configureHTTPSessions(poolSize=None, keepAlive=None, retries=None, backoff=None, connectTimeout=None, readTimeout=None, compressMinSize=None):
+    """
+    Sets the options for the persistent HTTP sessions used by sendHTTPRequest().  Existing sessions are closed so the new settings apply to the next request.
+    
+    Args:
+        poolSize (int):  Maximum number of connections kept open per target host.
+        keepAlive (bool):  Indicates if connections should be reused between requests.
+        retries (int):  Number of retries on connection failures.
+        backoff (float):  Backoff factor in seconds applied between retries.
+        connectTimeout (float):  Seconds to wait for a connection to be established.
+        readTimeout (float):  Seconds to wait for data from the remote host.
+        compressMinSize (int):  Smallest request body in bytes that is gzip compressed when compression is requested.
+        
+    Returns:
+        (dict):  The active session configuration.
+    """
+    
+    values = { "poolSize": poolSize, "keepAlive": keepAlive, "retries": retries, "backoff": backoff, "connectTimeout": connectTimeout, "readTimeout": readTimeout, "compressMinSize": compressMinSize }
+    
+    with _httpSessionLock:
+        for key in values:
+            if values[key] is not None:
+                _httpSessionConfig[key] = values[key]
+    
+    closeHTTPSessions()
+    return dict(_httpSessionConfig)
+
+def closeHTTPSessions():
+    """
+    Closes all persistent HTTP sessions and their pooled connections.
+    """
+    
+    with _httpSessionLock:
+        for key in list(_httpSessions.keys()):
+            try:
+                _httpSessions[key].close()
+            except:
+                pass
+            
+            del _httpSessions[key]
+
+def getTLSClientContext():
+    """
+    Returns the SSLContext used for all outbound HTTPS connections, creating it on first use.  The context remembers the TLS session of each server
+    and offers it on the next connection so reconnecting to the brain resumes the session instead of repeating the full handshake.
+    
+    Certificates are not verified (the same as sendHTTPRequest has always done with verify=False).
+    
+    Returns:
+        (ssl.SSLContext):  The shared client context.
+    """
+    
+    global _tlsClientContext
+    
+    with _httpSessionLock:
+        if _tlsClientContext is not None:
+            return _tlsClientContext
+        
+        import ssl # Imported on first use like requests
+        
+        class TLSClientContext(ssl.SSLContext):
+            def __init__(self, *args, **kwargs):
+                super().__init__()
+                self._sessions = {}         # (server hostname, peer address) => last resumable SSLSession
+                self._sessionLock = threading.Lock()
+            
+            def _sessionKey(self, sock, serverHostname):
+                try:
+                    return (serverHostname, sock.getpeername())
+                except OSError:
+                    return None
+            
+            def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+                key = self._sessionKey(sock, server_hostname)
+                if session is None and key is not None:
+                    with self._sessionLock:
+                        session = self._sessions.get(key)
+                
+                conn = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+                conn._sessionKey = key
+                self.saveSession(conn)
+                return conn
+            
+            def saveSession(self, conn):
+                # TLS 1.3 tickets arrive after the handshake, so getHTTPSession's connections call this again after each response
+                key = getattr(conn, "_sessionKey", None)
+                if key is None:
+                    return
+                
+                try:
+                    session = conn.session
+                except (ValueError, OSError):
+                    return
+                
+                if session is not None and (session.has_ticket or len(session.id) > 0):
+                    with self._sessionLock:
+                        self._sessions[key] = session
+        
+        context = TLSClientContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        
+        _tlsClientContext = context
+    
+    return _tlsClientContext
+
+def getHTTPSession(url, retries=None):
+    """
+    Returns the persistent HTTP session for the host of a URL, creating it on first use.
+    
+    Args:
+        url (str):  The address of the request.
+        retries (int):  Retries on connection failures for this session (defaults to the configureHTTPSessions() value).
+        
+    Returns:
+        (requests.Session):  Session with pooled connections for the target host.
+    """
+    
+    target = urlparse(url)
+    key = str(target.scheme).lower() + "://" + str(target.netloc).lower() + ("" if retries is None else " retries=" + str(retries))
+    
+    tlsContext = getTLSClientContext() if str(target.scheme).lower() == "https" else None
+    
+    with _httpSessionLock:
+        if key in _httpSessions:
+            return _httpSessions[key]
+        
+        # Imported on first use; requests and urllib3 are a large share of the package's import time
+        import requests, urllib3
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        if len(_httpSessions) == 0:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        
+        retry = Retry(
+            total=(_httpSessionConfig["retries"] if retries is None else retries), 
+            read=0, 
+            backoff_factor=_httpSessionConfig["backoff"], 
+            status_forcelist=[502,503,504], 
+            raise_on_status=False)
+        
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_httpSessionConfig["poolSize"], max_retries=retry)
+        if tlsContext is not None:
+            from urllib3.connectionpool import HTTPSConnectionPool
+            from urllib3.connection import HTTPSConnection
+            
+            class TLSSessionConnection(HTTPSConnection):
+                def getresponse(self, *args, **kwargs):
+                    sock = self.sock # Released by getresponse when the server closes the connection
+                    res = super().getresponse(*args, **kwargs)
+                    tlsContext.saveSession(sock) # TLS 1.3 tickets are received with the first response
+                    return res
+            
+            class TLSSessionPool(HTTPSConnectionPool):
+                ConnectionCls = TLSSessionConnection
+            
+            adapter.poolmanager.pool_classes_by_scheme = dict(adapter.poolmanager.pool_classes_by_scheme, https=TLSSessionPool)
+            adapter.poolmanager.connection_pool_kw["ssl_context"] = tlsContext # Shared so TLS sessions are resumed across connections
+        
+        session = requests.Session()
+        session.verify = False
+        session.mount(target.scheme + "://", adapter)
+        
+        if not _httpSessionConfig["keepAlive"]:
+            session.headers["Connection"] = "close"
+        
+        _httpSessions[key] = session
+        
+    return session
+
+def _discardResponse(res, maxSize=65536):
+    """
+    Reads and drops a response body that won't be used so the connection goes back to the session pool.  Bodies larger than maxSize are not 
+    worth reading and close the connection instead.
+    
+    Args:
+        res (requests.Response):  The streamed response.
+        maxSize (int):  Maximum number of bytes to read.
+    """
+    
+    try:
+        size = 0
+        for chunk in res.iter_content(8192):
+            size += len(chunk)
+            if size > maxSize:
+                break
+    except Exception:
+        pass # The connection is closed below
+    finally:
+        res.close()
+
+def sendHTTPRequest(url, type="POST", params=None, jsonData=None, origin=None, groupName=None, isStream=True, headers=None, timeout=None, compress=False, retries=None):
+    """
+    Sends a HTTP request to a remote host.
+    
+    Args:
+        url (str):  The address to submit the request.
+        type (str):  The HTTP method of the request (default to POST).
+        params (str): query string-like values of name/value pairs.
+        jsonData (dict): Dictionary object to be converted to JSON string
+        origin (str): The origination of the request (for context)
+        groupName (str): The name of the group originating the request (for context)
+        isStream (bool): indicates if the request is expected to return a stream object or a static response.
+        headers (dict): Name/Value pairs for headers
+        timeout (float or tuple): Seconds to wait as a single value or (connect, read) tuple.  Defaults to the configureHTTPSessions() values.
+        compress (bool): Gzip the request body when it is at least the configured compressMinSize (the receiver must support Content-Encoding).
+        retries (int): Retries on connection failures (e.g. 0 for a quick probe).  Defaults to the configureHTTPSessions() value.
+        
+    Returns:
+        (bool, contentType, contentObject): Status of request (True for success; HTTP content type of response; Object value or stream pointer of response.
+    """
+    
+    #FIXME: Add context to request!
+    
+
+    #url = 'https://localhost:8031/requests'
+    #mydata = {'somekey': 'somevalue'}
+    import requests
+    
+    logger = logging.getLogger("HTTP")
+
+    request_body = None
     
     try:
         if jsonData is not None:
@@ -428,71 +1884,899 @@ def sendHTTPRequest(url, type="POST", params=None, jsonData=None, origin=None, g
                 headers = {}
                 
             headers["Content-Type"] = "application/json" #, "X-CLIENT-URL": context.clientURL, "X-BRAIN-URL": context.brainURL }
-            request_body = json.dumps(jsonData)
+            request_body = jsonDumps(jsonData)
         else:
             if params is not None and isinstance(params, dict):
                 request_body = urlencode(params)
         
-        if origin is not None:
-            if headers is None:
-                headers = {}
+        if origin is not None:
+            if headers is None:
+                headers = {}
+            
+            headers["X-ORIGIN"] = str(origin)
+
+        if groupName is not None:
+            if headers is None:
+                headers = {}
+            
+            headers["X-GROUP"] = str(groupName)
+        
+        if compress and request_body is not None and len(request_body) >= _httpSessionConfig["compressMinSize"]:
+            request_body = compressBody(request_body.encode() if isinstance(request_body, str) else request_body, "gzip")
+            headers = dict(headers) if headers is not None else {}
+            headers["Content-Encoding"] = "gzip"
+        
+        if timeout is None:
+            timeout = (_httpSessionConfig["connectTimeout"], _httpSessionConfig["readTimeout"])
+        
+        session = getHTTPSession(url, retries=retries)
+        if type == "GET": # Doesn't send request body
+            res = session.get(url, headers=headers, verify=False, stream=isStream, timeout=timeout)
+        else:
+            res = session.post(url, data=request_body, headers=headers, verify=False, stream=isStream, timeout=timeout)
+        
+        ret_val = True
+        if res.ok:
+            try:
+                if res.is_redirect or res.is_permanent_redirect:
+                    _discardResponse(res)
+                    return False, "text/html", "An error occurred in the HTTP request" # We don't support redirects
+                
+                ret_type = str(res.headers.get("content-type") or "").split(";",1)[0].strip().lower()
+                if ret_type == "application/json":
+                    res_obj = jsonLoads(res.content) # Parsed once
+                    if isinstance(res_obj, dict) and "error" in res_obj and "message" in res_obj:
+                        ret_val = not res_obj["error"]
+                        
+                    return ret_val, res.headers.get("content-type"), res_obj # returns as a dict
+                
+                # Else!
+                if ret_type.startswith("text/"):
+                    return True, ret_type, res.text # returns as a string
+                elif ret_type == "multipart/x-mixed-replace":
+                    return True, res.headers.get("content-type"), res # returns as request item
+                else:
+                    return True, res.headers.get("content-type"), res.content # returns as bytes
+                        
+            except:
+                logger.error("Unable to parse response from " + str(url) + "")
+                return False, res.headers.get("content-type"), res.text
+        else:
+            logger.error("Request failed for " + str(url) + "")
+            _discardResponse(res)
+            return False, "text/html", "An error occurred in the HTTP request"
+
+    except requests.exceptions.Timeout:
+        logger.error("Request Timed Out: " + url)
+    except requests.exceptions.ConnectionError:
+        logger.error("Connection Failed: " + url)
+    except:
+        logger.error(str(sys.exc_info()[0]))
+        logger.error(str(traceback.format_exc()))
+
+    return False, "text/html", "An error occurred in the HTTP request"
+
+_responseDefaultHeaders = [
+        ("Access-Control-Allow-Origin", "*"),
+        ("Cache-Control", "no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0"),
+        ("Expires", "Mon, 1 Jan 2020 00:00:00 GMT"),
+        ("Pragma", "no-cache")
+    ]
+_responseHeaderCache = {}           # (status, message, content type, overridden defaults) => encoded header block
+_responseDate = (0, "")             # (second, formatted date) for the Date header
+
+def httpDate():
+    """
+    Returns the current time formatted for the HTTP Date header.  The value is only reformatted once per second.
+    
+    Returns:
+        (str):  The date in RFC 7231 format.
+    """
+    
+    global _responseDate
+    
+    now = int(time.time())
+    if _responseDate[0] != now:
+        _responseDate = (now, formatdate(timeval=now, localtime=False, usegmt=True))
+        
+    return _responseDate[1]
+
+def responseHeaderBlock(httpStatusCode, httpStatusMessage, contentType, headers=None):
+    """
+    Returns the encoded status line and static default headers for a response, cached per status and content type.
+    
+    Args:
+        httpStatusCode (int):  The HTTP status code.
+        httpStatusMessage (str):  The HTTP status message.
+        contentType (str):  The content type of the response body (None to omit).
+        headers (dict):  Additional headers; any default header named here is left out of the block.
+        
+    Returns:
+        (bytes):  The status line and default headers.
+    """
+    
+    overridden = tuple(x for x in ["Content-Type"] + [h[0] for h in _responseDefaultHeaders] if x in headers) if headers is not None else ()
+    key = (httpStatusCode, httpStatusMessage, contentType, overridden)
+    
+    block = _responseHeaderCache.get(key)
+    if block is None:
+        response_status = str(httpStatusCode) + " " + str(httpStatusMessage)
+        response_status = response_status.replace("(","").replace(")","").replace("'","").replace(",","")
+        
+        lines = ["HTTP/1.1 " + response_status]
+        if contentType is not None and "Content-Type" not in overridden:
+            lines.append("Content-Type: " + str(contentType))
+            
+        for name, value in _responseDefaultHeaders:
+            if name not in overridden:
+                lines.append(name + ": " + value)
+        
+        block = ("\r\n".join(lines) + "\r\n").encode()
+        if len(_responseHeaderCache) < 256: # Content types come from code, but don't let unusual ones grow the cache forever
+            _responseHeaderCache[key] = block
+        
+    return block
+
+def sendBuffers(sock, parts):
+    """
+    Writes several buffers to a socket, using a single sendmsg call where the socket supports it.
+    
+    Args:
+        sock (socket):  The socket to write to.
+        parts (list):  Byte-like objects to send in order (None values are skipped).
+    """
+    
+    views = [memoryview(x).cast("B") for x in parts if x is not None]
+    views = [x for x in views if x.nbytes > 0]
+    
+    if len(views) > 1 and hasattr(sock, "sendmsg"):
+        try:
+            while len(views) > 0:
+                sent = sock.sendmsg(views)
+                while sent > 0 and len(views) > 0: # Skip past whatever was written on a partial send
+                    if sent >= views[0].nbytes:
+                        sent -= views[0].nbytes
+                        views.pop(0)
+                    else:
+                        views[0] = views[0][sent:]
+                        sent = 0
+            return
+        except NotImplementedError: # SSL sockets do not support sendmsg
+            pass
+    
+    if len(views) == 1:
+        sock.sendall(views[0])
+    elif len(views) > 1:
+        sock.sendall(b"".join(views))
+
+def sendFileBody(sock, fileObject, length, chunkSize=65536):
+    """
+    Sends the contents of an open file to a socket, using sendfile where the socket supports it.
+    
+    Args:
+        sock (socket):  The socket to write to.
+        fileObject (file):  The open binary file positioned at the start of the data.
+        length (int):  The number of bytes to send.
+        chunkSize (int):  Bytes per read when sendfile is not available.
+    """
+    
+    if hasattr(sock, "sendfile"):
+        sock.sendfile(fileObject, offset=fileObject.tell(), count=length)
+        return
+    
+    remaining = length
+    while remaining > 0:
+        data = fileObject.read(min(chunkSize, remaining))
+        if not data:
+            break
+        
+        sock.sendall(data)
+        remaining -= len(data)
+
+_compressibleTypes = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+def acceptedEncoding(acceptEncoding, supported=("gzip","deflate")):
+    """
+    Picks the preferred content coding from an Accept-Encoding header.
+    
+    Args:
+        acceptEncoding (str):  The Accept-Encoding header value.
+        supported (tuple):  Codings the server can produce in order of preference.
+        
+    Returns:
+        (str):  The chosen coding or None if the body should be sent as-is.
+    """
+    
+    if acceptEncoding is None or acceptEncoding == "":
+        return None
+    
+    weights = {}
+    for item in str(acceptEncoding).lower().split(","):
+        name, sep, params = item.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, sep, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        
+        name = name.strip()
+        weights["gzip" if name == "x-gzip" else name] = weight
+    
+    best = None
+    for name in supported:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > weights.get(best, weights.get("*", 0.0))):
+            best = name
+            
+    return best
+
+def compressBody(data, encoding, level=6):
+    """
+    Compresses a body for the given content coding.
+    
+    Args:
+        data (bytes):  The uncompressed body.
+        encoding (str):  "gzip" or "deflate".
+        level (int):  The zlib compression level (1-9).
+        
+    Returns:
+        (bytes):  The compressed body.
+    """
+    
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    else:
+        raise ValueError("Unsupported content encoding: " + str(encoding))
+    
+    return compressor.compress(data) + compressor.flush()
+
+def decompressBody(data, encoding, maxSize=16777216):
+    """
+    Decompresses a request body sent with a Content-Encoding header.  Output is capped so a small compressed body cannot expand without limit.
+    
+    Args:
+        data (bytes):  The compressed body.
+        encoding (str):  The Content-Encoding header value.
+        maxSize (int):  Maximum size in bytes of the decompressed body.
+        
+    Returns:
+        (bytes):  The decompressed body.
+    """
+    
+    encoding = str(encoding).strip().lower()
+    if encoding in ["", "identity"]:
+        return data
+    
+    if encoding in ["gzip", "x-gzip"]:
+        wbits = [16 + zlib.MAX_WBITS]
+    elif encoding == "deflate":
+        wbits = [zlib.MAX_WBITS, -zlib.MAX_WBITS] # Some clients send raw deflate without the zlib wrapper
+    else:
+        raise HTTPRequestError("Unsupported content encoding.", 415, "Unsupported Media Type")
+    
+    for bits in wbits:
+        try:
+            decompressor = zlib.decompressobj(bits)
+            body = decompressor.decompress(data, maxSize + 1)
+        except zlib.error:
+            continue
+        
+        if len(body) > maxSize or decompressor.unconsumed_tail:
+            raise HTTPRequestError("Request body too large.", 413, "Payload Too Large")
+        
+        return body
+    
+    raise HTTPRequestError("Invalid compressed request body.")
+
+class StaticFileServer(object):
+    """
+    Serves static files (e.g. the /admin control panel) with an in-memory LRU cache, conditional requests and precompressed variants.
+    """
+    
+    def __init__(self, rootFolder, maxCacheSize=8388608, maxCachedFileSize=262144, maxAge=0):
+        """
+        Static File Server Initialization
+        
+        Args:
+            rootFolder (str):  The folder that requested paths are relative to.
+            maxCacheSize (int):  Maximum total bytes of file contents kept in memory.
+            maxCachedFileSize (int):  Files larger than this are sent from disk with sendfile instead of being cached.
+            maxAge (int):  Seconds browsers may use a file without revalidating it.
+        """
+        
+        self.rootFolder = os.path.abspath(rootFolder)
+        self.maxCacheSize = maxCacheSize
+        self.maxCachedFileSize = maxCachedFileSize
+        self.maxAge = maxAge
+        self.logger = logging.getLogger("STATIC")
+        
+        self.mimeTypes = {
+                ".html": "text/html",
+                ".htm": "text/html",
+                ".css": "text/css",
+                ".js": "application/javascript",
+                ".json": "application/json",
+                ".txt": "text/plain",
+                ".ico": "image/x-icon",
+                ".jpg": "image/jpeg",
+                ".gif": "image/gif",
+                ".png": "image/png",
+                ".bmp": "image/bmp",
+                ".svg": "image/svg+xml",
+                ".woff": "font/woff",
+                ".woff2": "font/woff2",
+                ".mp3": "audio/mp3",
+                ".mp4": "video/mp4"
+            }
+        
+        self._cache = collections.OrderedDict()     # file name => (mtime, size, data) in least-recently-used order
+        self._cacheSize = 0
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.notModified = 0
+    
+    def _resolve(self, path):
+        """
+        Maps a request path to a file inside the root folder.
+        
+        Args:
+            path (str):  The percent-encoded request path relative to the root folder.
+        
+        Returns:
+            (str):  The absolute file name or None if the path is outside the root folder.
+        """
+        
+        path = unquote(str(path))
+        if "\x00" in path:
+            return None
+        
+        fileName = os.path.abspath(os.path.join(self.rootFolder, str(path).lstrip("/")))
+        if fileName != self.rootFolder and not fileName.startswith(self.rootFolder + os.sep):
+            return None
+        
+        return fileName
+    
+    def _getCached(self, fileName, st):
+        """
+        Returns the cached contents of a file, loading it if missing or modified since it was cached.
+        """
+        
+        with self._lock:
+            entry = self._cache.get(fileName)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._cache.move_to_end(fileName)
+                self.hits += 1
+                return entry[2]
             
-            headers["X-ORIGIN"] = str(origin)
-
-        if groupName is not None:
-            if headers is None:
-                headers = {}
+            if entry is not None:
+                self._cacheSize -= len(entry[2])
+                del self._cache[fileName]
+        
+        data = getFileContents(fileName, "rb")
+        
+        with self._lock:
+            self.misses += 1
+            self._cache[fileName] = (st.st_mtime_ns, st.st_size, data)
+            self._cacheSize += len(data)
             
-            headers["X-GROUP"] = str(groupName)
+            while self._cacheSize > self.maxCacheSize and len(self._cache) > 1:
+                key, old = self._cache.popitem(last=False)
+                self._cacheSize -= len(old[2])
         
-        if type == "GET": # Doesn't send request body
-            res = requests.get(url, headers=headers, verify=False, stream=isStream)
-        else:
-            res = requests.post(url, data=request_body, headers=headers, verify=False, stream=isStream)
+        return data
+    
+    def contentType(self, fileName):
+        """
+        Returns the content type for a file name based on its extension.
+        """
         
-        ret_val = True
-        if res.ok:
+        ext = os.path.splitext(fileName)[1].lower()
+        if ext in self.mimeTypes:
+            return self.mimeTypes[ext]
+        
+        import mimetypes
+        return mimetypes.guess_type(fileName)[0] or "application/octet-stream"
+    
+    def serve(self, httpRequest, path):
+        """
+        Sends a static file in response to a request.
+        
+        Args:
+            httpRequest (KHTTPHandler):  The request to respond to.
+            path (str):  The file path relative to the root folder.
+            
+        Returns:
+            (bool):  True on success; False on failure
+        """
+        
+        fileName = self._resolve(path)
+        if fileName is None or not os.path.isfile(fileName):
+            return httpRequest.sendError()
+        
+        contentType = self.contentType(fileName)
+        
+        # Use a precompressed copy (e.g. app.js.br or app.js.gz) if the client accepts it
+        variants = { enc: fileName + ext for enc, ext in [("br", ".br"), ("gzip", ".gz")] if os.path.isfile(fileName + ext) }
+        encoding = acceptedEncoding(httpRequest.headers.get("accept-encoding"), supported=tuple(variants)) if len(variants) > 0 else None
+        if encoding is not None:
+            fileName = variants[encoding]
+        
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return httpRequest.sendError()
+        
+        etag = '"' + format(st.st_mtime_ns, "x") + "-" + format(st.st_size, "x") + ("-" + encoding if encoding is not None else "") + '"'
+        headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(timeval=st.st_mtime, localtime=False, usegmt=True),
+                "Cache-Control": ("max-age=" + str(self.maxAge) if self.maxAge > 0 else "no-cache"),
+                "Expires": None,
+                "Pragma": None,
+                "Vary": "Accept-Encoding"
+            }
+        
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        
+        if self.isNotModified(httpRequest, etag, st.st_mtime):
+            with self._lock:
+                self.notModified += 1
+            headers["Content-Length"] = None
+            return httpRequest.sendHTTP(contentType=None, httpStatusCode=304, httpStatusMessage="Not Modified", headers=headers)
+        
+        if st.st_size <= self.maxCachedFileSize:
+            data = self._getCached(fileName, st)
+            
+            headers["Accept-Ranges"] = "bytes"
+            byteRange = httpRequest.requestedRange(len(data), etag, headers["Last-Modified"])
+            if byteRange is False:
+                headers["Content-Range"] = "bytes */" + str(len(data))
+                return httpRequest.sendHTTP(contentType=None, httpStatusCode=416, httpStatusMessage="Range Not Satisfiable", headers=headers)
+            
+            if byteRange is not None:
+                headers["Content-Range"] = "bytes " + str(byteRange[0]) + "-" + str(byteRange[1]) + "/" + str(len(data))
+                return httpRequest.sendHTTP(memoryview(data)[byteRange[0]:byteRange[1]+1], contentType=contentType, httpStatusCode=206, httpStatusMessage="Partial Content", headers=headers)
+            
+            return httpRequest.sendHTTP(data, contentType=contentType, headers=headers)
+        
+        with open(fileName, "rb") as fp:
+            return httpRequest.sendFile(fp, contentType=contentType, headers=headers, etag=etag, lastModified=headers["Last-Modified"])
+    
+    def isNotModified(self, httpRequest, etag, mtime):
+        """
+        Checks the conditional request headers against the current version of a file.
+        
+        Returns:
+            (bool):  True if the client's copy is current.
+        """
+        
+        ifNoneMatch = httpRequest.headers.get("if-none-match")
+        if ifNoneMatch is not None:
+            tags = [x.strip() for x in ifNoneMatch.split(",")]
+            return "*" in tags or etag in tags or ("W/" + etag) in tags
+        
+        ifModifiedSince = httpRequest.headers.get("if-modified-since")
+        if ifModifiedSince is not None:
+            from email.utils import parsedate_to_datetime
             try:
-                if res.is_redirect or res.is_permanent_redirect:
-                    return False # We don't support redirects
-                
-                ret_type, ret_param = parse_header(res.headers.get("content-type"))
-                if ret_type == "application/json":
-                    res_obj = res.json()
-                    if "error" in res_obj and "message" in res_obj:
-                        result = res_obj
-                        ret_val = not result["error"]
-                        
-                    return ret_val, res.headers.get("content-type"), res.json() # returns as a dict
-                
-                # Else!
-                if ret_type.startswith("text/"):
-                    return True, ret_type, res.text # returns as a string
-                elif ret_type == "multipart/x-mixed-replace":
-                    return True, res.headers.get("content-type"), res # returns as request item
-                else:
-                    return True, res.headers.get("content-type"), res.content # returns as bytes
-                        
-            except:
-                logger.error("Unable to parse response from " + str(url) + "")
-                return False, res.headers.get("content-type"), res.text
+                return int(mtime) <= parsedate_to_datetime(ifModifiedSince).timestamp()
+            except (TypeError, ValueError):
+                return False
+        
+        return False
+    
+    def stats(self):
+        """
+        Returns cache counters.
+        
+        Returns:
+            (dict):  Cache size, entry count and hit/miss/304 counters.
+        """
+        
+        with self._lock:
+            return { "entries": len(self._cache), "size": self._cacheSize, "maxSize": self.maxCacheSize, "hits": self.hits, "misses": self.misses, "notModified": self.notModified }
+
+class HTTPRequestError(Exception):
+    """
+    Raised when an inbound HTTP request cannot be parsed or exceeds the configured limits.
+    """
+    
+    def __init__(self, message, httpStatusCode=400, httpStatusMessage="Bad Request"):
+        super(HTTPRequestError, self).__init__(message)
+        self.httpStatusCode = httpStatusCode
+        self.httpStatusMessage = httpStatusMessage
+
+class HTTPHeaders(dict):
+    """
+    Dictionary of HTTP headers with case-insensitive names.
+    """
+    
+    def __setitem__(self, key, value):
+        super(HTTPHeaders, self).__setitem__(str(key).lower(), value)
+        
+    def __getitem__(self, key):
+        return super(HTTPHeaders, self).__getitem__(str(key).lower())
+    
+    def __contains__(self, key):
+        return super(HTTPHeaders, self).__contains__(str(key).lower())
+    
+    def get(self, key, default=None):
+        return super(HTTPHeaders, self).get(str(key).lower(), default)
+
+def parseHTTPRequestHead(data):
+    """
+    Parses the request line, query string, headers and cookies of a raw HTTP request in a single pass.
+    
+    Args:
+        data (bytes):  The request head up to and including the blank line that ends the headers.
+        
+    Returns:
+        (dict):  The "command", "path", "query", "version", "headers" (case-insensitive) and "cookies" of the request or None if the request line is invalid.
+    """
+    
+    lines = bytes(data).decode("iso-8859-1").split("\n")
+    words = lines[0].rstrip("\r").split(" ")
+    
+    if len(words) != 3 or not words[2].startswith("HTTP/"):
+        return None
+    
+    path, sep, queryString = words[1].partition("?")
+    
+    headers = HTTPHeaders()
+    for line in lines[1:]:
+        line = line.rstrip("\r")
+        if line == "":
+            break
+        
+        name, sep, value = line.partition(":")
+        if sep == "":
+            continue # Not a header line
+        
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            headers[name] = headers[name] + ("; " if name == "cookie" else ", ") + value
         else:
-            logger.error("Request failed for " + str(url) + "")
-            return False, "text/html", "An error occurred in the HTTP request"
+            headers[name] = value
+    
+    cookies = {}
+    if "cookie" in headers:
+        for item in headers["cookie"].split(";"):
+            key, sep, keyVal = item.partition("=") # Values may contain "="
+            if sep != "":
+                cookies[key.strip()] = keyVal.strip()
+    
+    return { 
+        "command": words[0], 
+        "path": path, 
+        "query": parse_qs(queryString) if queryString != "" else {}, 
+        "version": words[2], 
+        "headers": headers, 
+        "cookies": cookies 
+    }
+
+def requestBodyLength(headers, maxBodySize=None):
+    """
+    Determines how the body of a request is framed.  Requests that could be read differently by another server (e.g. with both Content-Length 
+    and Transfer-Encoding) are rejected so they cannot desynchronize a persistent connection.
+    
+    Args:
+        headers (HTTPHeaders):  The request headers.
+        maxBodySize (int):  Maximum size in bytes of a request body.
+        
+    Returns:
+        (int):  The Content-Length (0 if there is no body) or None for a chunked body.
+    """
+    
+    transferEncoding = headers.get("transfer-encoding")
+    contentLength = headers.get("content-length")
+    
+    if transferEncoding is not None:
+        if contentLength is not None:
+            raise HTTPRequestError("Content-Length and Transfer-Encoding cannot be combined.")
+        
+        if [x.strip().lower() for x in transferEncoding.split(",")] != ["chunked"]:
+            raise HTTPRequestError("Unsupported transfer encoding.", 501, "Not Implemented")
+        
+        return None
+    
+    if contentLength is None:
+        return 0
+    
+    values = set(x.strip() for x in contentLength.split(",")) # Repeated headers are joined with commas
+    if len(values) != 1 or not next(iter(values)).isdigit():
+        raise HTTPRequestError("Invalid content length.")
+    
+    length = int(next(iter(values)))
+    if maxBodySize is not None and length > maxBodySize:
+        raise HTTPRequestError("Request body too large.", 413, "Payload Too Large")
+    
+    return length
 
-    except requests.exceptions.ConnectionError:
-        logger.error("Connection Failed: " + url)
-    except:
-        logger.error(str(sys.exc_info()[0]))
-        logger.error(str(traceback.format_exc()))
+def parseChunkSize(line):
+    """
+    Parses the size line of a chunk in a chunked request body (extensions after ";" are ignored).
+    
+    Args:
+        line (bytes):  The size line including its line ending.
+        
+    Returns:
+        (int):  The size of the chunk in bytes (0 for the last chunk).
+    """
+    
+    if not line.endswith(b"\n"):
+        raise HTTPRequestError("Incomplete request body.")
+    
+    size = line.split(b";", 1)[0].strip()
+    if re.fullmatch(rb"[0-9A-Fa-f]{1,16}", size) is None:
+        raise HTTPRequestError("Invalid chunk size.")
+    
+    return int(size, 16)
 
-    return False, "text/html", "An error occurred in the HTTP request"
+def readChunkedBody(readLine, read, maxBodySize=None):
+    """
+    Reads and decodes a chunked request body.  Trailer fields are discarded.
+    
+    Args:
+        readLine (function):  Returns the next line from the connection including its line ending.
+        read (function):  Returns the given number of bytes from the connection (fewer only if the connection closed).
+        maxBodySize (int):  Maximum size in bytes of the decoded body.
+        
+    Returns:
+        (bytes):  The decoded body.
+    """
+    
+    body = bytearray()
+    while True:
+        size = parseChunkSize(readLine())
+        if size == 0:
+            break
+        
+        if maxBodySize is not None and len(body) + size > maxBodySize:
+            raise HTTPRequestError("Request body too large.", 413, "Payload Too Large")
+        
+        chunk = read(size + 2)
+        if len(chunk) != size + 2 or chunk[-2:] != b"\r\n":
+            raise HTTPRequestError("Invalid chunk.")
+        
+        body += chunk[:-2]
+    
+    while True:
+        line = readLine()
+        if not line.endswith(b"\n"):
+            raise HTTPRequestError("Incomplete request body.")
+        
+        if line.strip() == b"":
+            return bytes(body)
 
-class KHTTPHandler(BaseHTTPRequestHandler):
-    def __init__(self, container, sock=None, address=("localhost",0), raw_request=None, origin=None):
+class HTTPRequestReader(object):
+    """
+    Incremental reader for HTTP/1.x requests on a socket.  Data received past the end of one request is kept for the next (pipelining).
+    """
+    
+    def __init__(self, sock, maxHeaderSize=65536, maxBodySize=16777216, bufferSize=65536):
+        """
+        HTTP Request Reader Initialization
+        
+        Args:
+            sock (socket):  The TCP socket for the connection.
+            maxHeaderSize (int):  Maximum size in bytes of the request line and headers.
+            maxBodySize (int):  Maximum size in bytes of a request body.
+            bufferSize (int):  Bytes requested from the socket per read.
+        """
         
-        self.container = container
         self.socket = sock
+        self.maxHeaderSize = maxHeaderSize
+        self.maxBodySize = maxBodySize
+        self.bufferSize = bufferSize
+        self._buffer = bytearray()
+        self._scanned = 0       # Bytes already searched for the end of the headers
+        
+    def _recv(self):
+        data = self.socket.recv(self.bufferSize)
+        if data:
+            self._buffer += data
+            
+        return len(data) > 0
+        
+    def readRequest(self):
+        """
+        Reads the next request head from the connection.
+        
+        Returns:
+            (dict):  The parsed request (see parseHTTPRequestHead) or None if the client closed the connection.
+        """
+        
+        while True:
+            # Ignore empty lines between requests
+            while self._buffer[:2] == b"\r\n":
+                del self._buffer[:2]
+                self._scanned = max(0, self._scanned - 2)
+                
+            idx = self._buffer.find(b"\r\n\r\n", max(0, self._scanned - 3))
+            if self.maxHeaderSize is not None and (idx + 4 if idx >= 0 else len(self._buffer)) > self.maxHeaderSize:
+                raise HTTPRequestError("Request headers too large.", 431, "Request Header Fields Too Large")
+            
+            if idx >= 0:
+                head = bytes(self._buffer[:idx+4])
+                del self._buffer[:idx+4]
+                self._scanned = 0
+                
+                request = parseHTTPRequestHead(head)
+                if request is None:
+                    raise HTTPRequestError("Invalid request line.")
+                
+                requestBodyLength(request["headers"], self.maxBodySize) # Rejects ambiguous framing before anything else is read
+                return request
+            
+            self._scanned = len(self._buffer)
+            if not self._recv():
+                return None
+    
+    def hasBufferedData(self):
+        """
+        Returns True if data for the next request was already received (pipelined) and can be read without waiting on the socket.
+        """
+        
+        pending = getattr(self.socket, "pending", None) # Decrypted TLS data is invisible to select()
+        return len(self._buffer.strip(b"\r\n")) > 0 or (callable(pending) and pending() > 0)
+    
+    def readLine(self):
+        """
+        Reads one line (e.g. a chunk size) from the connection.
+        
+        Returns:
+            (bytes):  The line including its line ending or the remaining data if the connection closed first.
+        """
+        
+        start = 0
+        while True:
+            idx = self._buffer.find(b"\n", start)
+            if idx >= 0:
+                line = bytes(self._buffer[:idx+1])
+                del self._buffer[:idx+1]
+                return line
+            
+            if self.maxHeaderSize is not None and len(self._buffer) > self.maxHeaderSize:
+                raise HTTPRequestError("Line too long.")
+            
+            start = len(self._buffer)
+            if not self._recv():
+                line = bytes(self._buffer)
+                del self._buffer[:]
+                return line
+    
+    def read(self, length):
+        """
+        Reads up to length bytes from the connection (fewer only if the connection closed).
+        """
+        
+        while len(self._buffer) < length:
+            if not self._recv():
+                break
+        
+        data = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+    
+    def readChunkedBody(self):
+        """
+        Reads a request body sent with Transfer-Encoding: chunked from the connection.
+        
+        Returns:
+            (bytes):  The decoded request body.
+        """
+        
+        return readChunkedBody(self.readLine, self.read, self.maxBodySize)
+    
+    def readBody(self, length):
+        """
+        Reads a request body of a known length from the connection.
+        
+        Args:
+            length (int):  The number of bytes to read (from the Content-Length header).
+            
+        Returns:
+            (bytes):  The request body.
+        """
+        
+        if self.maxBodySize is not None and length > self.maxBodySize:
+            raise HTTPRequestError("Request body too large.", 413, "Payload Too Large")
+        
+        while len(self._buffer) < length:
+            if not self._recv():
+                raise HTTPRequestError("Incomplete request body.")
+        
+        body = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return body
+
+class AsyncStreamSocket(object):
+    """
+    Socket-like wrapper around an asyncio stream writer so that KHTTPHandler responses can be sent from executor threads.
+    """
+    
+    def __init__(self, loop, writer):
+        """
+        Async Stream Socket Initialization
+        
+        Args:
+            loop (asyncio.AbstractEventLoop):  The event loop that owns the writer.
+            writer (asyncio.StreamWriter):  The stream for the client connection.
+        """
+        self.loop = loop
+        self.writer = writer
+        self.closed = False
+        self._loopThread = threading.get_ident() # Created on the event loop's thread
+        
+    def _call(self, fn, *args):
+        if self.closed:
+            raise OSError("Socket is closed")
+        
+        if threading.get_ident() == self._loopThread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+    
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+        
+    def send(self, data):
+        if self.closed:
+            raise OSError("Socket is closed")
+        
+        data = bytes(data)
+        if threading.get_ident() == self._loopThread:
+            self.writer.write(data)
+        else:
+            # Wait for the transport buffer to drain so large bodies are not queued in memory
+            import asyncio
+            asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+            
+        return len(data)
+    
+    def sendall(self, data):
+        self.send(data)
+        return None
+    
+    def settimeout(self, value):
+        pass
+    
+    def shutdown(self, how=None):
+        pass
+    
+    def close(self):
+        if not self.closed:
+            self._call(self.writer.close)
+            self.closed = True
+
+class KHTTPHandler(object):
+    def __init__(self, container, sock=None, address=("localhost",0), raw_request=None, origin=None, request=None, allowKeepAlive=False, reader=None):
+        """
+        Request Handler Initialization
+        
+        Args:
+            container (karen.templates.Container):  The container receiving the request.
+            sock (socket):  The TCP socket for the connection.
+            address (tuple):  The originating IP address and port for the request.
+            raw_request (file):  File-like object to parse the request from.
+            origin (str):  The origination of the request (for context)
+            request (dict):  Pre-parsed request as returned by parseHTTPRequestHead(), optionally with the raw "body" bytes added. (optional)
+            allowKeepAlive (bool):  Indicates if the server will keep the connection open after the response when the client asks for it.
+            reader (HTTPRequestReader):  Connection reader used to read the body on demand when it is not included in the request. (optional)
+        """
+        
+        self.container = container
+        self._socket = sock
         self.address = address # tuple (ip, port)
         self.authenticated = False 
         
@@ -500,15 +2784,35 @@ class KHTTPHandler(BaseHTTPRequestHandler):
             self.authenticated = True
              
         self.rfile = raw_request
-        self.raw_requestline = self.rfile.readline() if raw_request is not None else None # first line of request e.g. "GET /index.html"
+        self._reader = reader
+        self._body = None
+        self._rawBody = None
+        self.bodyError = None
+        self.raw_requestline = None
         self.error_code = None
         self.error_message = None
+        self.command = None
         self.path = None
-        self.headers = {}
+        self.request_version = None
+        self.headers = HTTPHeaders()
+        self.cookies = {}
+        self.getVars = {}
+
+        if request is None and raw_request is not None:
+            request = self._readRequestHead()
+        
+        if request is not None:
+            self.command = request["command"]
+            self.path = request["path"]
+            self.request_version = request["version"]
+            self.headers = request["headers"]
+            self.cookies = request["cookies"]
+            self.getVars = request["query"]
+            if "body" in request and request["body"] is not None:
+                self._rawBody = request["body"]
 
         self.isJSON = False
         self.JSON = None
-        self.getVars = {}
 
         self.isFileRequest = False
         self.isDeviceRequest = False
@@ -522,6 +2826,8 @@ class KHTTPHandler(BaseHTTPRequestHandler):
         self.groupName = None
         
         self.isResponseSent = False
+        self.keepAlive = False
+        self.detached = False   # The socket was handed to a device (e.g. for streaming) which now owns it
         
         self.mimeTypes = {
                 ".jpg": "image/jpeg",
@@ -533,190 +2839,402 @@ class KHTTPHandler(BaseHTTPRequestHandler):
                 ".mp4": "video/mp4"
             }
         
-        if self.rfile is not None:
-            self.parse_request()
+        if allowKeepAlive and self.command is not None:
+            connection = str(self.headers.get("connection") or "").lower()
+            if self.request_version == "HTTP/1.1":
+                self.keepAlive = "close" not in connection
+            else:
+                self.keepAlive = "keep-alive" in connection
         
-        if self.path is not None:
-            self.getVars = parse_qs(urlparse(self.path).query)
-            self.path = urlparse(self.path).path
-            
         if self.headers.get('content-type') is not None:
-            ctype = parse_header(self.headers.get('content-type'))[0]
-            if ctype == "application/json":
+            if self.headers.get('content-type').split(";",1)[0].strip().lower() == "application/json":
                 self.isJSON = True
                 
         if self.headers.get('x-origin') is not None:
-            self.origin = parse_header(self.headers.get("x-origin"))[0]
+            self.origin = self.headers.get("x-origin").split(";",1)[0].strip()
 
         if self.origin is None or str(self.origin) == "": # If we aren't given one then we create an origin
             self.origin = self.container.my_url
 
         if self.headers.get('x-group') is not None:
-            self.groupName = parse_header(self.headers.get("x-group"))[0]
+            self.groupName = self.headers.get("x-group").split(";",1)[0].strip()
+        
+        if self.authenticated == False and "token" in self.cookies:
+            if self.cookies["token"] == self.container.authenticationKey:
+                self.authenticated = True
+    
+    def _readRequestHead(self):
+        """
+        Reads the request line and headers from a file-like raw request.
+        
+        Returns:
+            (dict):  The parsed request or None if no request was received.
+        """
+        
+        lines = []
+        try:
+            while True:
+                line = self.rfile.readline(65537)
+                if len(lines) == 0:
+                    self.raw_requestline = line # first line of request e.g. "GET /index.html"
+                    
+                if line in (b"", b"\r\n", b"\n"):
+                    break
+                
+                lines.append(line)
+        except (socket.timeout, OSError):
+            return None # Idle connection timed out or was reset
         
-        if self.authenticated == False and self.headers.get('cookie') is not None:
-            for item in self.headers.get("cookie").split(";"):
-                (key, keyVal) = item.split("=")
-                if key == "token" and keyVal == self.container.authenticationKey:
-                    self.authenticated = True
+        if len(lines) == 0:
+            return None
+        
+        return parseHTTPRequestHead(b"".join(lines) + b"\r\n")
                 
     def sendRedirect(self, url):
         if self.isResponseSent: # Bail if we already sent a response to requestor
             return True 
-
-        if self.socket is None:
-            return False 
-        
-        try:
-            self.socket.send(("HTTP/1.1 307 Temporary Redirect\nLocation: "+str(url)).encode())
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except:
-            pass
-        
-        self.socket.close()
-        self.isResponseSent = True
-        return True
+
+        self.keepAlive = False
+        return self.sendHTTP(contentType=None, httpStatusCode=307, httpStatusMessage="Temporary Redirect", headers={ "Location": str(url) })
         
     def sendError(self):
         if self.isResponseSent: # Bail if we already sent a response to requestor
             return True 
         
-        if self.socket is None:
-            return False 
+        self.keepAlive = False
+        return self.sendHTTP(contentType=None, httpStatusCode=404, httpStatusMessage="NOT FOUND")
+    
+    def _responseHead(self, contentType, httpStatusCode, httpStatusMessage, headers, contentLength=None):
+        """
+        Builds the encoded status line and headers for a response.
         
-        try:
-            self.socket.send("HTTP/1.1 404 NOT FOUND".encode())
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except:
-            pass
-
-        self.socket.close()
-        self.isResponseSent = True
-        return True
+        Args:
+            contentType (str):  The content type of the response body.
+            httpStatusCode (int):  The HTTP status code.
+            httpStatusMessage (str):  The HTTP status message.
+            headers (dict):  Additional headers which override the defaults.
+            contentLength (int):  The length of the response body or None if unknown.
+            
+        Returns:
+            (bytes):  The response head including the blank line that ends the headers.
+        """
+        
+        dynamic = "Date: " + httpDate() + "\r\n"
+        
+        if contentLength is not None and (headers is None or "Content-Length" not in headers):
+            dynamic += "Content-Length: " + str(contentLength) + "\r\n"
+        
+        if headers is None or "Connection" not in headers:
+            dynamic += "Connection: " + ("keep-alive" if self.keepAlive else "close") + "\r\n"
+        elif str(headers["Connection"]).lower() == "close":
+            self.keepAlive = False
+        
+        if headers is not None:
+            for h in headers:
+                if headers[h] is not None: # None removes a default header
+                    dynamic += str(h).strip() + ": " + str(headers[h]).strip() + "\r\n"
+        
+            #if "X-ORIGIN" not in headers:
+            #    dynamic += "X-ORIGIN: " + self.origin + "\r\n"
+        
+        return responseHeaderBlock(httpStatusCode, httpStatusMessage, contentType, headers) + (dynamic + "\r\n").encode()
+    
+    @property
+    def socket(self):
+        """
+        The connection's socket.  Taking it hands the connection to the caller: the server will not read further requests from it or close it.
+        """
+        
+        self.detached = True
+        return self._socket
+    
+    @socket.setter
+    def socket(self, value):
+        self._socket = value
     
     def sendHeaders(self, contentType="text/html", httpStatusCode=200, httpStatusMessage="OK", headers=None):
         if self.isResponseSent: # Bail if we already sent a response to requestor
-            return None 
+            return None
         
-        if self.socket is None:
+        if self._socket is None:
             return None 
         
+        self.keepAlive = False # Body length is unknown so the connection cannot be reused
+        self.detached = True # The caller writes the rest of the response to the returned socket
+        
         ret = True
         try:
-            response_status = str(httpStatusCode) + " " + str(httpStatusMessage)
-            response_status = response_status.replace("(","").replace(")","").replace("'","").replace(",","")
-        
-            response_headers = [
-                    "HTTP/1.1 " + response_status,
-                    "Date: "+time.strftime("%a, %d %b %Y %H:%M:%S %Z")
-                ]
-            
-            if (headers is None or "Content-Type" not in headers) and contentType is not None:
-                response_headers.append("Content-Type: "+contentType)
-            
-            if headers is None or "Access-Control-Allow-Origin" not in headers:
-                response_headers.append("Access-Control-Allow-Origin: *")
-            
-            if headers is None or "Cache-Control" not in headers:
-                response_headers.append("Cache-Control: no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0")
-
-            if headers is None or "Expires" not in headers:
-                response_headers.append("Expires: Mon, 1 Jan 2020 00:00:00 GMT")
-                
-            if headers is None or "Pragma" not in headers:
-                response_headers.append("Pragma: no-cache")
-            
-            if headers is not None:
-                for h in headers:
-                    response_headers.append(str(h).strip() + ": " + str(headers[h]).strip())
-            
-                #if "X-ORIGIN" not in headers:
-                #    response_headers.append("X-ORIGIN: " + self.origin)
-            
-            response_text = "\n".join(response_headers)
-            
-            response_text += "\n\n"
-            self.socket.send(response_text.encode())
+            self._socket.sendall(self._responseHead(contentType, httpStatusCode, httpStatusMessage, headers))
                 
-            #self.socket.shutdown(socket.SHUT_RDWR)
-            #self.socket.close()
-            ret = self.socket
+            #self._socket.shutdown(socket.SHUT_RDWR)
+            #self._socket.close()
+            ret = self._socket
         except:
-            self.socket.close()
+            self._socket.close()
             ret = None
 
         return ret
     
     def sendHTTP(self, contentBody=None, contentType="text/html", httpStatusCode=200, httpStatusMessage="OK", headers=None):
+        """
+        Sends a complete response.  The head and body are written together.  File bodies are sent with sendFile() and generators with sendChunked().
+        
+        Args:
+            contentBody (str, bytes, file or generator):  The response body.  Open binary files are sent from their current position.
+            contentType (str):  The content type of the response body.
+            httpStatusCode (int):  The HTTP status code.
+            httpStatusMessage (str):  The HTTP status message.
+            headers (dict):  Additional headers which override the defaults.  A value of None removes a default header.
+            
+        Returns:
+            (bool):  True on success; False on failure
+        """
+        
         if self.isResponseSent: # Bail if we already sent a response to requestor
             return True 
         
-        if self.socket is None:
+        if self._socket is None:
             return False 
         
+        if contentBody is not None and hasattr(contentBody, "read") and hasattr(contentBody, "fileno"):
+            return self.sendFile(contentBody, contentType=contentType, httpStatusCode=httpStatusCode, httpStatusMessage=httpStatusMessage, headers=headers, allowRanges=False)
+        
+        if contentBody is not None and not isinstance(contentBody, (str, bytes, bytearray, memoryview)) and (hasattr(contentBody, "__next__") or hasattr(contentBody, "read")):
+            return self.sendChunked(contentBody, contentType=contentType, httpStatusCode=httpStatusCode, httpStatusMessage=httpStatusMessage, headers=headers)
+        
         ret = True
         try:
-            response_status = str(httpStatusCode) + " " + str(httpStatusMessage)
-            response_status = response_status.replace("(","").replace(")","").replace("'","").replace(",","")
-            try:
-                if contentType.startswith("image/") or contentType.startswith("audio/") or contentType.startswith("video"):
-                    response_body = contentBody
-                else:
-                    response_body = contentBody.encode()
-            except (UnicodeDecodeError, AttributeError):
-                raise
+            if contentBody is None:
+                response_body = b""
+            elif isinstance(contentBody, str):
+                response_body = contentBody.encode()
+            else:
                 response_body = contentBody
+            
+            response_body, headers = self._compressResponse(response_body, contentType, httpStatusCode, headers)
+            
+            response_head = self._responseHead(contentType, httpStatusCode, httpStatusMessage, headers, memoryview(response_body).nbytes)
+            sendBuffers(self._socket, [response_head, response_body])
+            
+            if not self.keepAlive:
+                self._socket.shutdown(socket.SHUT_RDWR)
+                self._socket.close()
+        except:
+            self.keepAlive = False
+            self._socket.close()
+            ret = False
+    
+        self.isResponseSent = True
+        self.detached = False # Complete response written by the handler
+        return ret
+    
+    def _compressResponse(self, body, contentType, httpStatusCode, headers):
+        """
+        Compresses a response body when the client accepts it and the body is large enough to benefit.
         
-            response_headers = [
-                    "HTTP/1.1 " + response_status,
-                    "Date: "+time.strftime("%a, %d %b %Y %H:%M:%S %Z")
-                ]
+        Args:
+            body (bytes):  The uncompressed response body.
+            contentType (str):  The content type of the response body.
+            httpStatusCode (int):  The HTTP status code.
+            headers (dict):  Additional headers for the response.
             
-            if (headers is None or "Content-Type" not in headers) and contentType is not None:
-                response_headers.append("Content-Type: "+contentType)
+        Returns:
+            (tuple):  The body and headers to send.
+        """
+        
+        minSize = self.container.compress_min_size if self.container is not None else 0
+        if minSize is None or minSize <= 0 or memoryview(body).nbytes < minSize or httpStatusCode in [204, 206, 304]:
+            return body, headers
+        
+        if contentType is None or not str(contentType).lower().startswith(_compressibleTypes):
+            return body, headers
+        
+        # Responses that already carry an encoding or an entity tag (static files) are sent as they are
+        if headers is not None and ("Content-Encoding" in headers or "ETag" in headers):
+            return body, headers
+        
+        encoding = acceptedEncoding(self.headers.get("accept-encoding"))
+        if encoding is None:
+            return body, headers
+        
+        headers = dict(headers) if headers is not None else {}
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+        return compressBody(body, encoding, self.container.compress_level), headers
+    
+    def requestedRange(self, size, etag=None, lastModified=None):
+        """
+        Parses a single byte range from the Range header.
+        
+        Args:
+            size (int):  The full length of the content.
+            etag (str):  The current entity tag used to validate If-Range. (optional)
+            lastModified (str):  The current Last-Modified value used to validate If-Range. (optional)
             
-            if (headers is None or "Content-Length" not in headers) and contentBody is not None and len(contentBody) > 0:
-                response_headers.append("Content-Length: "+str(len(response_body)))
+        Returns:
+            (tuple):  (start, end) inclusive offsets, None to send the full content, or False if the range cannot be satisfied.
+        """
+        
+        value = self.headers.get("range")
+        if value is None or self.command not in ["GET", "HEAD"]:
+            return None
+        
+        ifRange = self.headers.get("if-range")
+        if ifRange is not None and ifRange.strip() not in [etag, lastModified]:
+            return None # Client's copy is outdated so it gets the whole thing
+        
+        unit, sep, spec = value.strip().partition("=")
+        if unit.strip().lower() != "bytes" or "," in spec: 
+            return None # Multiple ranges are not supported; send everything
+        
+        first, sep, last = spec.strip().partition("-")
+        try:
+            if first == "":
+                length = int(last)
+                if length <= 0:
+                    return False
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last != "" else size - 1
+        except ValueError:
+            return None
+        
+        if start >= size or end < start:
+            return False
+        
+        return start, min(end, size - 1)
+    
+    def sendFile(self, fileObject, contentType="application/octet-stream", httpStatusCode=200, httpStatusMessage="OK", headers=None, allowRanges=True, etag=None, lastModified=None):
+        """
+        Sends an open file as the response body with sendfile where available.  Supports single byte ranges (206 Partial Content).
+        
+        Args:
+            fileObject (file):  The open binary file positioned at the start of the content.
+            contentType (str):  The content type of the file.
+            httpStatusCode (int):  The HTTP status code for a full response.
+            httpStatusMessage (str):  The HTTP status message for a full response.
+            headers (dict):  Additional headers which override the defaults.
+            allowRanges (bool):  Honor the Range header.
+            etag (str):  Entity tag of the file for If-Range validation. (optional)
+            lastModified (str):  Last-Modified value of the file for If-Range validation. (optional)
             
-            if headers is None or "Access-Control-Allow-Origin" not in headers:
-                response_headers.append("Access-Control-Allow-Origin: *")
+        Returns:
+            (bool):  True on success; False on failure
+        """
+        
+        if self.isResponseSent: # Bail if we already sent a response to requestor
+            return True 
+        
+        if self._socket is None:
+            return False 
+        
+        ret = True
+        try:
+            base = fileObject.tell()
+            size = os.fstat(fileObject.fileno()).st_size - base
+            length = size
             
-            if headers is None or "Cache-Control" not in headers:
-                response_headers.append("Cache-Control: no-store, no-cache, must-revalidate, pre-check=0, post-check=0, max-age=0")
-
-            if headers is None or "Expires" not in headers:
-                response_headers.append("Expires: Mon, 1 Jan 2020 00:00:00 GMT")
+            headers = dict(headers) if headers is not None else {}
+            if allowRanges:
+                headers["Accept-Ranges"] = "bytes"
+                byteRange = self.requestedRange(size, etag, lastModified)
                 
-            if headers is None or "Pragma" not in headers:
-                response_headers.append("Pragma: no-cache")
+                if byteRange is False:
+                    headers["Content-Range"] = "bytes */" + str(size)
+                    return self.sendHTTP(contentType=None, httpStatusCode=416, httpStatusMessage="Range Not Satisfiable", headers=headers)
+                
+                if byteRange is not None:
+                    fileObject.seek(base + byteRange[0])
+                    length = byteRange[1] - byteRange[0] + 1
+                    headers["Content-Range"] = "bytes " + str(byteRange[0]) + "-" + str(byteRange[1]) + "/" + str(size)
+                    httpStatusCode = 206
+                    httpStatusMessage = "Partial Content"
             
-            if headers is not None:
-                for h in headers:
-                    response_headers.append(str(h).strip() + ": " + str(headers[h]).strip())
+            self._socket.sendall(self._responseHead(contentType, httpStatusCode, httpStatusMessage, headers, length))
+            sendFileBody(self._socket, fileObject, length)
             
-                #if "X-ORIGIN" not in headers:
-                #    response_headers.append("X-ORIGIN: " + self.origin)
+            if not self.keepAlive:
+                self._socket.shutdown(socket.SHUT_RDWR)
+                self._socket.close()
+        except:
+            self.keepAlive = False
+            self._socket.close()
+            ret = False
+        
+        self.isResponseSent = True
+        self.detached = False # Complete response written by the handler
+        return ret
+    
+    def sendChunked(self, contentBody, contentType="application/octet-stream", httpStatusCode=200, httpStatusMessage="OK", headers=None, chunkSize=65536):
+        """
+        Streams a response of unknown length using chunked transfer encoding so the whole body never needs to be in memory.
+        
+        Args:
+            contentBody (generator or file):  Iterable of bytes/str chunks or a file-like object to read chunkSize bytes at a time.
+            contentType (str):  The content type of the response body.
+            httpStatusCode (int):  The HTTP status code.
+            httpStatusMessage (str):  The HTTP status message.
+            headers (dict):  Additional headers which override the defaults.
+            chunkSize (int):  Bytes per read when contentBody is a file-like object.
             
-            response_text = "\n".join(response_headers)
+        Returns:
+            (bool):  True on success; False on failure
+        """
+        
+        if self.isResponseSent: # Bail if we already sent a response to requestor
+            return True 
+        
+        if self._socket is None:
+            return False 
+        
+        if hasattr(contentBody, "read"):
+            fileObject = contentBody
+            contentBody = iter(lambda: fileObject.read(chunkSize), b"")
+        
+        # HTTP/1.0 clients do not understand chunks; the end of the body is marked by closing the connection instead
+        useChunks = self.request_version == "HTTP/1.1"
+        if not useChunks:
+            self.keepAlive = False
+        
+        headers = dict(headers) if headers is not None else {}
+        if useChunks:
+            headers["Transfer-Encoding"] = "chunked"
+        
+        ret = True
+        try:
+            self._socket.sendall(self._responseHead(contentType, httpStatusCode, httpStatusMessage, headers))
             
-            if contentBody is not None and contentBody is not None:
-                response_text += "\n\n"
-                self.socket.send(response_text.encode())
-                self.socket.send(response_body)
-            else:
-                self.socket.send(response_text.encode())
+            for chunk in contentBody:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
                 
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
+                size = memoryview(chunk).nbytes
+                if size == 0:
+                    continue
+                
+                if useChunks:
+                    sendBuffers(self._socket, [format(size, "x").encode() + b"\r\n", chunk, b"\r\n"])
+                else:
+                    self._socket.sendall(chunk)
+            
+            if useChunks:
+                self._socket.sendall(b"0\r\n\r\n")
+            
+            if not self.keepAlive:
+                self._socket.shutdown(socket.SHUT_RDWR)
+                self._socket.close()
         except:
-            self.socket.close()
+            self.keepAlive = False
+            self._socket.close()
             ret = False
-    
+        
         self.isResponseSent = True
+        self.detached = False # Complete response written by the handler
         return ret
     
     def sendJSON(self, contentBody=None, contentType="application/json", httpStatusCode=200, httpStatusMessage="OK", headers=None):
-        return self.sendHTTP(contentBody=json.dumps(contentBody), contentType=contentType, httpStatusCode=httpStatusCode, httpStatusMessage=httpStatusMessage, headers=headers)
+        return self.sendHTTP(contentBody=jsonDumps(contentBody), contentType=contentType, httpStatusCode=httpStatusCode, httpStatusMessage=httpStatusMessage, headers=headers)
     
     def validateRequest(self):
         if self.path is None:
@@ -724,8 +3242,8 @@ class KHTTPHandler(BaseHTTPRequestHandler):
             if self.command is not None and str(self.command) in ["GET","POST"]:
                 self.sendError()
             else:
-                self.socket.shutdown(socket.SHUT_RDWR)
-                self.socket.close()
+                self._socket.shutdown(socket.SHUT_RDWR)
+                self._socket.close()
                 
             return False 
         
@@ -801,6 +3319,51 @@ class KHTTPHandler(BaseHTTPRequestHandler):
                 
         return True
     
+    @property
+    def body(self):
+        """
+        Reads the request body (once) based on the Content-Length or Transfer-Encoding header and decodes any Content-Encoding.
+        
+        Returns:
+            (bytes):  The request body or empty bytes if there is none (or it could not be decoded; see bodyError).
+        """
+        
+        if self._body is None:
+            self._body = b""
+            try:
+                if self._rawBody is not None:
+                    self._body = self._rawBody
+                    self._rawBody = None
+                else:
+                    length = requestBodyLength(self.headers)
+                    if length is None:
+                        if self._reader is not None:
+                            self._body = self._reader.readChunkedBody()
+                        elif self.rfile is not None:
+                            self._body = readChunkedBody(self.rfile.readline, self.rfile.read)
+                    elif length > 0:
+                        if self._reader is not None:
+                            self._body = self._reader.readBody(length)
+                        elif self.rfile is not None:
+                            self._body = self.rfile.read(length)
+            except HTTPRequestError as e:
+                self._body = b""
+                self.bodyError = e
+                self.keepAlive = False
+            except (ValueError, socket.timeout, OSError):
+                self._body = b""
+                self.keepAlive = False
+            
+            if self.headers.get("content-encoding") is not None and len(self._body) > 0:
+                try:
+                    maxSize = self.container.max_body_size if self.container is not None else 16777216
+                    self._body = decompressBody(self._body, self.headers.get("content-encoding"), maxSize)
+                except HTTPRequestError as e:
+                    self.bodyError = e
+                    self._body = b""
+                    
+        return self._body
+    
     @property
     def JSONData(self):
         if self.JSON is not None:
@@ -809,15 +3372,64 @@ class KHTTPHandler(BaseHTTPRequestHandler):
             if self.headers is None:
                 return self.JSON
             
-            length = int(self.headers['content-length'])
             try:
-                json_body = self.rfile.read(length)
-                self.JSON = json.loads(json_body)
+                self.JSON = jsonLoads(self.body)
             except:
                 pass
         
         return self.JSON
 
+class CapturedRequest(KHTTPHandler):
+    """
+    Copy of a parsed request that records the response instead of writing it to the socket.  Used when one request is handed to several devices.
+    """
+    
+    def __init__(self, request):
+        """
+        Captured Request Initialization
+        
+        Args:
+            request (KHTTPHandler):  The original request.  Its body should already be read.
+        """
+        
+        self.__dict__.update(request.__dict__)
+        self._socket = None
+        self.detached = False
+        self.keepAlive = False
+        self.isResponseSent = False
+        self.response = None
+        
+    def sendRedirect(self, url):
+        return self.sendHTTP(httpStatusCode=307, httpStatusMessage="Temporary Redirect", headers={ "Location": str(url) })
+    
+    def sendError(self):
+        return self.sendHTTP(httpStatusCode=404, httpStatusMessage="NOT FOUND")
+    
+    def sendHeaders(self, contentType="text/html", httpStatusCode=200, httpStatusMessage="OK", headers=None):
+        return None # Open-ended (streaming) responses cannot be captured
+    
+    def sendHTTP(self, contentBody=None, contentType="text/html", httpStatusCode=200, httpStatusMessage="OK", headers=None):
+        if self.isResponseSent: # Bail if we already sent a response to requestor
+            return True 
+        
+        if contentBody is not None and not isinstance(contentBody, str):
+            try:
+                contentBody = contentBody.decode()
+            except (UnicodeDecodeError, AttributeError):
+                contentBody = None # Binary bodies are not included in aggregated responses
+        
+        self.response = { "status": httpStatusCode, "contentType": contentType, "body": contentBody }
+        self.isResponseSent = True
+        return True
+    
+    def sendJSON(self, contentBody=None, contentType="application/json", httpStatusCode=200, httpStatusMessage="OK", headers=None):
+        if self.isResponseSent: # Bail if we already sent a response to requestor
+            return True 
+        
+        self.response = { "status": httpStatusCode, "contentType": contentType, "data": contentBody }
+        self.isResponseSent = True
+        return True
+
 #####
 # Check out the link below for a more complete example of SSDP/UPNP:
 # https://github.com/ZeWaren/python-upnp-ssdp-example
@@ -839,6 +3451,14 @@ class UPNPServer(object):
         self._isRunning = False
         self.version = self.parent.version
         self.services = {}
+        self._byST = {}                 # ST => list of USNs registered for it
+        self._payloads = {}             # USN => pre-rendered "response", "alive" and "byebye" messages
+        self._maxAge = {}               # USN => max-age in seconds from CACHE-CONTROL
+        self._announceDue = {}          # USN => time of the next scheduled alive announcement
+        self._scheduled = []            # Heap of (due, sequence, kind, USN, destination) waiting to be sent
+        self._scheduleCount = 0
+        self._scheduleLock = threading.Lock()
+        self._ipLocation = None         # (USN, protocol, port) of the service whose LOCATION follows this host's address
     
         if usn is None:
             if self.parent is not None:
@@ -854,8 +3474,10 @@ class UPNPServer(object):
                 if not self.parent.use_http:
                     proto = "https://"
                 location = proto+str(my_ip)+':'+str(self.parent.tcp_port)
+                self._ipLocation = (usn, proto, self.parent.tcp_port)
             else:
                 location = proto + str(my_ip) + ":8080"
+                self._ipLocation = (usn, proto, 8080)
         
         if server is None:
             if self.parent is not None and self.parent.isBrain:
@@ -897,10 +3519,13 @@ class UPNPServer(object):
         cmd = socket.IP_ADD_MEMBERSHIP
         self._serverSocket.setsockopt(socket.IPPROTO_IP, cmd, addr + interface)
         self._serverSocket.bind(('0.0.0.0', self.tcp_port))
-        self._serverSocket.settimeout(1)
+        
+        for usn in list(self.services.keys()): # Services registered before the socket existed
+            self._notify(usn)
 
         while self._isRunning:
             try:
+                self._serverSocket.settimeout(self._sendScheduled())
                 data, addr = self._serverSocket.recvfrom(1024)
                 self._recv(data, addr)
             except socket.timeout:
@@ -930,6 +3555,9 @@ class UPNPServer(object):
                     if len(h) == 2 and h[0].strip() != "":
                         headers[h[0].strip().upper()] = h[1].strip() # Convert line into name/value pairs
 
+        if len(cmd) < 2:
+            return
+
         self.logger.debug('Incoming "' + str(cmd[0]) + ' ' + str(cmd[1]) + '" from ' + str(host) + ':' + str(port))
         self.logger.debug('Headers: ' + str(headers)) # Note that headers are uppercased
         
@@ -942,28 +3570,110 @@ class UPNPServer(object):
             
     def _search(self, headers, host, port):
 
-        self.logger.info('Search request for ' + str(headers['ST']))
-
-        for item in self.services.values():
-            if item['ST'] == headers['ST'] or headers['ST'] == 'ssdp:all':
-                response = ['HTTP/1.1 200 OK']
-
-                usn = None
-                for k, v in item.items():
-                    if k == 'USN':
-                        usn = v
-                    if k not in ('HOST','headers','last-seen'):
-                        response.append(str(k) + ': ' + str(v))
-                        
-                    if k == "headers":
-                        if isinstance(v, dict):
-                            for x in v:
-                                response.append(str(x) + ': ' + str(v[x]))
-
-                if usn:
-                    response.append('DATE: '+str(formatdate(timeval=None, localtime=False, usegmt=True)))
-                    self._send_data(('\r\n'.join(response) + '\r\n\r\n'), (host, port))
+        st = headers.get('ST')
+        self.logger.info('Search request for ' + str(st))
+        
+        if st == 'ssdp:all':
+            usns = list(self.services.keys())
+        else:
+            usns = self._byST.get(st, [])
+        
+        if len(usns) == 0:
+            return
+        
+        # Answer at a random point within the MX window so a search on a busy network doesn't trigger a burst of replies
+        try:
+            mx = min(max(int(headers.get('MX', 1)), 1), 5)
+        except ValueError:
+            mx = 1
+        
+        for usn in usns:
+            self._schedule(random.uniform(0, mx), "response", usn, (host, port))
 
+    def _schedule(self, delay, kind, usn, destination):
+        """
+        Queues a message for the server thread.
+        
+        Args:
+            delay (float):  Seconds from now to send the message.
+            kind (str):  "response" for an M-SEARCH reply or "alive" for a re-announcement.
+            usn (str):  The service the message is for.
+            destination (tuple):  The (host, port) to send the message to.
+            
+        Returns:
+            (float):  The time the message is due.
+        """
+        
+        due = time.time() + delay
+        with self._scheduleLock:
+            self._scheduleCount += 1
+            heapq.heappush(self._scheduled, (due, self._scheduleCount, kind, usn, destination))
+            
+        return due
+    
+    def _sendScheduled(self):
+        """
+        Sends queued messages that are due.
+        
+        Returns:
+            (float):  Seconds until the next queued message (at most 1).
+        """
+        
+        while True:
+            with self._scheduleLock:
+                if len(self._scheduled) == 0:
+                    return 1
+                
+                wait = self._scheduled[0][0] - time.time()
+                if wait > 0:
+                    return max(min(wait, 1), 0.01)
+                
+                due, count, kind, usn, destination = heapq.heappop(self._scheduled)
+            
+            payloads = self._payloads.get(usn)
+            if payloads is None or usn not in self.services:
+                continue # Unregistered since the message was queued
+            
+            if kind == "response":
+                self._send_data(payloads["response"] + b"DATE: " + httpDate().encode() + b"\r\n\r\n", destination)
+            elif kind == "alive" and self._announceDue.get(usn) == due:
+                self._notify(usn)
+    
+    def _render(self, usn):
+        """
+        Builds the M-SEARCH response and NOTIFY payloads for a service and updates the ST index.
+        
+        Args:
+            usn (str):  The registered service.
+        """
+        
+        item = self.services[usn]
+        
+        fields = [(k, v) for k, v in item.items() if k not in ('HOST','headers','last-seen')]
+        if isinstance(item["headers"], dict):
+            fields += list(item["headers"].items())
+        
+        notifyFields = [('NT' if k == 'ST' else k, v) for k, v in item.items() if k not in ('HOST','headers','last-seen')]
+        if isinstance(item["headers"], dict):
+            notifyFields += list(item["headers"].items()) # Listeners match on these (e.g. X-KAREN-TYPE) just like search responses
+        host = 'HOST: ' + str(self.hostname) + ":" + str(self.tcp_port)
+        
+        self._payloads[usn] = {
+                "response": ('\r\n'.join(['HTTP/1.1 200 OK'] + [str(k) + ': ' + str(v) for k, v in fields]) + '\r\n').encode(), # DATE is added when sent
+                "alive": ('\r\n'.join(['NOTIFY * HTTP/1.1', host, 'NTS: ssdp:alive'] + [str(k) + ': ' + str(v) for k, v in notifyFields]) + '\r\n\r\n').encode(),
+                "byebye": ('\r\n'.join(['NOTIFY * HTTP/1.1', host, 'NTS: ssdp:byebye'] + [str(k) + ': ' + str(v) for k, v in notifyFields]) + '\r\n\r\n').encode()
+            }
+        
+        match = re.search(r"max-age\s*=\s*(\d+)", str(item['CACHE-CONTROL']))
+        self._maxAge[usn] = int(match.group(1)) if match else 1800
+    
+    def _index(self):
+        byST = {}
+        for usn in self.services:
+            byST.setdefault(self.services[usn]['ST'], []).append(usn)
+        
+        self._byST = byST
+    
     def register(self, usn, st, location, server=None, cache_control='max-age=1800', headers=None):
 
         self.logger.info('Registering ' + str(st) + " (" + str(location) + ")")
@@ -979,13 +3689,47 @@ class UPNPServer(object):
         self.services[usn]['last-seen'] = time.time()
         self.services[usn]["headers"] = headers
         
+        self._render(usn)
+        self._index()
+        
         if self._serverSocket:
             self._notify(usn)
 
     def unregister(self, usn):
-        del self.services[usn]
+        if self._serverSocket and usn in self._payloads:
+            self._byebye(usn)
+        
+        self.services.pop(usn, None)
+        self._payloads.pop(usn, None)
+        self._maxAge.pop(usn, None)
+        self._announceDue.pop(usn, None)
+        self._index()
+        
+        with self._scheduleLock: # Drop its queued responses and announcements
+            self._scheduled = [x for x in self._scheduled if x[3] != usn]
+            heapq.heapify(self._scheduled)
+        
         return True
 
+    def _ipAddressChanged(self, address, oldAddress):
+        """
+        Updates the LOCATION of the service announced with this host's address and announces it again.
+        
+        Args:
+            address (str):  The new address.
+            oldAddress (str):  The previous address.
+        """
+        
+        usn, proto, port = self._ipLocation
+        if usn not in self.services:
+            return
+        
+        self.services[usn]['LOCATION'] = proto + str(address) + ':' + str(port)
+        self._render(usn)
+        
+        if self._serverSocket:
+            self._notify(usn)
+
     def is_known(self, usn):
         if usn in self.services:
             return True
@@ -999,7 +3743,7 @@ class UPNPServer(object):
     def _send_data(self, response, destination):
         self.logger.debug('Send response to '+str(destination))
         try:
-            self._serverSocket.sendto(response.encode(), destination)
+            self._serverSocket.sendto(response.encode() if isinstance(response, str) else response, destination)
         except (AttributeError, socket.error) as msg:
             self.logger.warning("Respond failed to send: " + str(msg))
                 
@@ -1007,61 +3751,28 @@ class UPNPServer(object):
 
         self.logger.info('Sending ssdp:byebye notification for '+str(usn))
 
-        out_response = [
-            'NOTIFY * HTTP/1.1',
-            'HOST: ' + str(self.hostname) + ":" + str(self.tcp_port),
-            'NTS: ssdp:byebye',
-        ]
-        try:
-            d = dict(self.services[usn].items()) # Copy the original so we don't mess with it.
-            
-            d['NT'] = d['ST']
-
-            del d['ST']
-            del d['last-seen']
-            del d["headers"]
-            
-            for item in d:
-                out_response.append(str(item) + ": " + str(d[item]))
-
-            self.logger.debug(str(out_response))
+        if usn not in self._payloads:
+            self.logger.error("Error creating byebye notification: " + str(usn))
+            return
         
-            if self._serverSocket:
-                try:
-                    self._serverSocket.sendto(('\r\n'.join(out_response) + "\r\n\r\n").encode(), (self.hostname, self.tcp_port))
-                except (AttributeError, socket.error) as msg:
-                    self.logger.error("Failure sending byebye notification: " + str(msg))
-        except KeyError as msg:
-            self.logger.error("Error creating byebye notification: " + str(msg))
+        if self._serverSocket:
+            try:
+                self._serverSocket.sendto(self._payloads[usn]["byebye"], (self.hostname, self.tcp_port))
+            except (AttributeError, socket.error) as msg:
+                self.logger.error("Failure sending byebye notification: " + str(msg))
     
     def _notify(self, usn):
 
         self.logger.info('Sending alive notification for '+str(usn))
-
-        out_response = [
-            'NOTIFY * HTTP/1.1',
-            'HOST: ' + str(self.hostname) + ":" + str(self.tcp_port),
-            'NTS: ssdp:alive',
-        ]
-        
-        d = dict(self.services[usn].items()) # Copy the original so we don't mess with it.
-            
-        d['NT'] = d['ST']
-        
-        del d['ST']
-        del d['last-seen']
-        del d["headers"]
-        
-        for item in d:
-            out_response.append(str(item) + ": " + str(d[item]))
-
-        self.logger.debug(str(out_response))
         
         try:
-            self._serverSocket.sendto('\r\n'.join(out_response).encode(), (self.hostname, self.tcp_port))
-            self._serverSocket.sendto('\r\n'.join(out_response).encode(), (self.hostname, self.tcp_port))
+            self._serverSocket.sendto(self._payloads[usn]["alive"], (self.hostname, self.tcp_port))
+            self._serverSocket.sendto(self._payloads[usn]["alive"], (self.hostname, self.tcp_port))
         except (AttributeError, socket.error) as msg:
             self.logger.warning("Failure sending out alive notification: " + str(msg))
+        
+        # Announce again well before peers' cached entries expire; earlier queued announcements for the service are skipped
+        self._announceDue[usn] = self._schedule(self._maxAge[usn] * random.uniform(0.4, 0.5), "alive", usn, None)
     
     @property
     def accepts(self):
@@ -1071,11 +3782,15 @@ class UPNPServer(object):
         return self._isRunning
     
     def start(self, httpRequest=None):
+        if self._ipLocation is not None:
+            watchIPAddress(self._ipAddressChanged)
+        
         self._serverThread = self._UDPServer()
         return True
         
     def stop(self, httpRequest=None):
         self._isRunning = False
+        unwatchIPAddress(self._ipAddressChanged)
         
         if self._serverThread is not None:
             self._serverThread.join()
@@ -1,9 +1,17 @@
-import os, logging, socket, ssl, time, uuid
-from .shared import threaded, getIPAddress, KHTTPHandler, sendHTTPRequest, upgradePackage
-from urllib.parse import urljoin
+import os, logging, socket, ssl, time, uuid, threading, random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as waitForFutures
+from .shared import threaded, getIPAddress, watchIPAddress, unwatchIPAddress, KHTTPHandler, CapturedRequest, sendHTTPRequest, closeHTTPSessions, upgradePackage, WorkerPool, IdleConnections, BatchQueue, AsyncStreamSocket, parseHTTPRequestHead, HTTPRequestReader, HTTPRequestError, StaticFileServer, requestBodyLength, parseChunkSize, jsonDumps, jsonLoads, acceptedEncoding, compressBody, discoverDevices, SSDPListener
+from urllib.parse import urljoin, urlparse
 
 class Container():
-    def __init__(self, tcp_port=8080, hostname="", ssl_cert_file=None, ssl_key_file=None, brain_url=None, groupName=None, authentication=None):
+    def __init__(self, tcp_port=8080, hostname="", ssl_cert_file=None, ssl_key_file=None, brain_url=None, groupName=None, authentication=None,
+            pool_size=10, pool_queue_size=50, pool_overflow="reject", server_mode="threads",
+            keepalive_timeout=5, keepalive_max=100,
+            uplink_batch_size=0, uplink_batch_window=0.5, uplink_queue_size=1000, uplink_coalesce=None,
+            fanout_parallel=False, fanout_timeout=10, max_header_size=65536, max_body_size=16777216,
+            static_folder=None, static_cache_size=8388608, compress_min_size=1024, compress_level=6, uplink_compress=False,
+            status_max_age=30, register_delay=1, parallel_startup=False, startup_timeout=60,
+            brain_cache_file="~/.karen/brain.json", brain_probe_timeout=1, brain_discovery=False):
         """
         Brain Server Initialization
         
@@ -15,6 +23,32 @@ class Container():
             brain_url (str): URL of brain device.
             groupName (str): Group or Room name for devices. (optional)
             authentication (dict): API Key required for web-based access
+            pool_size (int): Maximum number of worker threads handling inbound requests
+            pool_queue_size (int): Maximum number of accepted connections waiting for a free worker
+            pool_overflow (str): Action when the queue is full; "reject" responds with 503, "block" stops accepting until space is available
+            server_mode (str): "threads" for the blocking accept loop with a worker pool or "asyncio" for a single event loop (blocking device calls use pool_size executor threads)
+            keepalive_timeout (int): Seconds an idle persistent connection is held open waiting for the next request
+            keepalive_max (int): Maximum requests served on one connection before it is closed (1 disables keep-alive)
+            uplink_batch_size (int): Maximum events per batched post to the brain (0 sends each event immediately on the caller's thread)
+            uplink_batch_window (float): Maximum seconds an event waits before a partial batch is sent
+            uplink_queue_size (int): Maximum events waiting to be sent; the oldest is dropped when full
+            uplink_coalesce (list): Event types for which only the latest waiting event is sent (e.g. status updates)
+            fanout_parallel (bool): Call all matching devices of /type/ requests concurrently and respond with per-device results and timings
+            fanout_timeout (float): Seconds each device may run in a parallel /type/ request, counted from when its call starts
+            max_header_size (int): Maximum size in bytes of an inbound request line and headers
+            max_body_size (int): Maximum size in bytes of an inbound request body
+            static_folder (str): Folder to serve /admin files from (otherwise file requests are redirected to the brain)
+            static_cache_size (int): Maximum bytes of static files kept in memory
+            compress_min_size (int): Smallest text/JSON response in bytes that is gzip/deflate compressed for clients sending Accept-Encoding (0 disables)
+            compress_level (int): zlib compression level (1-9) for responses
+            uplink_compress (bool): Gzip large event posts to the brain (the brain must support compressed request bodies)
+            status_max_age (float): Seconds before the cached status snapshot is rebuilt for devices that change state without calling updateStatus() (0 rebuilds on every request)
+            register_delay (float): Seconds to collect device additions and status changes before one registration is sent to the brain (a random delay of up to the same amount is added)
+            parallel_startup (bool): Start each auto-started device on its own thread (after the devices it depends on are ready) instead of inside addDevice
+            startup_timeout (float): Seconds a device waits for the devices it depends on before giving up
+            brain_cache_file (str): File where the last brain endpoint that accepted a registration is saved (None disables)
+            brain_probe_timeout (float): Seconds to wait for the saved brain endpoint to answer at startup when brain_url is not set
+            brain_discovery (bool): Search the network with SSDP for a brain when brain_url is not set and the saved endpoint does not answer (UPNP announcements are also followed while running)
         
         Both the ssl_cert_file and ssl_key_file must be present in order for SSL to be leveraged.
         """
@@ -40,7 +74,68 @@ class Container():
         self._thread = None
         self._serverSocket = None             # Socket object (where the listener lives)
         self._serverThread = None             # Thread object for TCP Server (Should be non-blocking)
-        self._threadPool = []           # List of running threads (for incoming TCP requests)
+        self._workerPool = None         # Pool of reusable threads (for incoming TCP requests)
+        self._idleConnections = None    # Keep-alive connections waiting for their next request (threads mode)
+        self.pool_size = pool_size if pool_size is not None else 10
+        self.pool_queue_size = pool_queue_size if pool_queue_size is not None else 50
+        self.pool_overflow = pool_overflow if pool_overflow is not None else "reject"
+        
+        self.server_mode = str(server_mode).lower() if server_mode is not None else "threads"
+        if self.server_mode not in ["threads","asyncio"]:
+            raise ValueError("Invalid server mode: " + str(server_mode))
+        
+        self._loop = None               # Event loop (asyncio server mode only)
+        self._loopStop = None           # Event used to stop the asyncio server
+        self._asyncConnections = set()  # Open client streams (asyncio server mode only)
+        self._executor = None           # Executor for blocking device calls (asyncio server mode only)
+        self.request_timeout = 30       # Seconds to wait for a client to send a complete request (asyncio server mode only)
+        
+        self.keepalive_timeout = keepalive_timeout if keepalive_timeout is not None else 5
+        self.keepalive_max = keepalive_max if keepalive_max is not None else 100
+        
+        self.max_header_size = max_header_size if max_header_size is not None else 65536
+        self.max_body_size = max_body_size if max_body_size is not None else 16777216
+        
+        self.compress_min_size = compress_min_size if compress_min_size is not None else 1024
+        self.compress_level = compress_level if compress_level is not None else 6
+        self.uplink_compress = uplink_compress if uplink_compress is not None else False
+        
+        self._staticFiles = None        # Server for /admin files (None redirects to the brain)
+        if static_folder is not None:
+            self._staticFiles = StaticFileServer(static_folder, maxCacheSize=(static_cache_size if static_cache_size is not None else 8388608))
+        
+        self.fanout_parallel = fanout_parallel if fanout_parallel is not None else False
+        self.fanout_timeout = fanout_timeout if fanout_timeout is not None else 10
+        self._fanoutExecutor = None     # Executor for parallel /type/ requests
+        
+        self.status_max_age = status_max_age if status_max_age is not None else 30
+        self._statusLock = threading.RLock()
+        self._statusDevices = {}        # device id => status entry as reported by _getStatus()
+        self._statusVersion = 0         # Incremented whenever an entry changes
+        self._statusBodies = {}         # content coding => serialized status for the current version
+        self._statusUpdated = 0         # Time of the last full rebuild
+        
+        self.register_delay = register_delay if register_delay is not None else 1
+        self._registerPending = False   # Full registration waiting to be sent
+        self._registerEvent = threading.Event()
+        self._registerStop = threading.Event()
+        self._registerThread = None     # Thread sending registrations (devices only)
+        self._registeredTag = None      # Status version the brain last accepted
+        
+        self.parallel_startup = parallel_startup if parallel_startup is not None else False
+        self.startup_timeout = startup_timeout if startup_timeout is not None else 60
+        self._startupTime = time.time()   # Reference point for the startup timeline
+        self._startupLock = threading.Lock()
+        self._deviceReady = {}          # device id => Event set once the device has finished starting
+        
+        self._uplink = None             # Queue for batched callbackHandler events (None sends immediately)
+        if uplink_batch_size is not None and int(uplink_batch_size) > 0:
+            self._uplink = BatchQueue(self._sendCollectBatch, 
+                                      batchSize=uplink_batch_size, 
+                                      batchWindow=uplink_batch_window, 
+                                      maxSize=uplink_queue_size, 
+                                      coalesce=uplink_coalesce, 
+                                      name="CONTAINER-UPLINK")
         
         self._isRunning = False         # Flag used to indicate if TCP server should be running
         
@@ -50,10 +145,11 @@ class Container():
         self.tcp_port = tcp_port if tcp_port is not None else 8080
         self.hostname = hostname if hostname is not None else "" 
         self.use_http = True
-        self.keyfile=ssl_cert_file
-        self.certfile=ssl_key_file
+        self.keyfile=ssl_key_file
+        self.certfile=ssl_cert_file
 
         self.use_http = False if self.keyfile is not None and self.certfile is not None else True
+        self._sslContext = None         # Server SSLContext shared by all connections (see _getSSLContext)
         
         self.isOffline = None 
                         
@@ -71,11 +167,20 @@ class Container():
         self.my_url = self.my_url + str(my_ip if my_ip is not None and my_ip != "" else "localhost") + ":" + str(self.tcp_port)
 
         self.brain_url = brain_url
+        self._brainConfigured = brain_url is not None
         if self.brain_url is None:
             self.brain_url = "http://localhost:8080"
         
-        self.accepts = ["stop","stopDevices","status","restart","upgrade"]
+        self.brain_cache_file = os.path.expanduser(brain_cache_file) if brain_cache_file is not None else None
+        self.brain_probe_timeout = brain_probe_timeout if brain_probe_timeout is not None else 1
+        self.brain_discovery = brain_discovery if brain_discovery is not None else False
+        self._savedBrain = None         # Last brain endpoint read from or written to brain_cache_file
+        self._ssdpListener = None       # Keeps the discovery cache current while brain_discovery is in use
+        
+        self.accepts = ["stop","stopDevices","status","restart","upgrade","poolStatus","uplinkStatus","startupStatus"]
         self.devices = {}
+        self._dispatch = {}             # (device id, action) => bound method for accepted actions
+        self._typeIndex = {}            # device type => list of device ids
         
     def initialize(self):
         """
@@ -100,33 +205,32 @@ class Container():
                     
         return httpRequest.sendJSON({ "error": True, "message": "Authentication failed." })
         
-    def _purgeThreadPool(self):
+    def _waitForThreadPool(self):
         """
-        Purges the thread pool of completed or dead threads
+        Stops the worker pool and waits for in-flight requests to complete
         """
-        i = len(self._threadPool) - 1
-        while i >= 0:
-            try:
-                if self._threadPool[i] is None or self._threadPool[i].isAlive() == False:
-                    self._threadPool.pop(i)
-            except:
-                self._threadPool.pop(i)
-                        
-            i = i - 1
-            
-    def _waitForThreadPool(self):
+        if self._idleConnections is not None:
+            self._idleConnections.stop()
+        
+        if self._workerPool is not None:
+            self._workerPool.stop(wait=True)
+    
+    def _rejectConnection(self, conn, address):
         """
-        Pauses and waits for all threads in threadpool to complete/join the calling thread
+        Responds with a 503 error when the worker pool is saturated
+        
+        Args:
+            conn (socket): The TCP socket for the connection
+            address (tuple):  The originating IP address and port for the incoming request.
         """
-        i = len(self._threadPool) - 1
-        while i >= 0:
-            try:
-                if self._threadPool[i] is not None and self._threadPool[i].isAlive():
-                    self._threadPool[i].abort()
-            except:
-                pass
-                        
-            i = i - 1
+        
+        self.logger.warning("Worker pool full.  Rejecting request from " + str(address[0]))
+        if self._sslContext is not None:
+            conn.close() # A response would need a TLS handshake on the accept thread
+            return False
+        
+        req = KHTTPHandler(self, conn, address)
+        return req.sendJSON({ "error": True, "message": "Server busy." }, httpStatusCode=503, httpStatusMessage="Service Unavailable", headers={ "Retry-After": "1" })
     
     @threaded
     def _tcpServer(self):
@@ -138,18 +242,19 @@ class Container():
 
         """
         self._isRunning = True 
+        self.updateStatus(str(self.id))
+        
+        self._workerPool = WorkerPool(size=self.pool_size, queueSize=self.pool_queue_size, overflow=self.pool_overflow, name="CONTAINER-WORKER")
+        self._idleConnections = IdleConnections(self._resumeConnection, timeout=self.keepalive_timeout, name="CONTAINER-IDLE")
+        self._idleConnections.start()
                 
         self._serverSocket = socket.socket()
         self._serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._serverSocket.bind((self.hostname, self.tcp_port))
         self._serverSocket.listen(self.tcp_clients)
         
-        if self.use_http == False:
-            self.logger.info("SSL Enabled.")
-            self._serverSocket = ssl.wrap_socket(self._serverSocket, 
-                                       keyfile=self.keyfile, 
-                                       certfile=self.certfile,
-                                       server_side=True)
+        if self._getSSLContext() is not None:
+            self.logger.info("SSL Enabled.") # Handshakes run in _acceptConnection on the worker threads
 
         while self._isRunning:
 
@@ -157,9 +262,8 @@ class Container():
                 # Accept the new connection
                 conn, address = self._serverSocket.accept()
                 
-                t = self._acceptConnection(conn, address)
-                self._purgeThreadPool()
-                self._threadPool.append(t)
+                if not self._workerPool.submit(self._acceptConnection, conn, address):
+                    self._rejectConnection(conn, address)
                     
             except (KeyboardInterrupt): # Occurs when we press Ctrl+C on Linux
                 
@@ -178,49 +282,399 @@ class Container():
         
         return True
     
-    @threaded
     def _acceptConnection(self, conn, address):
         """
-        Accepts inbound TCP connections, parses request, and calls appropriate handler function
+        Accepts inbound TCP connections, parses request, and calls appropriate handler function.  Runs on a worker pool thread.
         
         Args:
             conn (socket): The TCP socket for the connection
             address (tuple):  The originating IP address and port for the incoming request e.g. (192.168.0.139, 59209).
+        """
+        
+        try:
+            conn.settimeout(self.keepalive_timeout)
             
-        Returns:
-            (thread):  The thread for the request's connection
+            if self._sslContext is not None:
+                conn = self._sslContext.wrap_socket(conn, server_side=True) # Handshake is limited by keepalive_timeout
+        except (ssl.SSLError, OSError) as e:
+            self.logger.debug("TLS handshake failed (" + str(address[0]) + "): " + str(e))
+            conn.close()
+            return
+        
+        reader = HTTPRequestReader(conn, maxHeaderSize=self.max_header_size, maxBodySize=self.max_body_size) # Shared across requests so pipelined data stays buffered
+        self._serveConnection(conn, address, reader, 0)
+    
+    def _resumeConnection(self, conn, state):
+        """
+        Queues an idle keep-alive connection on the worker pool once its next request starts to arrive.  Called by the idle connection watcher.
+        
+        Args:
+            conn (socket): The TCP socket for the connection
+            state (tuple):  The address, request reader and number of requests served as passed to IdleConnections.add().
+        """
+        
+        address, reader, count = state
+        if not self._workerPool.submit(self._serveConnection, conn, address, reader, count):
+            conn.close() # The client retries idle connections that were closed
+    
+    def _serveConnection(self, conn, address, reader, count):
+        """
+        Serves requests from a connection until it is closed, handed to a device or becomes idle.  Idle keep-alive connections are passed to 
+        the idle connection watcher so they do not hold a worker thread while waiting for the next request.
+        
+        Args:
+            conn (socket): The TCP socket for the connection
+            address (tuple):  The originating IP address and port for the incoming request.
+            reader (karen.shared.HTTPRequestReader):  The connection's request reader.
+            count (int):  Number of requests already served on the connection.
         """
         
         try:
-            # Parse the inbound request
-            req = KHTTPHandler(self, conn, address, conn.makefile(mode='b'))
-            self.logger.debug("HTTP (" + str(address[0]) + ") " + str(req.command) + " " + str(req.path) + " [" + ("JSON" if req.isJSON else "") + "]")
-            if req.validateRequest():
-                #req.socket.send("HTTP/1.1 200 OK\nContent-Type: text/html\nContent-Length: 9\n\nNOT FOUND".encode())
-                self._processRequest(req)
+            while True:
+                count += 1
+                
+                # Parse the inbound request
+                try:
+                    request = reader.readRequest()
+                except (socket.timeout, OSError):
+                    request = None
+                except HTTPRequestError as e:
+                    self._sendRequestError(conn, address, e)
+                    return
+                
+                if request is None: # Client closed the connection or idle timeout expired
+                    break
+                
+                req = KHTTPHandler(self, conn, address, request=request, allowKeepAlive=(count < self.keepalive_max), reader=reader)
+                self._handleRequest(req)
+                
+                if req.detached or not req.isResponseSent:
+                    return # Socket was handed off to the device (e.g. for streaming)
+                
+                if not self._isRunning or not req.keepAlive:
+                    break
+                
+                req.body # Drain any unread request body before the next request
+                if not req.keepAlive:
+                    break
+                
+                if not reader.hasBufferedData() and self._idleConnections.add(conn, (address, reader, count)):
+                    return # Resumed by _resumeConnection when the next request arrives
+            
+            conn.close()
                 
         except:
             raise
+    
+    def _sendRequestError(self, conn, address, error):
+        """
+        Responds to a request that could not be parsed and closes the connection.
         
-    def _getStatus(self):
-        myDevices = {}
-        for devId in self.devices:
-            item = self.devices[devId]
-            myDevices[devId] = { "id": devId, "type": item["type"], "accepts": item["accepts"], "active": True, "version": None, "groupName": self.groupName }
+        Args:
+            conn (socket): The TCP socket (or AsyncStreamSocket) for the connection
+            address (tuple):  The originating IP address and port for the incoming request.
+            error (karen.shared.HTTPRequestError):  The parsing error.
+        """
+        
+        self.logger.debug("HTTP (" + str(address[0]) + ") " + str(error))
+        req = KHTTPHandler(self, conn, address)
+        return req.sendJSON({ "error": True, "message": str(error) }, httpStatusCode=error.httpStatusCode, httpStatusMessage=error.httpStatusMessage)
+    
+    def _handleRequest(self, req):
+        """
+        Validates a parsed request and dispatches it to the appropriate device.
+        
+        Args:
+            req (karen.shared.KHTTPHandler):  The parsed inbound request.
+        """
+        
+        self.logger.debug("HTTP (" + str(req.address[0]) + ") " + str(req.command) + " " + str(req.path) + " [" + ("JSON" if req.isJSON else "") + "]")
+        if req.headers.get("content-encoding") is not None or req.headers.get("transfer-encoding") is not None:
+            req.body # Decode compressed and chunked bodies up front so bad ones are rejected before reaching a device
+            if req.bodyError is not None:
+                return req.sendJSON({ "error": True, "message": str(req.bodyError) }, httpStatusCode=req.bodyError.httpStatusCode, httpStatusMessage=req.bodyError.httpStatusMessage)
+            
+        if req.validateRequest():
+            #req.socket.send("HTTP/1.1 200 OK\nContent-Type: text/html\nContent-Length: 9\n\nNOT FOUND".encode())
+            self._processRequest(req)
+    
+    def _getSSLContext(self):
+        """
+        Returns the server-side SSL context, creating it from the configured certificate and key files on first use.  All connections share the 
+        context so clients can resume their TLS sessions (session tickets and the server session cache belong to the context).
+        
+        Returns:
+            (ssl.SSLContext):  The server SSL context or None if SSL is not enabled.
+        """
+        
+        if self.use_http:
+            return None
+        
+        if self._sslContext is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.options &= ~ssl.OP_NO_TICKET
+            context.load_cert_chain(certfile=self.certfile, keyfile=self.keyfile)
+            self._sslContext = context
+        
+        return self._sslContext
+    
+    @threaded
+    def _asyncServer(self):
+        """
+        Internal function that runs the asyncio event loop for the TCP server.
+        
+        Returns:
+            (thread):  The thread for the event loop
+        """
+        
+        import asyncio # Only loaded in asyncio server mode
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loopStop = asyncio.Event()
+        self._loop = loop
+        
+        # stop() may have run before the loop existed, in which case it had nothing to signal
+        if not self._isRunning:
+            self._loop = None
+            loop.close()
+            return True
+        
+        self.updateStatus(str(self.id))
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        
+        try:
+            self._loop.run_until_complete(self._asyncServe())
+        finally:
+            self._executor.shutdown(wait=True)
+            self._loop.close()
+            self._loop = None
+            
+        return True
+    
+    async def _asyncServe(self):
+        """
+        Starts the asyncio stream server and waits until stop() is called.
+        """
+        
+        import asyncio
+        self._asyncConnections = set()
+        
+        sslContext = self._getSSLContext()
+        if sslContext is not None:
+            self.logger.info("SSL Enabled.")
+            
+        server = await asyncio.start_server(self._asyncAcceptConnection, 
+                                            host=(self.hostname if self.hostname != "" else None), 
+                                            port=self.tcp_port, 
+                                            ssl=sslContext, 
+                                            ssl_handshake_timeout=(self.keepalive_timeout if sslContext is not None else None), 
+                                            backlog=self.tcp_clients, 
+                                            reuse_address=True,
+                                            limit=self.max_header_size)
+        
+        await self._loopStop.wait()
+        
+        server.close()
+        
+        # Drop idle keep-alive connections still waiting on their next request
+        for writer in list(self._asyncConnections):
+            writer.close()
+        
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if len(pending) > 0:
+            await asyncio.wait(pending, timeout=self.request_timeout)
+            
+        await server.wait_closed()
+        
+    async def _asyncReadChunkedBody(self, reader):
+        """
+        Reads and decodes a request body sent with Transfer-Encoding: chunked (see karen.shared.readChunkedBody).
+        
+        Args:
+            reader (asyncio.StreamReader):  The incoming stream for the connection.
+            
+        Returns:
+            (bytes):  The decoded request body.
+        """
+        
+        body = bytearray()
+        while True:
+            size = parseChunkSize(await reader.readuntil(b"\n"))
+            if size == 0:
+                break
+            
+            if len(body) + size > self.max_body_size:
+                raise HTTPRequestError("Request body too large.", 413, "Payload Too Large")
+            
+            chunk = await reader.readexactly(size + 2)
+            if chunk[-2:] != b"\r\n":
+                raise HTTPRequestError("Invalid chunk.")
+            
+            body += chunk[:-2]
+        
+        while (await reader.readuntil(b"\n")).strip() != b"":
+            pass # Trailer fields are discarded
+        
+        return bytes(body)
+    
+    async def _asyncAcceptConnection(self, reader, writer):
+        """
+        Reads an inbound request from the stream and hands it to the executor for processing.
+        
+        Args:
+            reader (asyncio.StreamReader):  The incoming stream for the connection.
+            writer (asyncio.StreamWriter):  The outgoing stream for the connection.
+        """
+        
+        import asyncio
+        address = writer.get_extra_info("peername") or ("localhost", 0)
+        sock = AsyncStreamSocket(self._loop, writer)
+        self._asyncConnections.add(writer)
+        
+        count = 0
+        while self._isRunning:
+            count += 1
             
             try:
-                myDevices[devId]["active"] = item["device"].isRunning()
+                # First request waits up to request_timeout; subsequent ones only for the keep-alive idle period
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.request_timeout if count == 1 else self.keepalive_timeout)
+                request = parseHTTPRequestHead(head.lstrip(b"\r\n"))
+                if request is None:
+                    raise HTTPRequestError("Invalid request line.")
+                
+                length = requestBodyLength(request["headers"], self.max_body_size)
+                if length is None:
+                    request["body"] = await asyncio.wait_for(self._asyncReadChunkedBody(reader), self.request_timeout)
+                else:
+                    request["body"] = await asyncio.wait_for(reader.readexactly(length), self.request_timeout) if length > 0 else b""
+                
+            except HTTPRequestError as e:
+                self._sendRequestError(sock, address, e)
+                break
+            except asyncio.LimitOverrunError:
+                self._sendRequestError(sock, address, HTTPRequestError("Request headers too large.", 431, "Request Header Fields Too Large"))
+                break
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+                break
+            
+            try:
+                req = KHTTPHandler(self, sock, address, request=request, allowKeepAlive=(count < self.keepalive_max))
+                await self._loop.run_in_executor(self._executor, self._handleRequest, req)
             except:
-                self.logger.error("Unable to parse local device status [running state].")
-                pass
+                self.logger.error("Error processing request from " + str(address[0]))
+                break
+            
+            if req.detached:
+                self._asyncConnections.discard(writer)
+                return # The device owns the stream now (e.g. for streaming)
+            
+            if not req.keepAlive or not req.isResponseSent:
+                break
+        
+        self._asyncConnections.discard(writer)
+        sock.close()
+        
+    def _deviceStatus(self, devId):
+        """
+        Builds the status entry for one device.
+        
+        Args:
+            devId (str):  The device's unique identifier.
+            
+        Returns:
+            (dict):  The status entry.
+        """
+        
+        item = self.devices[devId]
+        ret = { "id": devId, "type": item["type"], "accepts": item["accepts"], "active": True, "version": None, "groupName": self.groupName }
+        
+        try:
+            running = item["device"].isRunning
+            ret["active"] = running() if callable(running) else bool(running)
+        except:
+            self.logger.error("Unable to parse local device status [running state].")
+            pass
 
-            try:
-                myDevices[devId]["version"] = item["device"].version
-            except Exception as e:
-                self.logger.error("Unable to parse local device status [version].")
-                pass
+        try:
+            ret["version"] = getattr(item["device"], "version", None) # Not every device reports a version
+        except Exception as e:
+            self.logger.error("Unable to parse local device status [version].")
+            pass
+        
+        return ret
+    
+    def updateStatus(self, device=None):
+        """
+        Refreshes the cached status snapshot.  Called when devices are added, started or stopped.
+        
+        Args:
+            device (object):  The device (or its id) that changed.  None rebuilds every entry.
             
-        return { self.my_url: myDevices }
+        Returns:
+            (bool):  True if the snapshot changed.
+        """
+        
+        with self._statusLock:
+            if device is None:
+                ids = list(self.devices.keys())
+            else:
+                ids = [x for x in self.devices if x == str(device) or self.devices[x]["device"] is device]
+            
+            changed = False
+            for devId in ids:
+                entry = self._deviceStatus(devId)
+                if self._statusDevices.get(devId) != entry:
+                    self._statusDevices[devId] = entry
+                    changed = True
+            
+            if device is None:
+                for devId in [x for x in self._statusDevices if x not in self.devices]:
+                    del self._statusDevices[devId]
+                    changed = True
+                
+                self._statusUpdated = time.time()
+            
+            if changed:
+                self._statusVersion += 1
+                self._statusBodies = {}
+        
+        if changed and self._registerThread is not None:
+            self.scheduleRegistration()
+                
+        return changed
+    
+    def _getStatus(self):
+        with self._statusLock:
+            if time.time() - self._statusUpdated >= self.status_max_age:
+                self.updateStatus()
+            
+            return { self.my_url: { x: dict(self._statusDevices[x]) for x in self._statusDevices } }
+    
+    def _statusBody(self, encoding=None):
+        """
+        Returns the serialized status snapshot, encoding it only once per version.
+        
+        Args:
+            encoding (str):  The content coding ("gzip" or "deflate") or None for the plain JSON body.
+            
+        Returns:
+            (tuple):  (version, body bytes)
+        """
+        
+        with self._statusLock:
+            if time.time() - self._statusUpdated >= self.status_max_age:
+                self.updateStatus()
+            
+            key = encoding if encoding is not None else "identity"
+            if key not in self._statusBodies:
+                if "identity" not in self._statusBodies:
+                    self._statusBodies["identity"] = jsonDumps({ self.my_url: self._statusDevices })
+                
+                if encoding is not None:
+                    self._statusBodies[key] = compressBody(self._statusBodies["identity"], encoding, self.compress_level)
+                    
+            return self._statusVersion, self._statusBodies[key]
     
     def _processRequest(self, httpRequest):
         try:
@@ -228,26 +682,37 @@ class Container():
                 return self._authenticate(httpRequest)
             
             if httpRequest.isFileRequest:
+                if self._staticFiles is not None:
+                    return self._staticFiles.serve(httpRequest, httpRequest.item)
+                
                 return httpRequest.sendRedirect(self.brain_url)
         
             if not httpRequest.authenticated:
                 return httpRequest.sendError()
         
             if (not httpRequest.isTypeRequest) and httpRequest.item in self.devices:
-                result = eval("self.devices[httpRequest.item][\"device\"]."+httpRequest.action+"(httpRequest)")
-                if not httpRequest.isResponseSent:
+                fn = self._dispatch.get((httpRequest.item, httpRequest.action))
+                if fn is None:
+                    return httpRequest.sendJSON({ "error": True, "message": "Request not supported." })
+                
+                result = fn(httpRequest)
+                if not httpRequest.isResponseSent and not httpRequest.detached:
                     return httpRequest.sendJSON({ "error": False, "message": "Request completed successfully." })
                 else:
                     return True 
                 
             if httpRequest.isTypeRequest:
                 
-                for devId in self.devices:
-                    item = self.devices[devId]
-                    if httpRequest.item == "all" or item["type"] == httpRequest.item:
-                        result = eval("self.devices[devId][\"device\"]."+httpRequest.action+"(httpRequest)")
+                devIds = list(self.devices.keys()) if httpRequest.item == "all" else list(self._typeIndex.get(httpRequest.item, []))
+                if self.fanout_parallel and self._fanoutExecutor is not None:
+                    return self._fanOut(httpRequest, devIds)
+                
+                for devId in devIds:
+                    fn = self._dispatch.get((devId, httpRequest.action))
+                    if fn is not None:
+                        result = fn(httpRequest)
 
-                if not httpRequest.isResponseSent:
+                if not httpRequest.isResponseSent and not httpRequest.detached:
                     return httpRequest.sendJSON({ "error": False, "message": "Request completed successfully." })
                 else:
                     return True 
@@ -262,19 +727,333 @@ class Container():
         
         return httpRequest.sendError()
     
-    def registerWithBrain(self):
+    def _fanOut(self, httpRequest, devIds):
+        """
+        Calls the requested action on several devices concurrently and responds with the results of each.
+        
+        Args:
+            httpRequest (karen.shared.KHTTPHandler):  The /type/ request.
+            devIds (list):  The ids of the devices matching the request type.
+            
+        Returns:
+            (bool):  True on success; False on failure
+        """
+        
+        httpRequest.body # Read once so each device's copy shares the same body
+        if httpRequest.isJSON:
+            httpRequest.JSONData
+        
+        started = {} # Device id => time its call began on an executor thread
+        
+        def call(devId, fn, req):
+            start = time.time()
+            started[devId] = start
+            try:
+                result = fn(req)
+                error = False
+            except Exception as e:
+                result = str(e)
+                error = True
+                
+            return { "result": result, "error": error, "elapsed": time.time() - start }
+        
+        futures = {}
+        for devId in devIds:
+            fn = self._dispatch.get((devId, httpRequest.action))
+            if fn is not None:
+                req = CapturedRequest(httpRequest)
+                futures[devId] = (self._fanoutExecutor.submit(call, devId, fn, req), req)
+        
+        if len(futures) == 0:
+            return httpRequest.sendJSON({ "error": True, "message": "Request not supported." })
+        
+        # Each device gets fanout_timeout from when its call starts.  Calls still queued behind slow devices give up once every round of 
+        # pool_size calls could have used its full timeout.
+        queuedDeadline = time.time() + self.fanout_timeout * -(-len(futures) // self.pool_size)
+        pending = dict(futures)
+        expired = set()
+        while len(pending) > 0:
+            now = time.time()
+            deadlines = {}
+            for devId in list(pending):
+                deadline = started[devId] + self.fanout_timeout if devId in started else queuedDeadline
+                if pending[devId][0].done():
+                    del pending[devId]
+                elif deadline <= now:
+                    del pending[devId]
+                    expired.add(devId)
+                else:
+                    deadlines[devId] = deadline
+            
+            if len(pending) > 0:
+                timeout = min(deadlines.values()) - now
+                if len(started) < len(futures):
+                    timeout = min(timeout, 0.1) # Recheck soon so calls that start while waiting get their own deadline
+                
+                waitForFutures([x[0] for x in pending.values()], timeout=timeout, return_when=FIRST_COMPLETED)
+        
+        ret = {}
+        for devId in futures:
+            future, req = futures[devId]
+            item = { "id": devId, "type": self.devices[devId]["type"], "error": True, "timedOut": True, "elapsed": None, "result": None, "response": None }
+            
+            if future.done() and devId not in expired:
+                outcome = future.result()
+                item["timedOut"] = False
+                item["error"] = outcome["error"]
+                item["elapsed"] = outcome["elapsed"]
+                item["result"] = outcome["result"] if isinstance(outcome["result"], (bool, int, float, str, type(None))) else str(outcome["result"])
+                item["response"] = req.response
+                
+            ret[devId] = item
+        
+        hasErrors = any(ret[x]["error"] for x in ret)
+        return httpRequest.sendJSON({ "error": hasErrors, "message": "Request completed with errors." if hasErrors else "Request completed successfully.", "data": ret })
+    
+    def _statusTag(self):
+        """
+        Returns the identifier of the current status snapshot as sent to the brain with each registration.
+        
+        Returns:
+            (str):  The container id and status version.
+        """
+        
+        return str(self.id) + "-" + str(self._statusVersion)
+    
+    def registerWithBrain(self, url=None, timeout=None, retries=None):
         """
         Sends current container and child device plugin status to brain
+        
+        Args:
+            url (str):  The brain's base url (defaults to brain_url).
+            timeout (float):  Seconds to wait for the brain (defaults to the configureHTTPSessions() values).
+            retries (int):  Retries on connection failures (defaults to the configureHTTPSessions() value).
+            
+        Returns:
+            (bool):  True if the brain accepted the registration.
         """
         
-        headers=None
+        headers = { "X-STATUS-VERSION": None }
         if self.authenticationKey is not None:
-            headers = { "Cookie": "token="+self.authenticationKey}
+            headers["Cookie"] = "token="+self.authenticationKey
+        
+        with self._statusLock:
+            status = self._getStatus()
+            tag = self._statusTag()
+            headers["X-STATUS-VERSION"] = tag
+            
+        ret = sendHTTPRequest(urljoin(url if url is not None else self.brain_url,"brain/register"), jsonData=status, origin=self.my_url, groupName=self.groupName, headers=headers, timeout=timeout, retries=retries)[0]
+        if ret:
+            self._registeredTag = tag
             
-        ret = sendHTTPRequest(urljoin(self.brain_url,"brain/register"), jsonData=self._getStatus(), origin=self.my_url, groupName=self.groupName, headers=headers)[0]
         return ret
     
-    def addDevice(self, type, device, id=None, autoStart=True, isPanel=False):
+    def _loadBrainEndpoint(self):
+        """
+        Reads the last brain endpoint saved by _saveBrainEndpoint().
+        
+        Returns:
+            (dict):  The saved "url", "version" and "time" or None if nothing was saved.
+        """
+        
+        if self.brain_cache_file is None or not os.path.isfile(self.brain_cache_file):
+            return None
+        
+        try:
+            with open(self.brain_cache_file, "rb") as f:
+                data = jsonLoads(f.read())
+        except Exception:
+            self.logger.warning("Unable to read saved brain endpoint from " + str(self.brain_cache_file))
+            return None
+        
+        return data if isinstance(data, dict) and data.get("url") else None
+    
+    def _saveBrainEndpoint(self, version):
+        """
+        Saves the brain endpoint after a successful registration so the next start can try it before searching the network.
+        
+        Args:
+            version (str):  The status version the brain accepted.
+        """
+        
+        if self.brain_cache_file is None:
+            return
+        
+        if self._savedBrain is not None and self._savedBrain.get("url") == self.brain_url and self._savedBrain.get("version") == version:
+            return
+        
+        data = { "url": self.brain_url, "version": version, "time": time.time() }
+        try:
+            os.makedirs(os.path.dirname(self.brain_cache_file), exist_ok=True)
+            tmpFile = self.brain_cache_file + ".tmp"
+            with open(tmpFile, "wb") as f:
+                f.write(jsonDumps(data))
+            
+            os.replace(tmpFile, self.brain_cache_file) # Never leaves a partial file behind
+            self._savedBrain = data
+        except Exception:
+            self.logger.warning("Unable to save brain endpoint to " + str(self.brain_cache_file))
+    
+    def _probeBrain(self, url):
+        """
+        Checks that a brain answers at the url by registering with it (the one request every brain serves), without retries and waiting at 
+        most brain_probe_timeout seconds.  A successful probe is the container's registration.
+        
+        Args:
+            url (str):  The brain's base url.
+            
+        Returns:
+            (bool):  True if the brain accepted the registration.
+        """
+        
+        return self.registerWithBrain(url, timeout=self.brain_probe_timeout, retries=0)
+    
+    def locateBrain(self):
+        """
+        Selects the brain url when none was configured.  The endpoint saved by the last successful registration is probed first, then the network is 
+        searched with SSDP (if brain_discovery is set), otherwise the default of http://localhost:8080 is kept.
+        
+        Returns:
+            (str):  The brain url in use.
+        """
+        
+        if self._brainConfigured:
+            return self.brain_url
+        
+        self._savedBrain = self._loadBrainEndpoint()
+        if self._savedBrain is not None:
+            if self._probeBrain(self._savedBrain["url"]):
+                self.brain_url = self._savedBrain["url"]
+                self._saveBrainEndpoint(self._registeredTag)
+                self.logger.info("Using saved brain @ " + str(self.brain_url))
+                return self.brain_url
+            
+            self.logger.info("Saved brain @ " + str(self._savedBrain["url"]) + " did not respond")
+        
+        if self.brain_discovery:
+            for device in discoverDevices(timeout=max(2, self.brain_probe_timeout), match={ "X-KAREN-TYPE": "BRAIN" }):
+                location = urlparse(device["headers"].get("LOCATION", ""))
+                if location.scheme in ["http", "https"] and location.netloc != "":
+                    self.brain_url = location.scheme + "://" + location.netloc
+                    self.logger.info("Discovered brain @ " + str(self.brain_url))
+                    return self.brain_url
+            
+            self.logger.warning("No brain found on the network.  Using " + str(self.brain_url))
+        
+        return self.brain_url
+    
+    def scheduleRegistration(self):
+        """
+        Requests a full registration with the brain.  Requests made within register_delay seconds of each other are sent as one.
+        """
+        
+        self._registerPending = True
+        self._registerEvent.set()
+    
+    @threaded
+    def _registrationLoop(self):
+        """
+        Sends pending registrations (retrying with backoff while the brain is unreachable).
+        
+        Returns:
+            (thread):  The thread for the registration loop
+        """
+        
+        retryDelay = max(self.register_delay, 1)
+        
+        self.locateBrain()
+        
+        while not self._registerStop.is_set():
+            if self._registerPending:
+                # Let other changes (e.g. the remaining devices being added) accumulate so they go out in one request.
+                # The random part spreads out satellites that all restarted at the same time.
+                if self._registerStop.wait(self.register_delay + random.uniform(0, self.register_delay)):
+                    break
+                
+                self._registerPending = False
+                with self._statusLock:
+                    self._getStatus() # Rebuilds the snapshot if it is stale
+                    tag = self._statusTag()
+                
+                if tag == self._registeredTag:
+                    continue # Already sent (e.g. by the startup probe)
+                
+                if not self.registerWithBrain():
+                    self._registerPending = True
+                    self.logger.warning("Unable to register with brain.  Retrying in " + str(int(retryDelay)) + " second(s).")
+                    self._registerStop.wait(retryDelay)
+                    retryDelay = min(retryDelay * 2, 60)
+                    continue
+                
+                self._saveBrainEndpoint(self._registeredTag)
+                retryDelay = max(self.register_delay, 1)
+                continue
+            
+            self._registerEvent.wait()
+            self._registerEvent.clear()
+    
+    def _indexDevice(self, id):
+        """
+        Adds a device's accepted actions to the dispatch table and its id to the type index.
+        
+        Args:
+            id (str):  The string representation of the device's unique identifier.
+        """
+        
+        item = self.devices[id]
+        
+        self._unindexDevice(id) # The device may have been added before with another type or other actions
+        
+        for action in item["accepts"]:
+            fn = getattr(item["device"], action, None)
+            if callable(fn):
+                self._dispatch[(id, action)] = fn
+            else:
+                self.logger.warning("Device " + str(id) + " (" + str(item["type"]) + ") accepts \"" + str(action) + "\" but has no such method.")
+        
+        self._typeIndex.setdefault(item["type"], []).append(id)
+    
+    def _unindexDevice(self, id):
+        """
+        Removes a device from the dispatch table and the type index.
+        
+        Args:
+            id (str):  The string representation of the device's unique identifier.
+        """
+        
+        for key in [x for x in self._dispatch if x[0] == id]:
+            del self._dispatch[key]
+        
+        for type in [x for x in self._typeIndex if id in self._typeIndex[x]]:
+            self._typeIndex[type].remove(id)
+            if len(self._typeIndex[type]) == 0:
+                del self._typeIndex[type]
+    
+    def removeDevice(self, id):
+        """
+        Removes a device from the container so requests are no longer dispatched to it.  The device is not stopped.
+        
+        Args:
+            id (str):  The string representation of the device's unique identifier.
+            
+        Returns:
+            (bool): True on success; False if the device was not found.
+        """
+        
+        id = str(id)
+        if id not in self.devices:
+            return False
+        
+        del self.devices[id]
+        self._unindexDevice(id)
+        self.updateStatus() # Drops the device from the status snapshot
+        
+        if not self.isBrain:
+            self.scheduleRegistration()
+        
+        return True
+    
+    def addDevice(self, type, device, id=None, autoStart=True, isPanel=False, dependsOn=None):
         """
         Add Device to list.
         
@@ -283,6 +1062,8 @@ class Container():
             device (obj):  The instance of the device
             id (str):  The string representation of a unique identifier.
             autoStart (bool): Automatically start the device
+            isPanel (bool): The device is a GUI panel (always started on the caller's thread)
+            dependsOn (list): Ids of devices that must be ready before this device is started
             
         Returns:
             (bool): True on success; False on failure.
@@ -326,21 +1107,140 @@ class Container():
                 "device": device,
                 "accepts": accepts,
                 "active": True,
-                "isPanel": isPanel
+                "isPanel": isPanel,
+                "startup": { "dependsOn": [str(x) for x in (dependsOn or [])], "added": time.time(), "started": None, "ready": None, "error": None }
             }
         
-        try:
-            if autoStart and "start" in accepts and not device.isRunning():
-                self.logger.info("Starting Device: " + str(id) + " (" + str(type) + ")")
-                self.devices[str(id)]["device"].start()
-        except:
-            pass
+        self._indexDevice(str(id))
+        
+        if autoStart and "start" in accepts:
+            if self.parallel_startup and not isPanel:
+                self._startDeviceThread(str(id))
+            else:
+                self._startDevice(str(id), timeout=0) # Dependencies added before this device are already started
+        else:
+            self.devices[str(id)]["startup"]["ready"] = self.devices[str(id)]["startup"]["added"]
+            self._readyEvent(str(id)).set()
+        
+        self.updateStatus(str(id))
         
         if not self.isBrain:
-            self.registerWithBrain()
+            self.scheduleRegistration() # Sent once the container is started
         
         return True
     
+    def _readyEvent(self, id):
+        with self._startupLock:
+            return self._deviceReady.setdefault(str(id), threading.Event())
+    
+    def _startDevice(self, id, timeout=None):
+        """
+        Starts a device once the devices it depends on are ready and records its startup timeline.
+        
+        Args:
+            id (str):  The device's unique identifier.
+            timeout (float):  Seconds to wait for each dependency (None uses startup_timeout; 0 does not wait).
+            
+        Returns:
+            (bool):  True if the device started successfully.
+        """
+        
+        item = self.devices[id]
+        startup = item["startup"]
+        
+        for depId in startup["dependsOn"]:
+            if not self._readyEvent(depId).wait(self.startup_timeout if timeout is None else timeout):
+                if timeout == 0:
+                    self.logger.warning("Device " + str(id) + " started before its dependency " + depId + ".")
+                    continue
+                
+                startup["error"] = "Timed out waiting for " + depId + "."
+                break
+            
+            if depId in self.devices and self.devices[depId]["startup"]["error"] is not None:
+                startup["error"] = "Dependency " + depId + " failed to start."
+                break
+        
+        startup["started"] = time.time()
+        
+        if startup["error"] is None:
+            try:
+                if not item["device"].isRunning():
+                    self.logger.info("Starting Device: " + str(id) + " (" + str(item["type"]) + ")")
+                    item["device"].start()
+            except Exception as e:
+                startup["error"] = str(e) if str(e) != "" else e.__class__.__name__
+        
+        if startup["error"] is not None:
+            self.logger.error("Device " + str(id) + " (" + str(item["type"]) + ") failed to start: " + startup["error"])
+        
+        startup["ready"] = time.time()
+        self._readyEvent(id).set()
+        self.updateStatus(id)
+        
+        return startup["error"] is None
+    
+    @threaded
+    def _startDeviceThread(self, id):
+        self._startDevice(id)
+    
+    def waitForDevices(self, ids=None, timeout=None):
+        """
+        Waits for devices to finish starting.
+        
+        Args:
+            ids (list):  Device ids to wait for (None waits for all devices).
+            timeout (float):  Maximum seconds to wait in total.
+            
+        Returns:
+            (bool):  True if all devices are ready and started without errors.
+        """
+        
+        ids = list(self.devices.keys()) if ids is None else [str(x) for x in ids]
+        end = time.time() + timeout if timeout is not None else None
+        
+        for id in ids:
+            if not self._readyEvent(id).wait(max(0, end - time.time()) if end is not None else None):
+                return False
+            
+            if id in self.devices and self.devices[id]["startup"]["error"] is not None:
+                return False
+        
+        return True
+    
+    def startupStatus(self, httpRequest=None):
+        """
+        Collect the startup timeline: seconds from container creation until each device was added, started and ready.
+        
+        Args:
+            httpRequest (karen.shared.KHTTPHandler): Used to respond to status requests.
+            
+        Returns:
+            (dict): Timeline by device id when called without a request; otherwise True on success
+        """
+        
+        def offset(value):
+            return round(value - self._startupTime, 3) if value is not None else None
+        
+        ret = {}
+        for id in list(self.devices.keys()):
+            item = self.devices[id]
+            startup = item["startup"]
+            ret[id] = { 
+                    "type": item["type"], 
+                    "dependsOn": startup["dependsOn"],
+                    "added": offset(startup["added"]),
+                    "started": offset(startup["started"]),
+                    "ready": offset(startup["ready"]),
+                    "startTime": round(startup["ready"] - startup["started"], 3) if startup["ready"] is not None and startup["started"] is not None else None,
+                    "error": startup["error"]
+                }
+        
+        if httpRequest is None:
+            return ret
+        
+        return httpRequest.sendJSON({ "error": False, "message": "Device startup timeline.", "data": ret })
+    
     @property
     def version(self):
         """
@@ -371,7 +1271,33 @@ class Container():
         if self._isRunning:
             return True 
 
-        self._thread = self._tcpServer()
+        if self.server_mode == "asyncio":
+            self._isRunning = True # Set before the thread starts so a stop() that follows right away is not lost
+            self._thread = self._asyncServer()
+        else:
+            self._thread = self._tcpServer()
+        
+        if self._uplink is not None:
+            self._uplink.start()
+        
+        if self.fanout_parallel and self._fanoutExecutor is None:
+            self._fanoutExecutor = ThreadPoolExecutor(max_workers=self.pool_size)
+        
+        if self.hostname is None or self.hostname == "":
+            watchIPAddress(self._ipAddressChanged)
+        
+        if self.brain_discovery and not self._brainConfigured and not self.isBrain and self._ssdpListener is None:
+            self._ssdpListener = SSDPListener()
+            try:
+                self._ssdpListener.start()
+            except OSError as e:
+                self.logger.warning("Unable to listen for UPNP announcements: " + str(e))
+                self._ssdpListener = None
+        
+        if not self.isBrain and self._registerThread is None:
+            self._registerStop.clear()
+            self._registerThread = self._registrationLoop()
+            
         self.logger.info("Started @ "+ str(self.my_url))
 
         if not useThreads:
@@ -379,9 +1305,27 @@ class Container():
 
         return True
     
+    def _ipAddressChanged(self, address, oldAddress):
+        """
+        Updates my_url after the host's address changed and registers the new url with the brain.
+        
+        Args:
+            address (str):  The new address.
+            oldAddress (str):  The previous address.
+        """
+        
+        with self._statusLock:
+            self.my_url = ("http://" if self.use_http else "https://") + str(address if address is not None and address != "" else "localhost") + ":" + str(self.tcp_port)
+            self._statusVersion += 1 # The status is keyed by my_url
+            self._statusBodies = {}
+        
+        self.logger.info("Address changed.  Now @ " + str(self.my_url))
+        if self._registerThread is not None:
+            self.scheduleRegistration()
+    
     def status(self, httpRequest):
         """
-        Collect status as a JSON object for container and all devices.
+        Collect status as a JSON object for container and all devices.  The body comes from the cached snapshot and carries an ETag so pollers can send If-None-Match and receive 304 until something changes.
         
         Args:
             httpRequest (karen.shared.KHTTPHandler): Used to respond to status requests.
@@ -390,7 +1334,62 @@ class Container():
             (bool): True on success; False on Failure
         """
         
-        return httpRequest.sendJSON(self._getStatus())
+        if isinstance(httpRequest, CapturedRequest):
+            return httpRequest.sendJSON(self._getStatus())
+        
+        version, body = self._statusBody()
+        
+        encoding = None
+        if self.compress_min_size > 0 and len(body) >= self.compress_min_size:
+            encoding = acceptedEncoding(httpRequest.headers.get("accept-encoding"))
+            if encoding is not None:
+                version, body = self._statusBody(encoding)
+        
+        etag = '"' + str(self.id) + "-" + str(version) + ("-" + encoding if encoding is not None else "") + '"'
+        headers = { "ETag": etag, "Vary": "Accept-Encoding" }
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        
+        ifNoneMatch = httpRequest.headers.get("if-none-match")
+        if ifNoneMatch is not None and etag in [x.strip().replace("W/","",1) for x in ifNoneMatch.split(",")]:
+            headers["Content-Length"] = None
+            return httpRequest.sendHTTP(contentType=None, httpStatusCode=304, httpStatusMessage="Not Modified", headers=headers)
+        
+        return httpRequest.sendHTTP(body, contentType="application/json", headers=headers)
+    
+    def poolStatus(self, httpRequest=None):
+        """
+        Collect worker pool counters (queue depth, rejections, etc.) for sizing the pool.
+        
+        Args:
+            httpRequest (karen.shared.KHTTPHandler): Used to respond to status requests.
+            
+        Returns:
+            (dict): Pool counters when called without a request; otherwise True on success
+        """
+        
+        stats = self._workerPool.stats() if self._workerPool is not None else None
+        if httpRequest is None:
+            return stats
+        
+        return httpRequest.sendJSON({ "error": False, "message": "Worker pool status.", "data": stats })
+    
+    def uplinkStatus(self, httpRequest=None):
+        """
+        Collect batched uplink counters (queue depth, drops, flushes, etc.).
+        
+        Args:
+            httpRequest (karen.shared.KHTTPHandler): Used to respond to status requests.
+            
+        Returns:
+            (dict): Uplink counters when called without a request; otherwise True on success
+        """
+        
+        stats = self._uplink.stats() if self._uplink is not None else None
+        if httpRequest is None:
+            return stats
+        
+        return httpRequest.sendJSON({ "error": False, "message": "Uplink status.", "data": stats })
         
     def wait(self, seconds=0):
         """
@@ -438,9 +1437,16 @@ class Container():
             return True 
         
         self._isRunning = False  # Kills the listener loop 
+        unwatchIPAddress(self._ipAddressChanged)
         
         self._waitForThreadPool()
         
+        if self._loop is not None and self._loopStop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._loopStop.set)
+            except RuntimeError:
+                pass # Loop already closed
+        
         if self._serverSocket is not None:
             try:
                 self._serverSocket.shutdown(socket.SHUT_RDWR)
@@ -449,8 +1455,26 @@ class Container():
             except:
                 pass 
             
+        if self._registerThread is not None:
+            self._registerStop.set()
+            self._registerEvent.set()
+            self._registerThread = None
+        
+        if self._ssdpListener is not None:
+            self._ssdpListener.stop()
+            self._ssdpListener = None
+        
         self.stopDevices()
         
+        if self._uplink is not None:
+            self._uplink.stop() # Sends anything still waiting
+        
+        if self._fanoutExecutor is not None:
+            self._fanoutExecutor.shutdown(wait=False)
+            self._fanoutExecutor = None
+        
+        closeHTTPSessions()
+        
         if self.app is not None:
             self.app.quit()
         self.logger.info("Stopped")
@@ -476,7 +1500,7 @@ class Container():
         """
         
         ret = True
-        for item in self.devices:
+        for item in list(self.devices.keys()):
             if item == str(self.id):
                 continue 
             
@@ -492,6 +1516,7 @@ class Container():
                 except:
                     pass
         
+        self.updateStatus()
         return ret
     
     def callbackHandler(self, inType, data):
@@ -506,14 +1531,35 @@ class Container():
             (bool):  True on success or False on failure.
         """
         
+        if self._uplink is not None and self._uplink.put(inType, data):
+            return True
+        
         headers=None
         if self.authenticationKey is not None:
             headers = { "Cookie": "token="+self.authenticationKey}
         
         jsonData = { "type": inType, "data": data }
-        result = sendHTTPRequest(urljoin(self.brain_url,"/brain/collect"), jsonData=jsonData, origin=self.my_url, groupName=self.groupName, headers=headers)[0]
+        result = sendHTTPRequest(urljoin(self.brain_url,"/brain/collect"), jsonData=jsonData, origin=self.my_url, groupName=self.groupName, headers=headers, compress=self.uplink_compress)[0]
         return result 
     
+    def _sendCollectBatch(self, items):
+        """
+        Sends a batch of queued callbackHandler events to the brain in one request.
+        
+        Args:
+            items (list):  Events as { "type": ..., "data": ... } in the order collected.
+            
+        Returns:
+            (bool):  True on success or False on failure.
+        """
+        
+        headers=None
+        if self.authenticationKey is not None:
+            headers = { "Cookie": "token="+self.authenticationKey}
+        
+        jsonData = { "type": "BATCH", "data": items }
+        return sendHTTPRequest(urljoin(self.brain_url,"/brain/collect"), jsonData=jsonData, origin=self.my_url, groupName=self.groupName, headers=headers, compress=self.uplink_compress)[0]
+    
 class DeviceTemplate():
     def __init__(self,
             parent=None,
@@ -527,16 +1573,25 @@ class DeviceTemplate():
     def accepts(self):
         return ["start","stop"] # Add "upgrade" if the device can be upgraded with "pip install --upgrade" command.
     
-    @property
     def isRunning(self):
         return self._isRunning
     
+    def _statusChanged(self):
+        """
+        Tells the parent container to refresh this device's entry in its status snapshot.
+        """
+        
+        if self.parent is not None and hasattr(self.parent, "updateStatus"):
+            self.parent.updateStatus(self)
+    
     def start(self, httpRequest=None):
         self._isRunning = True
+        self._statusChanged()
         return True
     
     def stop(self, httpRequest=None):
         self._isRunning = False
+        self._statusChanged()
         return True
     
     def upgrade(self, httpRequest=None):
@@ -0,0 +1,150 @@
+"""
+Shared fixtures for tests that run a Container on a local port.
+"""
+
+import gzip, json, socket, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from karen.templates import Container, DeviceTemplate
+
+class Echo(DeviceTemplate):
+    """
+    Test device that answers with the request body (or a fixed reply) and can hand its socket off for streaming.
+    """
+    
+    accepts = ["start", "stop", "echo", "ignore", "slow", "stream"]
+    
+    def echo(self, httpRequest):
+        return httpRequest.sendHTTP(httpRequest.body, contentType="text/plain")
+    
+    def ignore(self, httpRequest):
+        return httpRequest.sendHTTP(b"ignored", contentType="text/plain") # Leaves any request body unread
+    
+    def slow(self, httpRequest):
+        time.sleep(0.5)
+        return httpRequest.sendHTTP(b"slow", contentType="text/plain")
+    
+    def stream(self, httpRequest):
+        sock = httpRequest.sendHeaders(contentType="multipart/x-mixed-replace; boundary=frame")
+        
+        def run():
+            for i in range(5):
+                sock.sendall(b"--frame\r\n" + str(i).encode() + b"\r\n")
+                time.sleep(0.05)
+            sock.close()
+            
+        threading.Thread(target=run, daemon=True).start()
+
+def freePort():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def startContainer(isBrain=True, **kwargs):
+    """
+    Starts a container that serves requests without saving anything under ~/.karen.
+    
+    Args:
+        isBrain (bool):  Run as the brain so nothing is registered; False registers with brain_url like a device container.
+    
+    Returns:
+        (Container):  The running container with an Echo device named "e".
+    """
+    
+    kwargs.setdefault("tcp_port", freePort())
+    kwargs.setdefault("brain_cache_file", None)
+    container = Container(hostname="127.0.0.1", authentication={}, **kwargs)
+    container.isBrain = isBrain
+    container.initialize()
+    container.addDevice("echo", Echo(), id="e")
+    container.start()
+    
+    for i in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", container.tcp_port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    
+    return container
+
+def waitFor(condition, timeout=5):
+    """
+    Polls until condition() is true.
+    
+    Returns:
+        (bool):  The last result of condition().
+    """
+    
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.02)
+    
+    return condition()
+
+def exchange(port, raw, timeout=1.0):
+    """
+    Sends raw bytes on a new connection and collects everything received until the server closes it or goes quiet.
+    
+    Returns:
+        (tuple):  (received bytes, True if the server closed the connection)
+    """
+    
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.settimeout(timeout)
+    sock.sendall(raw)
+    
+    data = b""
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return data, True
+            data += chunk
+    except socket.timeout:
+        return data, False
+    finally:
+        sock.close()
+
+class FakeBrain(object):
+    """
+    HTTP server standing in for a brain.  Records every request as (path, headers, parsed JSON body).
+    """
+    
+    def __init__(self):
+        brain = self
+        self.requests = []
+        self.available = True
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def log_message(self, *args):
+                pass
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                
+                brain.requests.append((self.path, dict(self.headers), json.loads(body) if body else None))
+                reply = json.dumps({ "error": not brain.available, "message": "ok" }).encode()
+                self.send_response(200 if brain.available else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def paths(self):
+        return [x[0] for x in self.requests]
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,53 @@
+import threading, time, unittest
+
+from .helpers import startContainer, exchange, freePort
+
+from karen.templates import Container
+
+class TestAsyncioServer(unittest.TestCase):
+    """
+    Container with server_mode="asyncio".
+    """
+
+    def testStopRightAfterStart(self):
+        for i in range(5):
+            container = Container(tcp_port=freePort(), hostname="127.0.0.1", authentication={}, server_mode="asyncio", brain_cache_file=None)
+            container.isBrain = True
+            container.start()
+            container.stop()
+
+            container._thread.join(5)
+            self.assertFalse(container._thread.is_alive())
+            self.assertIsNone(container._loop)
+
+    def testBlockingHandlersRunConcurrently(self):
+        container = startContainer(server_mode="asyncio", pool_size=4)
+        try:
+            results = []
+            request = b"GET /device/e/slow HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+            threads = [threading.Thread(target=lambda: results.append(exchange(container.tcp_port, request, timeout=3))) for i in range(4)]
+
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertLess(time.time() - start, 1.5) # Each request sleeps 0.5 seconds on an executor thread
+            self.assertEqual([x[0].count(b"200 OK") for x in results], [1, 1, 1, 1])
+        finally:
+            container.stop()
+            container.wait()
+
+    def testIncompleteRequestTimesOut(self):
+        container = startContainer(server_mode="asyncio")
+        container.request_timeout = 0.5
+        try:
+            data, closed = exchange(container.tcp_port, b"GET /device/e/ignore HTTP/1.1\r\nHost: x\r\n", timeout=3)
+            self.assertTrue(closed)
+        finally:
+            container.stop()
+            container.wait()
+
+if __name__ == "__main__":
+    unittest.main()
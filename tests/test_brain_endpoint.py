@@ -0,0 +1,87 @@
+import json, os, shutil, tempfile, time, unittest
+
+from .helpers import startContainer, waitFor, freePort, FakeBrain
+
+class TestSavedBrainEndpoint(unittest.TestCase):
+    """
+    brain.json: saving the brain that accepted a registration and probing it at the next start.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.folder, "karen", "brain.json")
+        self.brain = FakeBrain()
+        self.container = None
+
+    def tearDown(self):
+        if self.container is not None:
+            self.container.stop()
+            self.container.wait()
+        self.brain.close()
+        shutil.rmtree(self.folder)
+
+    def start(self, **kwargs):
+        self.container = startContainer(isBrain=False, brain_cache_file=self.cacheFile, register_delay=0.1, **kwargs)
+        return self.container
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+        with open(self.cacheFile, "w") as fp:
+            fp.write(data if isinstance(data, str) else json.dumps(data))
+
+    def saved(self):
+        try:
+            with open(self.cacheFile) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def testSavedAfterRegistration(self):
+        container = self.start(brain_url=self.brain.url)
+        self.assertTrue(waitFor(lambda: os.path.isfile(self.cacheFile)))
+
+        data = self.saved()
+        self.assertEqual(data["url"], self.brain.url)
+        self.assertEqual(data["version"], container._statusTag())
+        self.assertFalse(os.path.exists(self.cacheFile + ".tmp"))
+
+    def testSavedBrainIsProbedFirst(self):
+        self.save({ "url": self.brain.url, "version": "old", "time": time.time() })
+        container = self.start()
+
+        self.assertTrue(waitFor(lambda: container.brain_url == self.brain.url))
+        self.assertTrue(waitFor(lambda: self.saved().get("version") == container._statusTag()))
+        time.sleep(0.5)
+        self.assertEqual(self.brain.paths(), ["/brain/register"]) # The probe was the registration
+
+    def testUnavailableSavedBrain(self):
+        deadUrl = "http://127.0.0.1:" + str(freePort())
+        self.save({ "url": deadUrl, "version": "old", "time": time.time() })
+
+        begin = time.time()
+        container = self.start(brain_probe_timeout=0.5)
+        time.sleep(0.3)
+        self.assertEqual(container.brain_url, "http://localhost:8080") # Falls back to the default
+        self.assertLess(time.time() - begin, 2)
+        self.assertEqual(self.saved()["url"], deadUrl) # Kept until another brain accepts a registration
+
+    def testRejectedProbe(self):
+        self.brain.available = False
+        self.save({ "url": self.brain.url, "version": "old", "time": time.time() })
+        container = self.start()
+
+        self.assertTrue(waitFor(lambda: len(self.brain.requests) > 0))
+        time.sleep(0.3)
+        self.assertEqual(container.brain_url, "http://localhost:8080")
+        self.assertEqual(len(self.brain.requests), 1) # Probed once without retries
+
+    def testInvalidFile(self):
+        self.save("{ not json")
+        container = self.start(brain_url=self.brain.url)
+        self.assertIsNone(container._loadBrainEndpoint())
+
+        self.assertTrue(waitFor(lambda: len(self.brain.requests) > 0))
+        self.assertTrue(waitFor(lambda: self.saved().get("url") == self.brain.url)) # Replaced after the next registration
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import gzip, http.client, json, unittest, zlib
+
+from karen.shared import acceptedEncoding, compressBody, decompressBody, sendHTTPRequest, HTTPRequestError
+
+from .helpers import startContainer, FakeBrain
+
+class TestContentCoding(unittest.TestCase):
+
+    def testAcceptedEncoding(self):
+        self.assertIsNone(acceptedEncoding(None))
+        self.assertIsNone(acceptedEncoding("identity"))
+        self.assertEqual(acceptedEncoding("gzip, deflate"), "gzip")
+        self.assertEqual(acceptedEncoding("gzip;q=0.5, deflate"), "deflate")
+        self.assertEqual(acceptedEncoding("*"), "gzip")
+        self.assertIsNone(acceptedEncoding("*, gzip;q=0, deflate;q=0"))
+        self.assertEqual(acceptedEncoding("GZIP"), "gzip")
+        self.assertEqual(acceptedEncoding("x-gzip"), "gzip")
+        self.assertIsNone(acceptedEncoding("gzip;q=abc"))
+
+    def testRoundTrip(self):
+        data = b'{"value": 1}' * 100
+        for encoding in ["gzip", "deflate"]:
+            compressed = compressBody(data, encoding)
+            self.assertLess(len(compressed), len(data))
+            self.assertEqual(decompressBody(compressed, encoding), data)
+
+        self.assertEqual(gzip.decompress(compressBody(data, "gzip")), data)
+        self.assertEqual(decompressBody(gzip.compress(data), " X-GZIP "), data)
+        self.assertEqual(decompressBody(data, "identity"), data)
+        self.assertRaises(ValueError, compressBody, data, "br")
+
+    def testRawDeflate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.assertEqual(decompressBody(compressor.compress(b"raw") + compressor.flush(), "deflate"), b"raw")
+
+    def assertRejected(self, status, *args):
+        with self.assertRaises(HTTPRequestError) as ctx:
+            decompressBody(*args)
+        self.assertEqual(ctx.exception.httpStatusCode, status)
+
+    def testInvalidBodies(self):
+        self.assertRejected(415, b"data", "br")
+        self.assertRejected(400, b"not compressed", "gzip")
+        self.assertRejected(413, gzip.compress(b"\0" * 100000), "gzip", 1000) # Expansion is capped
+
+class TestCompressedMessages(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.container = startContainer(compress_min_size=64, max_body_size=4096)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.container.stop()
+        cls.container.wait()
+
+    def post(self, body, headers):
+        conn = http.client.HTTPConnection("127.0.0.1", self.container.tcp_port, timeout=5)
+        try:
+            conn.request("POST", "/device/e/echo", body=body, headers=headers)
+            res = conn.getresponse()
+            return res.status, dict(res.getheaders()), res.read()
+        finally:
+            conn.close()
+
+    def testResponseCompression(self):
+        data = b"x" * 200
+        status, headers, body = self.post(data, { "Accept-Encoding": "gzip" })
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(body), data)
+
+        status, headers, body = self.post(b"short", { "Accept-Encoding": "gzip" })
+        self.assertNotIn("Content-Encoding", headers) # Below compress_min_size
+
+        status, headers, body = self.post(data, {})
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(body, data)
+
+    def testRequestDecompression(self):
+        status, headers, body = self.post(gzip.compress(b"hello"), { "Content-Encoding": "gzip" })
+        self.assertEqual(body, b"hello")
+
+        status, headers, body = self.post(gzip.compress(b"\0" * 10000), { "Content-Encoding": "gzip" })
+        self.assertEqual(status, 413) # Larger than max_body_size once decompressed
+        self.assertTrue(json.loads(body)["error"])
+
+    def testCompressedRequests(self):
+        brain = FakeBrain()
+        try:
+            data = { "items": ["value"] * 500 }
+            ret = sendHTTPRequest(brain.url + "/brain/collect", jsonData=data, compress=True)
+            self.assertTrue(ret[0])
+            path, headers, body = brain.requests[-1]
+            self.assertEqual(headers["Content-Encoding"], "gzip")
+            self.assertLess(int(headers["Content-Length"]), len(json.dumps(data)))
+            self.assertEqual(body, data)
+
+            sendHTTPRequest(brain.url + "/brain/collect", jsonData={ "items": [] }, compress=True)
+            self.assertNotIn("Content-Encoding", brain.requests[-1][1]) # Too small to be worth it
+        finally:
+            brain.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from .helpers import startContainer, exchange
+
+class TestRequestFramingThreads(unittest.TestCase):
+    """
+    Request body framing on persistent connections (server_mode="threads").
+    """
+
+    serverMode = "threads"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.container = startContainer(server_mode=cls.serverMode, keepalive_timeout=1, max_body_size=1024)
+        cls.port = cls.container.tcp_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.container.stop()
+        cls.container.wait()
+
+    def testChunkedBody(self):
+        data, closed = exchange(self.port, b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+                                           b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n"
+                                           b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\nConnection: close\r\n\r\nabc")
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+        self.assertIn(b"\r\n\r\nhello world", data)
+        self.assertTrue(data.endswith(b"\r\n\r\nabc"))
+        self.assertTrue(closed)
+
+    def testUnreadChunkedBodyIsDrained(self):
+        data, closed = exchange(self.port, b"POST /device/e/ignore HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+                                           b"1c\r\nGET /device/e/x HTTP/1.1\r\n\r\n\r\n0\r\n\r\n"
+                                           b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\nok")
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+        self.assertTrue(data.endswith(b"\r\n\r\nok"))
+
+    def assertRejected(self, raw, statusLine):
+        data, closed = exchange(self.port, raw + b"GET /device/e/ignore HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(data.startswith(statusLine))
+        self.assertEqual(data.count(b"HTTP/1.1 "), 1) # Nothing after an unframeable body is served
+        self.assertTrue(closed)
+
+    def testRejectsAmbiguousFraming(self):
+        self.assertRejected(b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n\r\n", b"HTTP/1.1 400 ")
+        self.assertRejected(b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: gzip, chunked\r\n\r\n0\r\n\r\n", b"HTTP/1.1 501 ")
+        self.assertRejected(b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", b"HTTP/1.1 400 ")
+        self.assertRejected(b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nContent-Length: 2048\r\n\r\n", b"HTTP/1.1 413 ")
+
+    def testHeadersTooLarge(self):
+        data, closed = exchange(self.port, b"GET /device/e/ignore HTTP/1.1\r\nX-Big: " + b"x" * 70000 + b"\r\n\r\n")
+        self.assertTrue(data.startswith(b"HTTP/1.1 431 "))
+        self.assertTrue(closed)
+
+class TestRequestFramingAsyncio(TestRequestFramingThreads):
+    """
+    Request body framing on persistent connections (server_mode="asyncio").
+    """
+
+    serverMode = "asyncio"
+
+if __name__ == "__main__":
+    unittest.main()
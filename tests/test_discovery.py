@@ -0,0 +1,106 @@
+import socket, time, types, unittest
+from unittest import mock
+
+from karen import shared
+from karen.shared import discoverDevices, discoveredDevices, clearDiscoveryCache, _parseSSDP, _cacheDevice
+
+def response(usn, kind="SPEAKER", maxAge=1800):
+    return ("HTTP/1.1 200 OK\r\nCACHE-CONTROL: max-age=" + str(maxAge) + "\r\nLOCATION: http://10.0.0.5:8080\r\nST: upnp:rootdevice\r\n"
+            "USN: " + usn + "\r\nX-KAREN-TYPE: " + kind + "\r\n\r\n").encode()
+
+class FakeUDPSocket(object):
+    """
+    UDP socket stand-in that returns queued responses to a search.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = []
+        self.received = 0
+
+    def sendto(self, data, destination):
+        self.sent.append((data, destination))
+
+    def settimeout(self, value):
+        pass
+
+    def recvfrom(self, size):
+        if len(self.responses) == 0:
+            raise socket.timeout()
+        self.received += 1
+        return self.responses.pop(0), ("10.0.0.5", 1900)
+
+    def close(self):
+        pass
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        clearDiscoveryCache()
+        self.sockets = []
+
+    def tearDown(self):
+        clearDiscoveryCache()
+
+    def discover(self, responses, **kwargs):
+        """
+        Runs discoverDevices with the network replaced by a socket that answers with the given responses.
+        """
+
+        def factory(*args):
+            self.sockets.append(FakeUDPSocket(responses))
+            return self.sockets[-1]
+
+        fakeSocket = types.SimpleNamespace(**{ x: getattr(socket, x) for x in dir(socket) if not x.startswith("__") })
+        fakeSocket.socket = factory
+        with mock.patch.object(shared, "socket", fakeSocket):
+            return [x["usn"] for x in discoverDevices(timeout=1, **kwargs)]
+
+    def cache(self, usn, kind="SPEAKER", maxAge=1800):
+        _cacheDevice(_parseSSDP(response(usn, kind, maxAge), ("10.0.0.5", 1900)))
+
+    def testCachedMatch(self):
+        self.cache("uuid:speaker")
+        self.cache("uuid:brain", "BRAIN")
+
+        self.assertEqual(self.discover([response("uuid:other", "BRAIN")], match={ "X-KAREN-TYPE": "brain" }), ["uuid:brain"])
+        self.assertEqual(self.sockets, []) # Answered from the cache without a search
+
+    def testCachedEnumeration(self):
+        self.cache("uuid:a")
+        self.cache("uuid:b")
+
+        found = self.discover([response("uuid:a"), response("uuid:c")])
+        self.assertEqual(sorted(found[:2]), ["uuid:a", "uuid:b"]) # Cached entries first
+        self.assertEqual(found[2:], ["uuid:c"]) # Then new devices from the search, each USN once
+        self.assertEqual(len(self.sockets), 1)
+
+    def testSearchEnumeration(self):
+        found = self.discover([response("uuid:a"), response("uuid:b"), response("uuid:a")])
+        self.assertEqual(found, ["uuid:a", "uuid:b"])
+        self.assertIn(b"ST:upnp:rootdevice\r\n", self.sockets[0].sent[0][0])
+        self.assertEqual(sorted(x["usn"] for x in discoveredDevices()), ["uuid:a", "uuid:b"])
+
+    def testSearchStopsOnMatch(self):
+        found = self.discover([response("uuid:a"), response("uuid:brain", "BRAIN"), response("uuid:c")], match={ "X-KAREN-TYPE": "BRAIN" })
+        self.assertEqual(found, ["uuid:brain"])
+        self.assertEqual(self.sockets[0].received, 2)
+
+        found = self.discover([response("uuid:d")], useCache=False, match=lambda x: x["usn"].startswith("uuid:"), stopOnMatch=False)
+        self.assertEqual(found, ["uuid:d"])
+
+    def testCacheExpiry(self):
+        self.cache("uuid:old", maxAge=0)
+        self.cache("uuid:new")
+        time.sleep(0.01)
+        self.assertEqual([x["usn"] for x in discoveredDevices()], ["uuid:new"])
+
+    def testNotifyKeepsSearchHeaders(self):
+        self.cache("uuid:brain", "BRAIN")
+        notify = b"NOTIFY * HTTP/1.1\r\nCACHE-CONTROL: max-age=1800\r\nNTS: ssdp:alive\r\nUSN: uuid:brain\r\n\r\n"
+        self.assertFalse(_cacheDevice(_parseSSDP(notify, ("10.0.0.5", 1900))))
+
+        self.assertEqual([x["usn"] for x in discoveredDevices({ "X-KAREN-TYPE": "BRAIN" })], ["uuid:brain"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import http.client, json, unittest
+
+from karen.templates import DeviceTemplate
+
+from .helpers import startContainer
+
+class Light(DeviceTemplate):
+    """
+    Test device that counts how often each action was called.
+    """
+
+    accepts = ["start", "stop", "toggle", "missing"]
+
+    def __init__(self):
+        super(Light, self).__init__()
+        self.calls = []
+
+    def toggle(self, httpRequest):
+        self.calls.append("toggle")
+
+class TestDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.container = startContainer()
+        self.lights = [Light(), Light()]
+        for i, light in enumerate(self.lights):
+            self.container.addDevice("light", light, id="l" + str(i))
+
+    def tearDown(self):
+        self.container.stop()
+        self.container.wait()
+
+    def get(self, path):
+        conn = http.client.HTTPConnection("127.0.0.1", self.container.tcp_port, timeout=5)
+        try:
+            conn.request("GET", path)
+            res = conn.getresponse()
+            body = res.read()
+            return res.status, (json.loads(body) if res.getheader("Content-Type") == "application/json" else body)
+        finally:
+            conn.close()
+
+    def testDeviceRequest(self):
+        status, body = self.get("/device/l0/toggle")
+        self.assertFalse(body["error"])
+        self.assertEqual(self.lights[0].calls, ["toggle"])
+        self.assertEqual(self.lights[1].calls, [])
+
+    def testUnsupportedAction(self):
+        for path in ["/device/l0/dim", "/device/l0/missing", "/device/l0/__init__"]:
+            status, body = self.get(path)
+            self.assertTrue(body["error"])
+            self.assertEqual(body["message"], "Request not supported.")
+
+        self.assertNotIn(("l0", "missing"), self.container._dispatch) # Accepted but not implemented
+
+    def testTypeRequest(self):
+        self.get("/type/light/toggle")
+        self.assertEqual([x.calls for x in self.lights], [["toggle"], ["toggle"]])
+
+        self.get("/type/-/toggle")
+        self.assertEqual([x.calls for x in self.lights], [["toggle"] * 2, ["toggle"] * 2])
+
+    def testReaddedWithAnotherType(self):
+        self.container.addDevice("lamp", self.lights[0], id="l0")
+        self.assertEqual(self.container._typeIndex["light"], ["l1"])
+        self.assertEqual(self.container._typeIndex["lamp"], ["l0"])
+
+        self.get("/type/light/toggle")
+        self.assertEqual([x.calls for x in self.lights], [[], ["toggle"]])
+
+    def testRemoveDevice(self):
+        self.assertTrue(self.container.removeDevice("l1"))
+        self.assertFalse(self.container.removeDevice("l1"))
+
+        self.get("/type/light/toggle")
+        status, body = self.get("/device/l1/toggle")
+        self.assertEqual(status, 404)
+        self.assertEqual([x.calls for x in self.lights], [["toggle"], []])
+        self.assertNotIn("l1", self.container._getStatus()[self.container.my_url])
+
+        self.container.removeDevice("l0")
+        self.assertNotIn("light", self.container._typeIndex)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import http.client, json, time, unittest
+
+from karen.templates import DeviceTemplate
+
+from .helpers import startContainer
+
+class Sensor(DeviceTemplate):
+    """
+    Test device whose "ping" action takes a fixed time, optionally failing.
+    """
+
+    accepts = ["start", "stop", "ping", "reply"]
+
+    def __init__(self, delay=0, fail=False):
+        super(Sensor, self).__init__()
+        self.delay = delay
+        self.fail = fail
+
+    def ping(self, httpRequest):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("sensor offline")
+        return "pong"
+
+    def reply(self, httpRequest):
+        return httpRequest.sendJSON({ "error": False, "message": "ok", "data": httpRequest.JSONData })
+
+class TestFanOut(unittest.TestCase):
+
+    def start(self, devices, **kwargs):
+        self.container = startContainer(fanout_parallel=True, **kwargs)
+        for devId, device in devices:
+            self.container.addDevice("sensor", device, id=devId)
+
+    def tearDown(self):
+        self.container.stop()
+        self.container.wait()
+
+    def request(self, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.container.tcp_port, timeout=10)
+        try:
+            start = time.time()
+            if body is None:
+                conn.request("GET", path)
+            else:
+                conn.request("POST", path, body=json.dumps(body), headers={ "Content-Type": "application/json" })
+            res = conn.getresponse()
+            return json.loads(res.read()), time.time() - start
+        finally:
+            conn.close()
+
+    def testConcurrentResults(self):
+        self.start([("s" + str(i), Sensor(delay=0.3)) for i in range(4)] + [("bad", Sensor(fail=True))], pool_size=10)
+        body, elapsed = self.request("/type/sensor/ping")
+
+        self.assertLess(elapsed, 1) # Not 4 x 0.3 seconds
+        self.assertTrue(body["error"])
+        self.assertEqual(sorted(body["data"]), ["bad", "s0", "s1", "s2", "s3"])
+        self.assertEqual(body["data"]["s0"]["result"], "pong")
+        self.assertGreaterEqual(body["data"]["s0"]["elapsed"], 0.3)
+        self.assertEqual(body["data"]["bad"]["result"], "sensor offline")
+        self.assertFalse(body["data"]["bad"]["timedOut"])
+
+    def testResponsesAreCaptured(self):
+        self.start([("s0", Sensor()), ("s1", Sensor())])
+        body, elapsed = self.request("/type/sensor/reply", { "value": 1 })
+
+        self.assertFalse(body["error"])
+        for devId in ["s0", "s1"]:
+            self.assertEqual(body["data"][devId]["response"]["data"]["data"], { "value": 1 })
+
+    def testTimeoutCountsFromStartOfEachCall(self):
+        devices = [("slow0", Sensor(delay=1)), ("slow1", Sensor(delay=1)), ("fast0", Sensor()), ("fast1", Sensor())]
+        self.start(devices, pool_size=2, fanout_timeout=0.5)
+        body, elapsed = self.request("/type/sensor/ping")
+
+        self.assertTrue(body["data"]["slow0"]["timedOut"])
+        self.assertTrue(body["data"]["slow1"]["timedOut"])
+        for devId in ["fast0", "fast1"]:
+            self.assertFalse(body["data"][devId]["timedOut"]) # Queued behind the slow devices, but fast once started
+            self.assertEqual(body["data"][devId]["result"], "pong")
+
+    def testQueuedCallsGiveUp(self):
+        self.start([("slow" + str(i), Sensor(delay=2)) for i in range(3)], pool_size=1, fanout_timeout=0.3)
+        body, elapsed = self.request("/type/sensor/ping")
+
+        self.assertLess(elapsed, 1.5)
+        self.assertTrue(all(body["data"][x]["timedOut"] for x in body["data"]))
+
+if __name__ == "__main__":
+    unittest.main()
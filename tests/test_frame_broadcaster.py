@@ -0,0 +1,85 @@
+import socket, time, unittest
+
+from karen.shared import FrameBroadcaster
+
+def readUntil(sock, marker, count=1, timeout=2):
+    sock.settimeout(timeout)
+    data = b""
+    while data.count(marker) < count:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+class TestFrameBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.broadcaster = FrameBroadcaster()
+        self.pairs = []
+
+    def tearDown(self):
+        self.broadcaster.stop()
+        for server, client in self.pairs:
+            client.close()
+
+    def connect(self, **kwargs):
+        server, client = socket.socketpair()
+        self.pairs.append((server, client))
+        return self.broadcaster.addClient(server, **kwargs), client
+
+    def testFrameReachesEveryClient(self):
+        clients = [self.connect() for i in range(3)]
+        for streamer, sock in clients:
+            self.assertIn(b"Content-Type: multipart/x-mixed-replace", readUntil(sock, b"--boundarydonotcross"))
+
+        frame = b"\xff\xd8jpeg\xff\xd9"
+        self.broadcaster.publish(frame)
+
+        for streamer, sock in clients:
+            data = readUntil(sock, b"--boundarydonotcross")
+            self.assertIn(b"Content-Length: " + str(len(frame)).encode() + b"\nContent-Type: image/jpeg\n\n" + frame + b"--boundarydonotcross", data)
+
+    def testRawFrames(self):
+        streamer, sock = self.connect(includeHeader=False, includeBoundary=False)
+        self.broadcaster.publish(bytearray(b"frame-1"))
+        self.assertEqual(readUntil(sock, b"frame-1"), b"frame-1")
+
+    def testSlowClientOnlyGetsLatestFrame(self):
+        streamer, sock = self.connect(includeHeader=False, includeBoundary=False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+        big = b"x" * 1000000
+        self.broadcaster.publish(big) # Blocks the sender until it is read
+        time.sleep(0.1)
+        for i in range(10):
+            self.broadcaster.publish(b"frame-" + str(i).encode())
+
+        data = readUntil(sock, b"frame-9", timeout=5)
+        self.assertTrue(data.startswith(big))
+        self.assertNotIn(b"frame-0", data) # Frames published while sending are skipped, not queued
+        self.assertGreater(streamer.dropped, 0)
+
+    def testDisconnectedClientIsRemoved(self):
+        streamer, sock = self.connect()
+        self.assertEqual(len(self.broadcaster.clients), 1)
+
+        sock.close()
+        for i in range(20):
+            self.broadcaster.publish(b"frame")
+            time.sleep(0.05)
+            if len(self.broadcaster.clients) == 0:
+                break
+
+        self.assertEqual(self.broadcaster.clients, [])
+
+    def testStop(self):
+        streamer, sock = self.connect()
+        self.broadcaster.stop()
+
+        streamer.streamThread.join(2)
+        self.assertFalse(streamer.streamThread.is_alive())
+        self.assertEqual(self.broadcaster.clients, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import socket, unittest
+
+from karen.shared import parseHTTPRequestHead, requestBodyLength, parseChunkSize, readChunkedBody, HTTPRequestReader, HTTPRequestError
+
+class TestParseHTTPRequestHead(unittest.TestCase):
+
+    def testRequestLine(self):
+        request = parseHTTPRequestHead(b"GET /device/e/echo?a=1&a=2 HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertEqual(request["command"], "GET")
+        self.assertEqual(request["path"], "/device/e/echo")
+        self.assertEqual(request["query"], { "a": ["1", "2"] })
+        self.assertEqual(request["version"], "HTTP/1.1")
+
+    def testHeadersAndCookies(self):
+        request = parseHTTPRequestHead(b"GET / HTTP/1.1\r\nX-Value: 1\r\nx-value: 2\r\nCookie: a=1\r\nCookie: token=b=c\r\n\r\n")
+        self.assertEqual(request["headers"]["X-VALUE"], "1, 2")
+        self.assertEqual(request["cookies"], { "a": "1", "token": "b=c" })
+
+    def testInvalidRequestLine(self):
+        self.assertIsNone(parseHTTPRequestHead(b"GET /\r\n\r\n"))
+        self.assertIsNone(parseHTTPRequestHead(b"GET / FTP/1.0\r\n\r\n"))
+
+class TestRequestBodyLength(unittest.TestCase):
+
+    def headers(self, raw):
+        return parseHTTPRequestHead(b"POST / HTTP/1.1\r\n" + raw + b"\r\n")["headers"]
+
+    def testFraming(self):
+        self.assertEqual(requestBodyLength(self.headers(b"")), 0)
+        self.assertEqual(requestBodyLength(self.headers(b"Content-Length: 12\r\n")), 12)
+        self.assertEqual(requestBodyLength(self.headers(b"Content-Length: 12\r\nContent-Length: 12\r\n")), 12)
+        self.assertIsNone(requestBodyLength(self.headers(b"Transfer-Encoding: Chunked\r\n")))
+
+    def assertRejected(self, raw, status, maxBodySize=None):
+        with self.assertRaises(HTTPRequestError) as ctx:
+            requestBodyLength(self.headers(raw), maxBodySize)
+        self.assertEqual(ctx.exception.httpStatusCode, status)
+
+    def testRejectsAmbiguousFraming(self):
+        self.assertRejected(b"Content-Length: 4\r\nTransfer-Encoding: chunked\r\n", 400)
+        self.assertRejected(b"Content-Length: 3\r\nContent-Length: 4\r\n", 400)
+        self.assertRejected(b"Content-Length: -1\r\n", 400)
+        self.assertRejected(b"Transfer-Encoding: gzip, chunked\r\n", 501)
+
+    def testBodyTooLarge(self):
+        self.assertRejected(b"Content-Length: 11\r\n", 413, maxBodySize=10)
+
+class TestChunkedBody(unittest.TestCase):
+
+    def decode(self, data, maxBodySize=None):
+        reader = HTTPRequestReader(None)
+        reader._buffer += data
+        reader._recv = lambda: False # Everything is already buffered
+        return reader.readChunkedBody() if maxBodySize is None else readChunkedBody(reader.readLine, reader.read, maxBodySize)
+
+    def testChunkSize(self):
+        self.assertEqual(parseChunkSize(b"1a\r\n"), 26)
+        self.assertEqual(parseChunkSize(b"5;name=value\r\n"), 5)
+        self.assertRaises(HTTPRequestError, parseChunkSize, b"zz\r\n")
+        self.assertRaises(HTTPRequestError, parseChunkSize, b"-5\r\n")
+        self.assertRaises(HTTPRequestError, parseChunkSize, b"5")
+
+    def testDecode(self):
+        self.assertEqual(self.decode(b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n"), b"hello world")
+        self.assertEqual(self.decode(b"0\r\nX-Trailer: 1\r\n\r\n"), b"")
+
+    def testInvalidChunks(self):
+        self.assertRaises(HTTPRequestError, self.decode, b"5\r\nhelloXX0\r\n\r\n")
+        self.assertRaises(HTTPRequestError, self.decode, b"5\r\nhel")
+        self.assertRaises(HTTPRequestError, self.decode, b"5\r\nhello\r\n0\r\n")
+        self.assertRaises(HTTPRequestError, self.decode, b"6\r\nhello!\r\n0\r\n\r\n", 5)
+
+class TestHTTPRequestReader(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+        self.reader = HTTPRequestReader(self.server, maxHeaderSize=1024, maxBodySize=64)
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def testPipelinedRequests(self):
+        self.client.sendall(b"POST /a HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc\r\nGET /b HTTP/1.1\r\n\r\n")
+
+        request = self.reader.readRequest()
+        self.assertEqual(request["path"], "/a")
+        self.assertEqual(self.reader.readBody(requestBodyLength(request["headers"])), b"abc")
+        self.assertTrue(self.reader.hasBufferedData())
+
+        self.assertEqual(self.reader.readRequest()["path"], "/b") # Stray CRLF between requests is ignored
+        self.assertFalse(self.reader.hasBufferedData())
+
+        self.client.shutdown(socket.SHUT_WR)
+        self.assertIsNone(self.reader.readRequest())
+
+    def testRequestSplitAcrossReads(self):
+        self.reader.bufferSize = 3
+        self.client.sendall(b"POST /c HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n")
+
+        request = self.reader.readRequest()
+        self.assertEqual(request["path"], "/c")
+        self.assertEqual(self.reader.readChunkedBody(), b"abc")
+
+    def testLimits(self):
+        self.client.sendall(b"GET / HTTP/1.1\r\nX-Big: " + b"x" * 2048 + b"\r\n\r\n")
+        with self.assertRaises(HTTPRequestError) as ctx:
+            self.reader.readRequest()
+        self.assertEqual(ctx.exception.httpStatusCode, 431)
+
+    def testIncompleteBody(self):
+        self.client.sendall(b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+        self.client.shutdown(socket.SHUT_WR)
+
+        self.reader.readRequest()
+        self.assertRaises(HTTPRequestError, self.reader.readBody, 10)
+
+if __name__ == "__main__":
+    unittest.main()
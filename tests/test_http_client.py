@@ -0,0 +1,108 @@
+import gzip, json, threading, unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from karen import shared
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super(Handler, self).setup()
+        self.server.connections += 1
+
+    def reply(self, status, contentType, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/json":
+            return self.reply(200, "application/json", b'{"error":false,"message":"ok","data":[1,2]}')
+        if self.path == "/error":
+            return self.reply(200, "application/json", b'{"error":true,"message":"failed"}')
+        if self.path == "/text":
+            return self.reply(200, "text/plain; charset=utf-8", b"hello")
+        if self.path == "/redirect":
+            return self.reply(302, "text/html", b"moved", { "Location": "/elsewhere" })
+        if self.path == "/big-error":
+            return self.reply(500, "text/html", b"x" * 200000)
+        
+        return self.reply(404, "text/html", b"<html>not found</html>" * 50)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        self.server.posted.append(json.loads(body))
+        return self.reply(200, "application/json", b'{"error":false,"message":"ok"}')
+
+class TestSendHTTPRequest(unittest.TestCase):
+    """
+    Pooled persistent sessions used by sendHTTPRequest.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.daemon_threads = True
+        cls.server.connections = 0
+        cls.server.posted = []
+        cls.url = "http://127.0.0.1:" + str(cls.server.server_address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        shared.closeHTTPSessions()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        shared.closeHTTPSessions()
+        self.server.connections = 0
+        self.server.posted = []
+
+    def testResponseTypes(self):
+        self.assertEqual(shared.sendHTTPRequest(self.url + "/json", type="GET"), (True, "application/json", { "error": False, "message": "ok", "data": [1, 2] }))
+        self.assertFalse(shared.sendHTTPRequest(self.url + "/error", type="GET")[0])
+        self.assertEqual(shared.sendHTTPRequest(self.url + "/text", type="GET"), (True, "text/plain", "hello"))
+
+    def testConnectionIsReused(self):
+        for i in range(5):
+            self.assertTrue(shared.sendHTTPRequest(self.url + "/json", type="GET")[0])
+            self.assertTrue(shared.sendHTTPRequest(self.url + "/post", jsonData={ "n": i })[0])
+
+        self.assertEqual(self.server.connections, 1) # HTTPServer serves one connection at a time
+        self.assertEqual([x["n"] for x in self.server.posted], [0, 1, 2, 3, 4])
+
+    def testFailedResponsesReleaseTheConnection(self):
+        for path in ["/missing", "/redirect", "/missing", "/json"]:
+            ret = shared.sendHTTPRequest(self.url + path, type="GET")
+            self.assertEqual(len(ret), 3)
+            self.assertEqual(ret[0], path == "/json")
+
+        self.assertEqual(self.server.connections, 1) # Otherwise the next request blocks until the server gives up on the first connection
+
+    def testLargeErrorBodyIsNotRead(self):
+        self.assertFalse(shared.sendHTTPRequest(self.url + "/big-error", type="GET")[0])
+        self.assertTrue(shared.sendHTTPRequest(self.url + "/json", type="GET")[0])
+        self.assertEqual(self.server.connections, 2)
+
+    def testCompressedPost(self):
+        payload = { "items": ["event"] * 500 }
+        self.assertTrue(shared.sendHTTPRequest(self.url + "/post", jsonData=payload, compress=True)[0])
+        self.assertEqual(self.server.posted, [payload])
+
+    def testConnectionFailure(self):
+        ret = shared.sendHTTPRequest("http://127.0.0.1:9/", type="GET", timeout=1, retries=0)
+        self.assertEqual(ret[0], False)
+
+if __name__ == "__main__":
+    unittest.main()
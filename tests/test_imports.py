@@ -0,0 +1,46 @@
+import importlib.util, json, os, subprocess, sys, unittest
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+def loadedModules(statement, modules):
+    """
+    Runs a statement in a new interpreter.
+
+    Returns:
+        (list):  The modules from the list that were imported by the statement.
+    """
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC + (os.pathsep + env["PYTHONPATH"] if "PYTHONPATH" in env else "")
+
+    script = statement + "\nimport sys, json\nprint(json.dumps([x for x in " + repr(modules) + " if x in sys.modules]))"
+    proc = subprocess.run([sys.executable, "-c", script], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+class TestLazyImports(unittest.TestCase):
+
+    heavy = ["asyncio", "orjson", "ujson", "requests", "urllib3", "subprocess", "http.server", "karen_device", "karen_brain"]
+
+    def testImportIsLight(self):
+        self.assertEqual(loadedModules("import karen", self.heavy), [])
+        self.assertEqual(loadedModules("import karen.templates", self.heavy), [])
+
+    def testModulesLoadOnFirstUse(self):
+        self.assertEqual(loadedModules("import karen.shared\nkaren.shared.getHTTPSession('http://localhost:1')", ["requests"]), ["requests"])
+
+        fastest = [x for x in ["orjson", "ujson"] if importlib.util.find_spec(x) is not None][:1] # Only the first one installed is tried
+        self.assertEqual(loadedModules("import karen.shared\nkaren.shared.jsonDumps({})", ["orjson", "ujson"]), fastest)
+
+    def testPluginClasses(self):
+        import karen
+        self.assertIn("Brain", dir(karen))
+        if importlib.util.find_spec("karen_brain") is None:
+            self.assertRaises(AttributeError, getattr, karen, "Brain")
+
+        self.assertRaises(AttributeError, getattr, karen, "NotAPlugin")
+
+if __name__ == "__main__":
+    unittest.main()
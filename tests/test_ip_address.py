@@ -0,0 +1,106 @@
+import threading, unittest
+from unittest import mock
+
+from karen import shared
+from karen.shared import getIPAddress, refreshIPAddresses, watchIPAddress, unwatchIPAddress, UPNPServer
+
+from .helpers import startContainer
+
+class TestIPAddressWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.addresses = { None: "10.0.0.2", "eth1": "192.168.1.2" }
+        self.reads = []
+        self.signature = 1
+
+        def readIPAddress(iface=None):
+            self.reads.append(iface)
+            return self.addresses[iface]
+
+        self.saved = dict(shared._ipAddresses)
+        shared._ipAddresses.clear()
+        self.patches = [mock.patch.object(shared, "_readIPAddress", readIPAddress), mock.patch.object(shared, "_interfaceSignature", lambda: self.signature)]
+        for item in self.patches:
+            item.start()
+
+    def tearDown(self):
+        for item in self.patches:
+            item.stop()
+        shared._ipAddresses.clear()
+        shared._ipAddresses.update(self.saved)
+
+    def testCached(self):
+        self.assertEqual(getIPAddress(), "10.0.0.2")
+        self.addresses[None] = "10.0.0.3"
+        self.assertEqual(getIPAddress(), "10.0.0.2")
+        self.assertEqual(self.reads, [None])
+
+        self.assertEqual(getIPAddress(refresh=True), "10.0.0.3")
+        self.assertEqual(getIPAddress(), "10.0.0.3")
+
+    def testRefreshNotifiesWatchers(self):
+        calls = []
+        def failing(address, oldAddress):
+            raise RuntimeError("callback error")
+        def watcher(address, oldAddress):
+            calls.append((address, oldAddress))
+        def eth1Watcher(address, oldAddress):
+            calls.append(("eth1", address))
+
+        try:
+            watchIPAddress(failing)
+            self.assertEqual(watchIPAddress(watcher), "10.0.0.2")
+            watchIPAddress(eth1Watcher, "eth1")
+            self.assertEqual(refreshIPAddresses(), {})
+
+            self.addresses[None] = "10.0.0.9"
+            self.assertEqual(refreshIPAddresses(), { None: ("10.0.0.2", "10.0.0.9") })
+            self.assertEqual(calls, [("10.0.0.9", "10.0.0.2")]) # Other watchers run even if one fails
+            self.assertEqual(getIPAddress(), "10.0.0.9")
+        finally:
+            for callback in [failing, watcher, eth1Watcher]:
+                unwatchIPAddress(callback)
+
+    def testMonitor(self):
+        changed = threading.Event()
+        def watcher(address, oldAddress):
+            changed.set()
+
+        watchIPAddress(watcher, interval=0.05)
+        try:
+            self.assertIsNotNone(shared._ipAddressMonitor)
+            self.addresses[None] = "10.0.0.4"
+            self.assertFalse(changed.wait(0.2)) # Interfaces are only read again when the signature changes
+
+            self.signature = 2
+            self.assertTrue(changed.wait(2))
+        finally:
+            unwatchIPAddress(watcher)
+            shared._ipAddressPollInterval = 30
+
+        self.assertIsNone(shared._ipAddressMonitor)
+
+    def testContainerFollowsAddress(self):
+        container = startContainer()
+        try:
+            version = container._statusVersion
+            container._ipAddressChanged("10.0.0.7", "10.0.0.2")
+            self.assertEqual(container.my_url, "http://10.0.0.7:" + str(container.tcp_port))
+            self.assertGreater(container._statusVersion, version)
+            self.assertIn(container.my_url, container._getStatus())
+        finally:
+            container.stop()
+            container.wait()
+
+    def testUPNPLocationFollowsAddress(self):
+        parent = mock.Mock(id="c1", version="1", use_http=True, tcp_port=8081, isBrain=False)
+        server = UPNPServer(parent=parent)
+        usn = "uuid:c1::upnp:rootdevice"
+        self.assertEqual(server.services[usn]["LOCATION"], "http://10.0.0.2:8081")
+
+        server._ipAddressChanged("10.0.0.8", "10.0.0.2")
+        self.assertEqual(server.services[usn]["LOCATION"], "http://10.0.0.8:8081")
+        self.assertIn(b"LOCATION: http://10.0.0.8:8081\r\n", server._payloads[usn]["alive"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import importlib.util, json, unittest
+
+from karen import shared
+from karen.shared import isJSONCodecAvailable, setJSONCodec, getJSONCodec, jsonDumps, jsonLoads
+
+class TestJSONCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = list(shared._jsonCodec)
+
+    def tearDown(self):
+        shared._jsonCodec[:] = self.saved
+
+    def codecs(self):
+        return [x for x in ["orjson", "ujson", "json"] if isJSONCodecAvailable(x)]
+
+    def testAvailability(self):
+        self.assertTrue(isJSONCodecAvailable("json"))
+        for name in ["orjson", "ujson"]:
+            self.assertEqual(isJSONCodecAvailable(name), importlib.util.find_spec(name) is not None)
+
+        self.assertRaises(ValueError, isJSONCodecAvailable, "simplejson")
+        self.assertRaises(ValueError, setJSONCodec, "simplejson")
+
+    def testMissingCodec(self):
+        missing = [x for x in ["orjson", "ujson"] if not isJSONCodecAvailable(x)]
+        if len(missing) == 0:
+            self.skipTest("All JSON codecs are installed")
+
+        codec = getJSONCodec()
+        self.assertRaises(ImportError, setJSONCodec, missing[0])
+        self.assertEqual(getJSONCodec(), codec)
+
+    def testSelectedOnFirstUse(self):
+        shared._jsonCodec[:] = [None, shared._autoJSONDumps, shared._autoJSONLoads]
+        self.assertEqual(jsonLoads(b'{"a":1}'), { "a": 1 })
+        self.assertEqual(getJSONCodec(), self.codecs()[0])
+
+        self.assertEqual(setJSONCodec("json"), "json")
+        self.assertEqual(getJSONCodec(), "json")
+
+    def testCodecsAgree(self):
+        values = [
+                { "error": False, "message": "ok", "data": { "temp": 21.5, "on": True, "items": [1, None, "two"] } },
+                { "text": "café ☃ </script>" },
+                { "big": 2 ** 70 },             # Beyond orjson's 64 bit integers
+                { 1: "a", 2: "b" },              # Non-string keys
+                []
+            ]
+
+        for name in self.codecs():
+            setJSONCodec(name)
+            for value in values:
+                data = jsonDumps(value)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(json.loads(data), json.loads(json.dumps(value)), name)
+                self.assertEqual(jsonLoads(data), jsonLoads(data.decode()))
+
+            self.assertIn("café".encode("utf-8"), jsonDumps(values[1])) # Not escaped
+            self.assertNotIn(b" ", jsonDumps({ "a": [1, 2] })) # Compact
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import socket, threading, time, unittest
+
+from karen.shared import IdleConnections
+
+from .helpers import startContainer, exchange
+
+REQUEST = b"GET /device/e/ignore HTTP/1.1\r\nHost: x\r\n\r\n"
+
+class TestKeepAliveThreads(unittest.TestCase):
+    """
+    Persistent connection handling of the container's HTTP server (server_mode="threads").
+    """
+
+    serverMode = "threads"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.container = startContainer(server_mode=cls.serverMode, keepalive_timeout=1, keepalive_max=5)
+        cls.port = cls.container.tcp_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.container.stop()
+        cls.container.wait()
+
+    def testPipelinedRequests(self):
+        data, closed = exchange(self.port, REQUEST * 3)
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 3)
+        self.assertEqual(data.count(b"ignored"), 3)
+        self.assertEqual(data.count(b"Connection: keep-alive"), 3)
+
+    def testSequentialRequests(self):
+        sock = socket.create_connection(("127.0.0.1", self.port))
+        sock.settimeout(2)
+        for i in range(3):
+            sock.sendall(REQUEST)
+            data = b""
+            while not data.endswith(b"ignored"):
+                data += sock.recv(65536)
+        sock.close()
+
+    def testKeepAliveMax(self):
+        data, closed = exchange(self.port, REQUEST * 7)
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 5)
+        self.assertTrue(closed)
+
+    def testConnectionClose(self):
+        data, closed = exchange(self.port, b"GET /device/e/ignore HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n" + REQUEST)
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 1)
+        self.assertIn(b"Connection: close", data)
+        self.assertTrue(closed)
+
+        data, closed = exchange(self.port, b"GET /device/e/ignore HTTP/1.0\r\n\r\n" + REQUEST)
+        self.assertEqual(data.count(b" 200 OK"), 1) # HTTP/1.0 closes unless the client asks for keep-alive
+        self.assertTrue(closed)
+
+    def testUnreadBodyIsDrained(self):
+        body = b"GET /device/e/x HTTP/1.1\r\n\r\n"
+        data, closed = exchange(self.port, b"POST /device/e/ignore HTTP/1.1\r\nHost: x\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body +
+                                           b"POST /device/e/echo HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\nok")
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2) # The first body looks like a request but must not be served as one
+        self.assertTrue(data.endswith(b"\r\n\r\nok"))
+
+    def testIdleConnectionIsClosed(self):
+        sock = socket.create_connection(("127.0.0.1", self.port))
+        sock.settimeout(5)
+        sock.sendall(REQUEST)
+        self.assertIn(b"200 OK", sock.recv(65536))
+
+        start = time.time()
+        while sock.recv(65536):
+            pass
+        self.assertLess(time.time() - start, 4)
+        sock.close()
+
+    def testStreamHandOff(self):
+        data, closed = exchange(self.port, b"GET /device/e/stream HTTP/1.1\r\nHost: x\r\n\r\n", timeout=3)
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK"))
+        self.assertEqual(data.count(b"--frame\r\n"), 5) # Written by the device thread after the request returned
+        self.assertTrue(closed)
+
+class TestKeepAliveAsyncio(TestKeepAliveThreads):
+    """
+    Persistent connection handling of the container's HTTP server (server_mode="asyncio").
+    """
+
+    serverMode = "asyncio"
+
+class TestIdleConnections(unittest.TestCase):
+    """
+    Idle keep-alive connections are parked outside the worker pool.
+    """
+
+    def setUp(self):
+        self.ready = []
+        self.readyEvent = threading.Event()
+        self.idle = IdleConnections(self.resume, timeout=0.5)
+        self.idle.start()
+        self.pairs = []
+
+    def tearDown(self):
+        self.idle.stop()
+        for a, b in self.pairs:
+            a.close()
+            b.close()
+
+    def resume(self, sock, data):
+        self.ready.append((sock, data))
+        self.readyEvent.set()
+
+    def pair(self):
+        server, client = socket.socketpair()
+        self.pairs.append((server, client))
+        return server, client
+
+    def testReadableConnectionIsResumed(self):
+        server, client = self.pair()
+        self.assertTrue(self.idle.add(server, "state"))
+        self.assertEqual(len(self.idle), 1)
+
+        client.sendall(REQUEST)
+        self.assertTrue(self.readyEvent.wait(2))
+        self.assertEqual(self.ready, [(server, "state")])
+        self.assertEqual(len(self.idle), 0)
+        self.assertEqual(server.recv(65536), REQUEST) # The data is left for the caller
+
+    def testExpiredConnectionIsClosed(self):
+        server, client = self.pair()
+        self.idle.add(server)
+
+        time.sleep(1.2)
+        self.assertEqual(len(self.idle), 0)
+        self.assertEqual(server.fileno(), -1)
+        self.assertEqual(self.ready, [])
+
+    def testStopClosesConnections(self):
+        server, client = self.pair()
+        self.idle.add(server)
+        self.idle.stop()
+
+        self.assertEqual(server.fileno(), -1)
+        self.assertFalse(self.idle.add(self.pair()[0]))
+
+    def testIdleConnectionsDoNotHoldWorkers(self):
+        container = startContainer(pool_size=2, keepalive_timeout=5)
+
+        def get(sock):
+            sock.sendall(REQUEST)
+            data = b""
+            while not data.endswith(b"ignored"):
+                data += sock.recv(65536)
+            return data
+
+        try:
+            idle = []
+            for i in range(4):
+                sock = socket.create_connection(("127.0.0.1", container.tcp_port))
+                sock.settimeout(2)
+                get(sock)
+                idle.append(sock)
+
+            sock = socket.create_connection(("127.0.0.1", container.tcp_port))
+            sock.settimeout(2)
+            self.assertIn(b"200 OK", get(sock)) # Would time out if idle connections occupied both workers
+            self.assertIn(b"200 OK", get(idle[0]))
+            self.assertGreaterEqual(len(container._idleConnections), 3)
+
+            for sock in idle:
+                sock.close()
+        finally:
+            container.stop()
+            container.wait()
+
+if __name__ == "__main__":
+    unittest.main()
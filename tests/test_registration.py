@@ -0,0 +1,63 @@
+import time, unittest
+
+from .helpers import startContainer, waitFor, Echo, FakeBrain
+
+class TestRegistration(unittest.TestCase):
+    """
+    Deferred, coalesced registration of device containers with the brain.
+    """
+
+    def setUp(self):
+        self.brain = FakeBrain()
+        self.container = None
+
+    def tearDown(self):
+        if self.container is not None:
+            self.container.stop()
+            self.container.wait()
+        self.brain.close()
+
+    def start(self, **kwargs):
+        self.container = startContainer(isBrain=False, brain_url=self.brain.url, register_delay=0.1, **kwargs)
+        return self.container
+
+    def registrations(self):
+        return [x for x in self.brain.requests if x[0] == "/brain/register"]
+
+    def testDevicesAreRegisteredTogether(self):
+        container = self.start()
+        for i in range(5):
+            container.addDevice("echo", Echo(), id="d" + str(i))
+
+        self.assertTrue(waitFor(lambda: len(self.registrations()) > 0))
+        time.sleep(0.5)
+        self.assertEqual(len(self.registrations()), 1)
+
+        path, headers, status = self.registrations()[0]
+        self.assertEqual(sorted(status[container.my_url]), sorted([str(container.id), "d0", "d1", "d2", "d3", "d4", "e"]))
+        self.assertEqual(headers["X-STATUS-VERSION"], container._statusTag())
+
+    def testStatusChangesAreRegistered(self):
+        container = self.start()
+        self.assertTrue(waitFor(lambda: len(self.registrations()) == 1))
+
+        container.devices["e"]["device"].stop()
+        self.assertTrue(waitFor(lambda: len(self.registrations()) == 2))
+        self.assertFalse(self.registrations()[-1][2][container.my_url]["e"]["active"])
+
+        container.scheduleRegistration() # Nothing changed since the last one
+        time.sleep(0.5)
+        self.assertEqual(len(self.registrations()), 2)
+
+    def testRetriesUntilTheBrainAccepts(self):
+        self.brain.available = False
+        self.start()
+        self.assertTrue(waitFor(lambda: len(self.registrations()) >= 2, timeout=5))
+
+        self.brain.available = True
+        count = len(self.registrations())
+        self.assertTrue(waitFor(lambda: self.container._registeredTag == self.container._statusTag(), timeout=10))
+        self.assertGreater(len(self.registrations()), count)
+
+if __name__ == "__main__":
+    unittest.main()
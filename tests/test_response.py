@@ -0,0 +1,131 @@
+import json, socket, time, unittest
+from email.utils import parsedate_to_datetime
+
+from karen.shared import httpDate, responseHeaderBlock, sendBuffers, parseHTTPRequestHead, KHTTPHandler
+
+class FakeSocket(object):
+    """
+    Socket stand-in that accepts at most a few bytes per sendmsg call.
+    """
+
+    def __init__(self, maxSend=None, hasSendmsg=True):
+        self.data = b""
+        self.calls = []
+        self.maxSend = maxSend
+        if not hasSendmsg:
+            self.sendmsg = self._unsupported
+
+    def sendmsg(self, buffers):
+        data = b"".join(bytes(x) for x in buffers)
+        if self.maxSend is not None:
+            data = data[:self.maxSend]
+        self.calls.append("sendmsg")
+        self.data += data
+        return len(data)
+
+    def _unsupported(self, buffers):
+        raise NotImplementedError()
+
+    def sendall(self, data):
+        self.calls.append("sendall")
+        self.data += bytes(data)
+
+class TestResponseHeaders(unittest.TestCase):
+
+    def testHTTPDate(self):
+        value = httpDate()
+        self.assertTrue(value.endswith(" GMT"))
+        self.assertLess(abs(parsedate_to_datetime(value).timestamp() - time.time()), 2)
+
+    def testBlockIsCached(self):
+        block = responseHeaderBlock(200, "OK", "text/plain")
+        self.assertIs(responseHeaderBlock(200, "OK", "text/plain"), block)
+        self.assertTrue(block.startswith(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"))
+        self.assertIn(b"Cache-Control: no-store", block)
+        self.assertTrue(block.endswith(b"\r\n"))
+        self.assertFalse(block.endswith(b"\r\n\r\n"))
+
+    def testOverriddenDefaults(self):
+        block = responseHeaderBlock(200, "OK", "text/plain", { "Cache-Control": "max-age=60", "Content-Type": "text/css" })
+        self.assertNotIn(b"Cache-Control", block)
+        self.assertNotIn(b"Content-Type", block)
+        self.assertIn(b"Pragma: no-cache", block)
+
+    def testStatusLine(self):
+        self.assertTrue(responseHeaderBlock(404, "('Not Found',)", None).startswith(b"HTTP/1.1 404 Not Found\r\n"))
+        self.assertNotIn(b"Content-Type", responseHeaderBlock(304, "Not Modified", None))
+
+class TestSendBuffers(unittest.TestCase):
+
+    def testSingleCall(self):
+        sock = FakeSocket()
+        sendBuffers(sock, [b"head", None, b"", bytearray(b"body")])
+        self.assertEqual(sock.data, b"headbody")
+        self.assertEqual(sock.calls, ["sendmsg"])
+
+    def testPartialSends(self):
+        sock = FakeSocket(maxSend=3)
+        sendBuffers(sock, [b"head", b"er", b"body"])
+        self.assertEqual(sock.data, b"headerbody")
+
+    def testFallback(self):
+        sock = FakeSocket(hasSendmsg=False)
+        sendBuffers(sock, [b"head", b"body"])
+        self.assertEqual(sock.data, b"headbody")
+        self.assertEqual(sock.calls, ["sendall"])
+
+        sock = FakeSocket()
+        sendBuffers(sock, [b"only"])
+        self.assertEqual(sock.calls, ["sendall"])
+
+class TestSendHTTP(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+        self.client.settimeout(2)
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def handler(self, raw=b"GET / HTTP/1.1\r\nHost: x\r\n\r\n"):
+        return KHTTPHandler(None, sock=self.server, request=parseHTTPRequestHead(raw), origin="test", allowKeepAlive=True)
+
+    def response(self):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            data += self.client.recv(65536)
+        head, body = data.split(b"\r\n\r\n", 1)
+        lines = head.decode().split("\r\n")
+        return lines[0], dict(x.split(": ", 1) for x in lines[1:]), body
+
+    def testKeepAliveResponse(self):
+        handler = self.handler()
+        self.assertTrue(handler.sendHTTP("hello", contentType="text/plain", headers={ "X-Test": "1", "Pragma": None }))
+        status, headers, body = self.response()
+
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(headers["Content-Length"], "5")
+        self.assertEqual(headers["Connection"], "keep-alive")
+        self.assertEqual(headers["X-Test"], "1")
+        self.assertEqual(headers["Date"], httpDate())
+        self.assertNotIn("Pragma", headers) # None removes a default header
+        self.assertEqual(body, b"hello")
+        self.assertTrue(handler.isResponseSent)
+
+        self.assertTrue(handler.sendHTTP("again")) # Only one response per request
+        self.client.setblocking(False)
+        self.assertRaises(BlockingIOError, self.client.recv, 1)
+
+    def testConnectionClose(self):
+        handler = self.handler(b"GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        handler.sendJSON({ "error": False }, headers={ "X-Test": "1" })
+        status, headers, body = self.response()
+
+        self.assertEqual(headers["Connection"], "close")
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(json.loads(body), { "error": False })
+        self.assertEqual(self.client.recv(1), b"") # Closed after the response
+
+if __name__ == "__main__":
+    unittest.main()
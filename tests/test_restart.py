@@ -0,0 +1,81 @@
+import os, sys, tempfile, threading, types, unittest
+
+import karen
+
+class Service(object):
+    """
+    Stand-in for a brain or container: a thread that runs until stop() is called.
+    """
+
+    def __init__(self, restart=False):
+        self._doRestart = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(restart,), daemon=True)
+        self._thread.start()
+
+    def _run(self, restart):
+        if restart:
+            self._doRestart = True # Asks for a restart right away
+            return
+
+        self._stop.wait()
+
+    def isRunning(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self):
+        self._thread.join()
+
+class TestRestart(unittest.TestCase):
+
+    def testOtherServicesStopForRestart(self):
+        brain, container = Service(), Service(restart=True)
+        karen._waitForServices([brain, container])
+
+        self.assertFalse(brain.isRunning())
+        self.assertTrue(brain._doRestart)
+
+    def testWaitsForAllServices(self):
+        brain, container = Service(), Service()
+        threading.Timer(0.1, container.stop).start()
+        threading.Timer(0.3, brain.stop).start()
+        karen._waitForServices([brain, container]) # Returns once both have stopped
+
+        self.assertFalse(brain.isRunning())
+        self.assertFalse(brain._doRestart)
+
+    def testRestartsInProcess(self):
+        starts = []
+
+        def start(configFile, log_level, log_file, x_wait=True):
+            starts.append(configFile)
+            service = Service(restart=len(starts) == 1)
+            if len(starts) > 1:
+                threading.Timer(0.1, service.stop).start()
+            return service
+
+        module = types.ModuleType("karen_device")
+        module.start = start
+        fd, configFile = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+        saved = { x: sys.modules.get(x) for x in ["karen_device", "karen_brain"] }
+        sys.modules["karen_device"] = module
+        sys.modules["karen_brain"] = None # Not installed
+        try:
+            karen.start(configFile, overwriteConfig=False)
+        finally:
+            for name in saved:
+                if saved[name] is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = saved[name]
+            os.remove(configFile)
+
+        self.assertEqual(starts, [configFile, configFile]) # Rebuilt once without replacing the interpreter
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import http.client, json, time, unittest
+
+from karen.templates import DeviceTemplate
+
+from .helpers import startContainer
+
+class SlowStart(DeviceTemplate):
+    """
+    Test device that takes a while to start and can fail to start.
+    """
+
+    accepts = ["start", "stop"]
+
+    def __init__(self, delay=0.3, fail=False):
+        super(SlowStart, self).__init__()
+        self.delay = delay
+        self.fail = fail
+        self.startedAt = None
+
+    def start(self, httpRequest=None):
+        self.startedAt = time.time()
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("no hardware")
+        return super(SlowStart, self).start(httpRequest)
+
+class TestStartup(unittest.TestCase):
+
+    def start(self, **kwargs):
+        self.container = startContainer(**kwargs)
+        return self.container
+
+    def tearDown(self):
+        self.container.stop()
+        self.container.wait()
+
+    def testParallelStartup(self):
+        container = self.start(parallel_startup=True)
+        begin = time.time()
+        for i in range(3):
+            container.addDevice("slow", SlowStart(), id="s" + str(i))
+        self.assertLess(time.time() - begin, 0.2) # addDevice does not wait for start()
+
+        self.assertTrue(container.waitForDevices(timeout=2))
+        self.assertLess(time.time() - begin, 0.8)
+        self.assertTrue(all(container.devices["s" + str(i)]["device"].isRunning() for i in range(3)))
+
+    def testSequentialStartup(self):
+        container = self.start()
+        begin = time.time()
+        container.addDevice("slow", SlowStart(delay=0.2), id="s0")
+        self.assertGreaterEqual(time.time() - begin, 0.2)
+        self.assertTrue(container.devices["s0"]["device"].isRunning())
+
+    def testDependencies(self):
+        container = self.start(parallel_startup=True)
+        first, second = SlowStart(), SlowStart(delay=0)
+        container.addDevice("slow", second, id="b", dependsOn=["a"]) # Added before the device it needs
+        container.addDevice("slow", first, id="a")
+
+        self.assertTrue(container.waitForDevices(["b"], timeout=2))
+        self.assertGreaterEqual(second.startedAt, first.startedAt + first.delay)
+
+    def testFailedDependency(self):
+        container = self.start(parallel_startup=True)
+        container.addDevice("slow", SlowStart(delay=0, fail=True), id="a")
+        container.addDevice("slow", SlowStart(delay=0), id="b", dependsOn=["a"])
+
+        self.assertFalse(container.waitForDevices(["b"], timeout=2)) # Returns at the first failed device, so wait for the dependent one
+        self.assertFalse(container.waitForDevices(["a"], timeout=2))
+        self.assertTrue(container.waitForDevices(["e"], timeout=2))
+        timeline = container.startupStatus()
+        self.assertEqual(timeline["a"]["error"], "no hardware")
+        self.assertEqual(timeline["b"]["error"], "Dependency a failed to start.")
+        self.assertFalse(container.devices["b"]["device"].isRunning())
+
+    def testDependencyTimeout(self):
+        container = self.start(parallel_startup=True, startup_timeout=0.2)
+        container.addDevice("slow", SlowStart(delay=0), id="b", dependsOn=["missing"])
+
+        self.assertFalse(container.waitForDevices(["b"], timeout=2))
+        self.assertEqual(container.startupStatus()["b"]["error"], "Timed out waiting for missing.")
+
+    def testStartupTimeline(self):
+        container = self.start(parallel_startup=True)
+        container.addDevice("slow", SlowStart(delay=0.2), id="s0")
+        container.addDevice("slow", SlowStart(delay=0), id="manual", autoStart=False)
+        container.waitForDevices(timeout=2)
+
+        conn = http.client.HTTPConnection("127.0.0.1", container.tcp_port, timeout=5)
+        try:
+            conn.request("GET", "/container/" + str(container.id) + "/startupStatus")
+            timeline = json.loads(conn.getresponse().read())["data"]
+        finally:
+            conn.close()
+
+        self.assertGreaterEqual(timeline["s0"]["startTime"], 0.2)
+        self.assertLessEqual(timeline["s0"]["added"], timeline["s0"]["started"])
+        self.assertIsNone(timeline["manual"]["started"])
+        self.assertEqual(timeline["manual"]["ready"], timeline["manual"]["added"])
+        self.assertIsNone(timeline["s0"]["error"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import os, gzip, shutil, tempfile, unittest, http.client
+
+from .helpers import startContainer
+
+class TestStaticFileServer(unittest.TestCase):
+    """
+    Conditional and range requests for /admin files served from static_folder.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.content = bytes(range(256)) * 4
+        with open(os.path.join(cls.folder, "a.bin"), "wb") as fp:
+            fp.write(cls.content)
+        with open(os.path.join(cls.folder, "big.bin"), "wb") as fp:
+            fp.write(cls.content * 64) # Larger than maxCachedFileSize so it is sent with sendFile
+
+        cls.container = startContainer(static_folder=cls.folder)
+        cls.container._staticFiles.maxCachedFileSize = len(cls.content) * 2
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.container.stop()
+        cls.container.wait()
+        shutil.rmtree(cls.folder)
+
+    def get(self, path, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.container.tcp_port, timeout=5)
+        try:
+            conn.request("GET", path, headers=headers or {})
+            res = conn.getresponse()
+            return res.status, res.getheaders(), res.read()
+        finally:
+            conn.close()
+
+    def testETag(self):
+        for name in ["a.bin", "big.bin"]:
+            status, headers, body = self.get("/admin/" + name)
+            headers = dict(headers)
+            self.assertEqual(status, 200)
+            self.assertEqual(len(body), os.path.getsize(os.path.join(self.folder, name)))
+
+            status, cached, body = self.get("/admin/" + name, { "If-None-Match": headers["ETag"] })
+            self.assertEqual(status, 304)
+            self.assertEqual(body, b"")
+
+            status, cached, body = self.get("/admin/" + name, { "If-None-Match": "W/" + headers["ETag"] })
+            self.assertEqual(status, 304)
+
+            status, cached, body = self.get("/admin/" + name, { "If-Modified-Since": headers["Last-Modified"] })
+            self.assertEqual(status, 304)
+
+            status, cached, body = self.get("/admin/" + name, { "If-None-Match": '"outdated"' })
+            self.assertEqual(status, 200)
+
+    def testModifiedFileGetsNewETag(self):
+        fileName = os.path.join(self.folder, "b.txt")
+        with open(fileName, "wb") as fp:
+            fp.write(b"one")
+        status, headers, body = self.get("/admin/b.txt")
+        etag = dict(headers)["ETag"]
+
+        with open(fileName, "wb") as fp:
+            fp.write(b"two!")
+        status, headers, body = self.get("/admin/b.txt", { "If-None-Match": etag })
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"two!")
+        self.assertNotEqual(dict(headers)["ETag"], etag)
+
+    def testRange(self):
+        for name in ["a.bin", "big.bin"]:
+            size = os.path.getsize(os.path.join(self.folder, name))
+
+            status, headers, body = self.get("/admin/" + name, { "Range": "bytes=5-9" })
+            self.assertEqual(status, 206)
+            self.assertEqual(dict(headers)["Content-Range"], "bytes 5-9/" + str(size))
+            self.assertEqual(body, self.content[5:10])
+
+            status, headers, body = self.get("/admin/" + name, { "Range": "bytes=-4" })
+            self.assertEqual(status, 206)
+            self.assertEqual(body, self.content[-4:])
+
+            status, headers, body = self.get("/admin/" + name, { "Range": "bytes=" + str(size) + "-" })
+            self.assertEqual(status, 416)
+            self.assertEqual(dict(headers)["Content-Range"], "bytes */" + str(size))
+
+            status, headers, body = self.get("/admin/" + name, { "Range": "bytes=0-1,4-5" })
+            self.assertEqual(status, 200) # Multiple ranges are answered with the whole file
+            self.assertEqual(len(body), size)
+
+    def testIfRange(self):
+        status, headers, body = self.get("/admin/a.bin")
+        etag = dict(headers)["ETag"]
+
+        status, headers, body = self.get("/admin/a.bin", { "Range": "bytes=0-3", "If-Range": etag })
+        self.assertEqual(status, 206)
+
+        status, headers, body = self.get("/admin/a.bin", { "Range": "bytes=0-3", "If-Range": '"outdated"' })
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.content)
+
+    def testPrecompressed(self):
+        with open(os.path.join(self.folder, "c.js"), "wb") as fp:
+            fp.write(b"var a = 1;")
+        with open(os.path.join(self.folder, "c.js.gz"), "wb") as fp:
+            fp.write(gzip.compress(b"var a = 1;"))
+
+        status, headers, body = self.get("/admin/c.js", { "Accept-Encoding": "gzip" })
+        headers = dict(headers)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body), b"var a = 1;")
+
+        status, plain, body = self.get("/admin/c.js")
+        self.assertEqual(body, b"var a = 1;")
+        self.assertNotEqual(dict(plain)["ETag"], headers["ETag"])
+
+    def testPrecompressedNegotiation(self):
+        with open(os.path.join(self.folder, "d.css"), "wb") as fp:
+            fp.write(b"a{}")
+        with open(os.path.join(self.folder, "d.css.gz"), "wb") as fp:
+            fp.write(gzip.compress(b"a{}"))
+        with open(os.path.join(self.folder, "d.css.br"), "wb") as fp:
+            fp.write(b"not really brotli")
+
+        def encoding(acceptEncoding):
+            status, headers, body = self.get("/admin/d.css", { "Accept-Encoding": acceptEncoding })
+            return dict(headers).get("Content-Encoding")
+
+        self.assertEqual(encoding("gzip, br"), "br")
+        self.assertEqual(encoding("br;q=0.5, gzip"), "gzip")
+        self.assertEqual(encoding("x-gzip"), "gzip")
+        self.assertEqual(encoding("gzip;q=0"), None)
+        self.assertEqual(encoding("br;q=0, *"), "gzip")
+        self.assertEqual(encoding("identity"), None)
+        self.assertEqual(encoding("bro"), None) # Not a substring match
+
+    def testPercentEncodedPath(self):
+        with open(os.path.join(self.folder, "my file.txt"), "wb") as fp:
+            fp.write(b"spaced")
+
+        status, headers, body = self.get("/admin/my%20file.txt")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"spaced")
+
+    def testOutsideRootFolder(self):
+        with open(os.path.join(self.folder, "..", os.path.basename(self.folder) + ".secret"), "wb") as fp:
+            fp.write(b"secret")
+
+        try:
+            status, headers, body = self.get("/admin/../" + os.path.basename(self.folder) + ".secret")
+            self.assertNotEqual(status, 200)
+            self.assertNotIn(b"secret", body)
+
+            for path in ["%2e%2e/", "..%2f", "%2E%2E%2F"]:
+                status, headers, body = self.get("/admin/" + path + os.path.basename(self.folder) + ".secret")
+                self.assertNotEqual(status, 200)
+                self.assertNotIn(b"secret", body)
+
+            status, headers, body = self.get("/admin/a.bin%00.txt")
+            self.assertNotEqual(status, 200)
+        finally:
+            os.remove(self.folder + ".secret")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import gzip, http.client, time, unittest
+
+from .helpers import startContainer, Echo
+
+class TestStatus(unittest.TestCase):
+    """
+    ETag handling of the container status request.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.container = startContainer(compress_min_size=64)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.container.stop()
+        cls.container.wait()
+
+    def get(self, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.container.tcp_port, timeout=5)
+        try:
+            conn.request("GET", "/container/" + str(self.container.id) + "/status", headers=headers or {})
+            res = conn.getresponse()
+            return res.status, dict(res.getheaders()), res.read()
+        finally:
+            conn.close()
+
+    def testETag(self):
+        status, headers, body = self.get()
+        self.assertEqual(status, 200)
+        self.assertIn(self.container.my_url, self.container._getStatus())
+
+        status, cached, body = self.get({ "If-None-Match": headers["ETag"] })
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+        device = self.container.devices["e"]["device"]
+        device.stop() # Any status change invalidates the tag
+        try:
+            status, changed, body = self.get({ "If-None-Match": headers["ETag"] })
+            self.assertEqual(status, 200)
+            self.assertNotEqual(changed["ETag"], headers["ETag"])
+        finally:
+            device.start()
+
+    def testCompressedETag(self):
+        status, headers, body = self.get({ "Accept-Encoding": "gzip" })
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        gzip.decompress(body)
+
+        status, plain, body = self.get()
+        self.assertNotEqual(plain["ETag"], headers["ETag"]) # Each encoding has its own tag
+
+        status, cached, body = self.get({ "Accept-Encoding": "gzip", "If-None-Match": headers["ETag"] })
+        self.assertEqual(status, 304)
+
+class TestStatusSnapshot(unittest.TestCase):
+    """
+    Versioning of the cached status snapshot.
+    """
+
+    def setUp(self):
+        self.container = startContainer()
+
+    def tearDown(self):
+        self.container.stop()
+        self.container.wait()
+
+    def devices(self):
+        return self.container._getStatus()[self.container.my_url]
+
+    def testVersionFollowsDeviceState(self):
+        device = self.container.devices["e"]["device"]
+        version = self.container._statusVersion
+
+        self.assertFalse(self.container.updateStatus("e")) # Nothing changed
+        self.assertEqual(self.container._statusVersion, version)
+
+        device.stop()
+        self.assertEqual(self.container._statusVersion, version + 1)
+        self.assertFalse(self.devices()["e"]["active"])
+
+        device.start()
+        self.assertEqual(self.container._statusVersion, version + 2)
+        self.assertTrue(self.devices()["e"]["active"])
+
+    def testAddAndRemoveDevices(self):
+        version = self.container._statusVersion
+        self.container.addDevice("echo", Echo(), id="e2")
+        self.assertIn("e2", self.devices())
+        self.assertGreater(self.container._statusVersion, version)
+
+        version = self.container._statusVersion
+        self.container.removeDevice("e2")
+        self.assertNotIn("e2", self.devices())
+        self.assertGreater(self.container._statusVersion, version)
+
+    def testBodyIsSerializedOncePerVersion(self):
+        version, body = self.container._statusBody()
+        self.assertIs(self.container._statusBody()[1], body)
+
+        self.container.devices["e"]["device"].stop()
+        newVersion, newBody = self.container._statusBody()
+        self.assertGreater(newVersion, version)
+        self.assertIsNot(newBody, body)
+
+    def testStaleSnapshotIsRebuilt(self):
+        device = self.container.devices["e"]["device"]
+        self.devices()
+        device._isRunning = False # Changes state without telling the container
+        self.assertTrue(self.devices()["e"]["active"])
+
+        self.container.status_max_age = 0
+        self.assertFalse(self.devices()["e"]["active"])
+
+if __name__ == "__main__":
+    unittest.main()
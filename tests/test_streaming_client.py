@@ -0,0 +1,80 @@
+import threading, time, unittest
+
+from karen.shared import StreamingClient
+
+class RecordingClient(StreamingClient):
+
+    def __init__(self, **kwargs):
+        super(RecordingClient, self).__init__(**kwargs)
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def transmit(self, data):
+        self.release.wait(5)
+        self.sent.append(data)
+        return True
+
+class TestStreamingClient(unittest.TestCase):
+
+    def fill(self, client, count):
+        return [client.bufferStreamData(str(i).encode()) for i in range(count)]
+
+    def queued(self, client):
+        return [x[0] for x in client._buffer]
+
+    def testDropOldest(self):
+        client = StreamingClient(maxFrames=3, bufferPolicy="drop-oldest")
+        self.assertEqual(self.fill(client, 5), [True] * 5)
+        self.assertEqual(self.queued(client), [b"2", b"3", b"4"])
+        self.assertEqual(client.stats()["dropped"], 2)
+
+    def testDropNewest(self):
+        client = StreamingClient(maxFrames=3, bufferPolicy="drop-newest")
+        self.assertEqual(self.fill(client, 5), [True, True, True, False, False])
+        self.assertEqual(self.queued(client), [b"0", b"1", b"2"])
+        self.assertEqual(client.stats()["dropped"], 2)
+
+    def testLatestOnly(self):
+        client = StreamingClient(maxFrames=30, bufferPolicy="latest-only")
+        self.fill(client, 5)
+        self.assertEqual(self.queued(client), [b"4"])
+
+    def testByteLimit(self):
+        client = StreamingClient(maxFrames=None, maxBytes=10)
+        for data in [b"aaaa", b"bbbb", b"cccc"]:
+            client.bufferStreamData(data)
+
+        self.assertEqual(self.queued(client), [b"bbbb", b"cccc"])
+        self.assertEqual(client.stats()["queuedBytes"], 8)
+
+        client.bufferStreamData(b"x" * 50) # A frame larger than the limit still replaces everything
+        self.assertEqual(self.queued(client), [b"x" * 50])
+
+    def testInvalidPolicy(self):
+        self.assertRaises(ValueError, StreamingClient, bufferPolicy="block")
+
+    def testSlowTransmitDoesNotGrowBuffer(self):
+        client = RecordingClient(maxFrames=2)
+        client.release.clear()
+        client.start()
+
+        client.bufferStreamData(b"first")
+        time.sleep(0.1) # The stream thread is now stuck sending "first"
+        self.fill(client, 10)
+        self.assertEqual(client.stats()["queuedFrames"], 2)
+
+        client.release.set()
+        for i in range(50):
+            if len(client.sent) == 3:
+                break
+            time.sleep(0.02)
+
+        self.assertEqual(client.sent, [b"first", b"8", b"9"])
+        self.assertEqual(client.stats()["framesSent"], 3)
+        client.stop()
+        client.streamThread.join(2)
+        self.assertFalse(client.streamThread.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
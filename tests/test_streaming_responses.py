@@ -0,0 +1,121 @@
+import http.client, os, socket, tempfile, unittest
+
+from karen.shared import parseHTTPRequestHead, KHTTPHandler
+
+class TestStreamingResponses(unittest.TestCase):
+    """
+    Chunked and ranged responses written by KHTTPHandler.
+    """
+
+    def setUp(self):
+        self.connect()
+        self.content = bytes(range(256)) * 8
+
+        fd, self.fileName = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(self.content)
+
+    def connect(self):
+        self.server, self.client = socket.socketpair()
+        self.client.settimeout(2)
+
+    def reconnect(self):
+        self.server.close()
+        self.client.close()
+        self.connect()
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+        os.remove(self.fileName)
+
+    def handler(self, headers=b"", version=b"HTTP/1.1"):
+        request = parseHTTPRequestHead(b"GET /clip " + version + b"\r\nHost: x\r\n" + headers + b"\r\n")
+        return KHTTPHandler(None, sock=self.server, request=request, origin="test", allowKeepAlive=True)
+
+    def response(self):
+        res = http.client.HTTPResponse(self.client, method="GET")
+        res.begin()
+        return res, res.read()
+
+    def testGeneratorIsChunked(self):
+        handler = self.handler()
+        self.assertTrue(handler.sendHTTP((x for x in [b"one", "", "two", bytearray(b"three")]), contentType="text/plain"))
+
+        res, body = self.response()
+        self.assertEqual(res.getheader("Transfer-Encoding"), "chunked")
+        self.assertIsNone(res.getheader("Content-Length"))
+        self.assertEqual(body, b"onetwothree")
+        self.assertTrue(handler.keepAlive)
+
+    def testFileObjectIsChunked(self):
+        with open(self.fileName, "rb") as fp:
+            self.handler().sendChunked(fp, chunkSize=100)
+
+        res, body = self.response()
+        self.assertEqual(body, self.content)
+
+    def testHTTP10ClosesInsteadOfChunking(self):
+        handler = self.handler(version=b"HTTP/1.0")
+        handler.sendChunked(iter([b"a", b"b"]))
+
+        res, body = self.response()
+        self.assertIsNone(res.getheader("Transfer-Encoding"))
+        self.assertEqual(body, b"ab")
+        self.assertFalse(handler.keepAlive)
+
+    def testFileBody(self):
+        with open(self.fileName, "rb") as fp:
+            fp.seek(10) # Sent from the current position
+            self.handler().sendHTTP(fp, contentType="audio/mp3")
+
+        res, body = self.response()
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader("Content-Length"), str(len(self.content) - 10))
+        self.assertEqual(body, self.content[10:])
+
+    def sendRange(self, rangeHeader, ifRange=None):
+        headers = b"Range: " + rangeHeader + b"\r\n"
+        if ifRange is not None:
+            headers += b"If-Range: " + ifRange + b"\r\n"
+
+        with open(self.fileName, "rb") as fp:
+            self.handler(headers).sendFile(fp, contentType="video/mp4", etag='"v1"')
+
+        return self.response()
+
+    def testRange(self):
+        res, body = self.sendRange(b"bytes=100-199")
+        self.assertEqual(res.status, 206)
+        self.assertEqual(res.getheader("Content-Range"), "bytes 100-199/" + str(len(self.content)))
+        self.assertEqual(body, self.content[100:200])
+
+    def testOpenEndedAndSuffixRanges(self):
+        res, body = self.sendRange(b"bytes=2000-")
+        self.assertEqual(body, self.content[2000:])
+
+        self.reconnect()
+        res, body = self.sendRange(b"bytes=-5")
+        self.assertEqual(body, self.content[-5:])
+
+        self.reconnect()
+        res, body = self.sendRange(b"bytes=2040-99999")
+        self.assertEqual(res.getheader("Content-Range"), "bytes 2040-2047/2048")
+
+    def testUnsatisfiableRange(self):
+        res, body = self.sendRange(b"bytes=4096-")
+        self.assertEqual(res.status, 416)
+        self.assertEqual(res.getheader("Content-Range"), "bytes */" + str(len(self.content)))
+        self.assertEqual(body, b"")
+
+    def testIfRange(self):
+        res, body = self.sendRange(b"bytes=0-9", b'"v1"')
+        self.assertEqual(res.status, 206)
+
+        self.reconnect()
+        res, body = self.sendRange(b"bytes=0-9", b'"v0"')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(body, self.content)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os, shutil, subprocess, tempfile, unittest
+
+from karen.shared import getHTTPSession, getTLSClientContext, sendHTTPRequest, closeHTTPSessions
+
+from .helpers import startContainer
+
+@unittest.skipIf(shutil.which("openssl") is None, "The openssl command is required to create a test certificate")
+class TestTLSSessionResumption(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        certFile = os.path.join(cls.folder, "cert.pem")
+        keyFile = os.path.join(cls.folder, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                        "-keyout", keyFile, "-out", certFile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        cls.container = startContainer(ssl_cert_file=certFile, ssl_key_file=keyFile)
+        cls.url = "https://127.0.0.1:" + str(cls.container.tcp_port) + "/device/e/echo"
+
+    @classmethod
+    def tearDownClass(cls):
+        closeHTTPSessions()
+        cls.container.stop()
+        cls.container.wait()
+        shutil.rmtree(cls.folder)
+
+    def setUp(self):
+        closeHTTPSessions()
+        self.context = getTLSClientContext()
+        with self.context._sessionLock:
+            self.context._sessions.clear()
+
+        self.resumed = []
+        def wrapSocket(*args, **kwargs):
+            conn = type(self.context).wrap_socket(self.context, *args, **kwargs)
+            self.resumed.append(conn.session_reused)
+            return conn
+
+        self.context.wrap_socket = wrapSocket # Records each new connection
+
+    def tearDown(self):
+        del self.context.wrap_socket
+
+    def request(self, headers=None):
+        res = getHTTPSession(self.url).post(self.url, data=b"hello", headers=headers, verify=False)
+        self.assertEqual(res.content, b"hello")
+
+    def testSessionIsResumed(self):
+        for i in range(3):
+            self.request({ "Connection": "close" }) # A new connection each time
+        self.assertEqual(self.resumed, [False, True, True])
+        self.assertEqual(len(self.context._sessions), 1)
+
+    def testPooledConnections(self):
+        self.request()
+        self.request()
+        self.assertEqual(self.resumed, [False]) # Kept alive
+
+        closeHTTPSessions()
+        self.request()
+        self.assertEqual(self.resumed, [False, True])
+
+    def testSendHTTPRequest(self):
+        self.assertTrue(sendHTTPRequest(self.url, jsonData={ "value": 1 })[0])
+        self.assertEqual(self.resumed, [False]) # Connected with the shared context
+        self.assertEqual(len(self.context._sessions), 1)
+
+if __name__ == "__main__":
+    unittest.main()
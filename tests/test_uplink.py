@@ -0,0 +1,126 @@
+import threading, time, unittest
+
+from karen.shared import BatchQueue, closeHTTPSessions
+from karen.templates import Container
+
+from .helpers import FakeBrain, freePort
+
+class TestBatchQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.sent = threading.Event()
+        self.result = True
+        self.queue = None
+
+    def tearDown(self):
+        if self.queue is not None:
+            self.queue.stop()
+
+    def send(self, batch):
+        self.batches.append(batch)
+        self.sent.set()
+        return self.result
+
+    def start(self, **kwargs):
+        self.queue = BatchQueue(self.send, **kwargs)
+        self.queue.start()
+        return self.queue
+
+    def testFullBatchIsSentRightAway(self):
+        queue = self.start(batchSize=3, batchWindow=10)
+        for i in range(3):
+            queue.put("EVENT", i)
+
+        self.assertTrue(self.sent.wait(2))
+        self.assertEqual(self.batches, [[{ "type": "EVENT", "data": 0 }, { "type": "EVENT", "data": 1 }, { "type": "EVENT", "data": 2 }]])
+
+    def testPartialBatchIsSentAfterWindow(self):
+        queue = self.start(batchSize=10, batchWindow=0.2)
+        start = time.time()
+        queue.put("EVENT", 1)
+
+        self.assertTrue(self.sent.wait(2))
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertEqual(len(self.batches[0]), 1)
+
+    def testCoalescedTypeKeepsLatestValueInPlace(self):
+        queue = self.start(batchSize=10, batchWindow=0.2, coalesce=["STATUS"])
+        queue.put("STATUS", "old")
+        queue.put("EVENT", 1)
+        queue.put("STATUS", "new")
+
+        self.assertTrue(self.sent.wait(2))
+        self.assertEqual(self.batches[0], [{ "type": "STATUS", "data": "new" }, { "type": "EVENT", "data": 1 }])
+        self.assertEqual(queue.stats()["coalesced"], 1)
+
+    def testOldestItemIsDroppedWhenFull(self):
+        queue = BatchQueue(self.send, batchSize=10, maxSize=3)
+        queue._isRunning = True # Accepts items without a sender thread
+        for i in range(5):
+            queue.put("EVENT", i)
+
+        self.assertEqual(queue.stats()["dropped"], 2)
+        queue.flush()
+        self.assertEqual([x["data"] for x in self.batches[0]], [2, 3, 4])
+
+    def testFailedBatchIsCounted(self):
+        self.result = False
+        queue = self.start(batchSize=1, batchWindow=10)
+        queue.put("EVENT", 1)
+
+        self.assertTrue(self.sent.wait(2))
+        time.sleep(0.05)
+        self.assertEqual(queue.stats()["failed"], 1)
+
+    def testStopSendsWaitingItems(self):
+        queue = self.start(batchSize=10, batchWindow=10)
+        queue.put("EVENT", 1)
+        queue.stop()
+
+        self.assertEqual(self.batches, [[{ "type": "EVENT", "data": 1 }]])
+        self.assertFalse(queue.put("EVENT", 2))
+
+class TestContainerUplink(unittest.TestCase):
+    """
+    callbackHandler events reach the brain's /brain/collect immediately or in batches.
+    """
+
+    def setUp(self):
+        self.brain = FakeBrain()
+
+    def tearDown(self):
+        closeHTTPSessions()
+        self.brain.close()
+
+    def container(self, **kwargs):
+        container = Container(tcp_port=freePort(), hostname="127.0.0.1", authentication={}, brain_url=self.brain.url, brain_cache_file=None, **kwargs)
+        container.isBrain = True # No registration requests in the way
+        return container
+
+    def testImmediate(self):
+        container = self.container()
+        self.assertTrue(container.callbackHandler("EVENT", { "n": 1 }))
+        self.assertEqual(self.brain.requests[0][0], "/brain/collect")
+        self.assertEqual(self.brain.requests[0][2], { "type": "EVENT", "data": { "n": 1 } })
+
+    def testBatched(self):
+        container = self.container(uplink_batch_size=5, uplink_batch_window=0.2, uplink_coalesce=["STATUS"])
+        container.start()
+        try:
+            for i in range(3):
+                container.callbackHandler("STATUS", i)
+                container.callbackHandler("EVENT", i)
+
+            time.sleep(0.6)
+            self.assertEqual(len(self.brain.requests), 1)
+            path, headers, body = self.brain.requests[0]
+            self.assertEqual(body["type"], "BATCH")
+            self.assertEqual(body["data"], [{ "type": "STATUS", "data": 2 }, { "type": "EVENT", "data": 0 }, { "type": "EVENT", "data": 1 }, { "type": "EVENT", "data": 2 }])
+            self.assertEqual(container.uplinkStatus()["sent"], 4)
+        finally:
+            container.stop()
+            container.wait()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import time, unittest
+
+from karen.shared import UPNPServer
+
+class Parent(object):
+    id = "container-1"
+    version = "0.7.1"
+    use_http = True
+    tcp_port = 8080
+    isBrain = True
+
+class FakeUDPSocket(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, destination):
+        self.sent.append((data, destination))
+
+class TestUPNPServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = UPNPServer(parent=Parent(), usn="uuid:brain::upnp:rootdevice", location="http://10.0.0.2:8080", cache_control="max-age=100")
+        self.sock = FakeUDPSocket()
+        self.server._serverSocket = self.sock
+
+    def register(self, usn="uuid:speaker", st="urn:karen:speaker"):
+        self.server.register(usn, st, "http://10.0.0.3:8081", cache_control="max-age=60")
+        self.sock.sent = []
+        return usn
+
+    def testRegister(self):
+        usn = self.register()
+        self.assertEqual(self.server._byST["urn:karen:speaker"], [usn])
+        self.assertEqual(self.server._maxAge[usn], 60)
+        self.assertIn(b"LOCATION: http://10.0.0.3:8081\r\n", self.server._payloads[usn]["response"])
+        self.assertIn(b"NT: urn:karen:speaker\r\n", self.server._payloads[usn]["alive"])
+        self.assertIn(b"X-KAREN-TYPE: BRAIN\r\n", self.server._payloads["uuid:brain::upnp:rootdevice"]["alive"])
+
+        due = self.server._announceDue[usn] - time.time()
+        self.assertTrue(60 * 0.4 - 1 < due <= 60 * 0.5) # Re-announced before peers' entries expire
+
+    def testSearch(self):
+        usn = self.register()
+        self.server._search({ "ST": "urn:karen:speaker", "MX": "1" }, "10.0.0.9", 1900)
+        self.server._search({ "ST": "urn:karen:missing", "MX": "1" }, "10.0.0.9", 1900)
+        self.server._search({ "ST": "ssdp:all", "MX": "1" }, "10.0.0.8", 1900)
+
+        queued = [(x[3], x[4]) for x in self.server._scheduled if x[2] == "response"]
+        self.assertEqual(sorted(queued), sorted([(usn, ("10.0.0.9", 1900)), (usn, ("10.0.0.8", 1900)), ("uuid:brain::upnp:rootdevice", ("10.0.0.8", 1900))]))
+
+        time.sleep(1.05)
+        self.server._sendScheduled()
+        self.assertEqual(len(self.sock.sent), 3)
+        self.assertTrue(all(x[0].startswith(b"HTTP/1.1 200 OK\r\n") and b"\r\nDATE: " in x[0] for x in self.sock.sent))
+
+    def testUnregister(self):
+        usn = self.register()
+        self.server._schedule(0, "response", usn, ("10.0.0.9", 1900))
+        self.server._schedule(0, "alive", usn, None)
+
+        self.assertTrue(self.server.unregister(usn))
+        self.assertEqual(len(self.sock.sent), 1)
+        self.assertIn(b"NTS: ssdp:byebye\r\n", self.sock.sent[0][0])
+
+        for table in [self.server.services, self.server._payloads, self.server._maxAge, self.server._announceDue]:
+            self.assertNotIn(usn, table)
+        self.assertNotIn("urn:karen:speaker", self.server._byST)
+        self.assertFalse(any(x[3] == usn for x in self.server._scheduled))
+
+        self.server._sendScheduled()
+        self.assertEqual(len(self.sock.sent), 1) # Nothing else went out for the removed service
+        self.assertTrue(self.server.unregister(usn)) # Already gone
+
+    def testQueuedMessagesForUnknownServicesAreSkipped(self):
+        usn = self.register()
+        del self.server.services[usn]
+        self.server._schedule(0, "response", usn, ("10.0.0.9", 1900))
+
+        self.server._sendScheduled()
+        self.assertEqual(self.sock.sent, [])
+
+if __name__ == "__main__":
+    unittest.main()
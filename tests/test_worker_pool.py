@@ -0,0 +1,122 @@
+import socket, threading, time, unittest
+
+from karen.shared import WorkerPool
+
+from .helpers import startContainer, exchange
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.stop(wait=True)
+
+    def testRunsTasksOnReusedThreads(self):
+        self.pool = WorkerPool(size=2, queueSize=10)
+        done = threading.Semaphore(0)
+        names = set()
+
+        def task():
+            names.add(threading.current_thread().name)
+            done.release()
+
+        for i in range(20):
+            self.assertTrue(self.pool.submit(task))
+            time.sleep(0.001)
+        for i in range(20):
+            self.assertTrue(done.acquire(timeout=2))
+
+        self.assertLessEqual(len(names), 2)
+        stats = self.pool.stats()
+        self.assertEqual(stats["submitted"], 20)
+        self.assertLessEqual(stats["workers"], 2)
+
+    def testRejectsWhenQueueIsFull(self):
+        self.pool = WorkerPool(size=1, queueSize=1, overflow="reject")
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        self.assertTrue(self.pool.submit(block))
+        self.assertTrue(started.wait(2))
+        self.assertTrue(self.pool.submit(block)) # Waits in the queue
+        self.assertFalse(self.pool.submit(block))
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+        release.set()
+
+    def testBlocksWhenQueueIsFull(self):
+        self.pool = WorkerPool(size=1, queueSize=1, overflow="block")
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        self.pool.submit(block)
+        started.wait(2)
+        self.pool.submit(block)
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: self.pool.submit(block) and submitted.set(), daemon=True).start()
+        self.assertFalse(submitted.wait(0.2))
+
+        release.set()
+        self.assertTrue(submitted.wait(2))
+
+    def testFailedTaskKeepsWorker(self):
+        self.pool = WorkerPool(size=1, queueSize=5)
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError("expected")
+
+        self.pool.submit(fail)
+        self.pool.submit(done.set)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(self.pool.stats()["failed"], 1)
+
+    def testStop(self):
+        self.pool = WorkerPool(size=2, queueSize=5)
+        self.pool.submit(time.sleep, 0.1)
+        self.pool.stop(wait=True)
+        self.assertFalse(self.pool.submit(time.sleep, 0))
+        self.assertEqual(self.pool.stats()["completed"], 1)
+
+    def testInvalidOverflow(self):
+        self.assertRaises(ValueError, WorkerPool, overflow="drop")
+
+class TestContainerPool(unittest.TestCase):
+    """
+    Saturated containers answer 503 instead of spawning a thread per connection.
+    """
+
+    def testBusy(self):
+        container = startContainer(pool_size=1, pool_queue_size=1)
+        try:
+            slow = socket.create_connection(("127.0.0.1", container.tcp_port))
+            slow.sendall(b"GET /device/e/slow HTTP/1.1\r\nHost: x\r\n\r\n")
+            time.sleep(0.1)
+            queued = socket.create_connection(("127.0.0.1", container.tcp_port)) # Waits for the only worker
+            time.sleep(0.1)
+
+            data, closed = exchange(container.tcp_port, b"GET /device/e/ignore HTTP/1.1\r\nHost: x\r\n\r\n")
+            self.assertTrue(data.startswith(b"HTTP/1.1 503 "))
+            self.assertIn(b"Retry-After: 1", data)
+
+            slow.settimeout(2)
+            self.assertIn(b"200 OK", slow.recv(65536))
+            slow.close()
+            queued.close()
+            self.assertEqual(container.poolStatus()["rejected"], 1)
+        finally:
+            container.stop()
+            container.wait()
+
+if __name__ == "__main__":
+    unittest.main()